@@ -0,0 +1,64 @@
+"""
+Compares Selector.query latency against the previous DataFrame.query based implementation.
+
+Usage: python benchmarks/bench_query.py data/processed/TCAD --zip-codes 78733 78741 --bldg-types "1 FAM DWELLING"
+"""
+import argparse
+import statistics
+import time
+
+from tcad.selector import Selector, filter_zip, filter_bldg_type
+
+def legacy_query(selector,zip_codes=None,bldg_types=None):
+    """ Selector.query before the indexed semi-joins, returns the four filtered tables. """
+    prop_df = filter_zip(selector.prop_df,zip_codes) if zip_codes else selector.prop_df
+    imp_info_df = filter_bldg_type(selector.imp_info_df,bldg_types) if bldg_types else selector.imp_info_df
+    imp_det_df = selector.imp_det_df
+    imp_atr_df = selector.imp_atr_df
+
+    prop_ids = list(set(prop_df['prop_id']).intersection(imp_info_df['prop_id']))
+    imprv_ids = imp_info_df['imprv_id']
+
+    query1 = "prop_id in @prop_ids"
+    query2 = query1 + " and imprv_id in @imprv_ids"
+
+    return (prop_df.query(query1),imp_info_df.query(query2),imp_det_df.query(query2),imp_atr_df.query(query2))
+
+def timed(func,repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+    return statistics.median(times)
+
+def materialized(selector):
+    return selector.prop_df,selector.imp_info_df,selector.imp_det_df,selector.imp_atr_df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir')
+    parser.add_argument('--zip-codes',nargs='+',default=None)
+    parser.add_argument('--bldg-types',nargs='+',default=None)
+    parser.add_argument('--repeat',type=int,default=20)
+    args = parser.parse_args(argv)
+
+    tables = Selector(args.data_dir)
+    materialized(tables)
+
+    start = time.perf_counter()
+    tables.query(args.zip_codes,args.bldg_types)
+    first = time.perf_counter()-start
+
+    results = {
+        'legacy query':timed(lambda:legacy_query(tables,args.zip_codes,args.bldg_types),args.repeat),
+        'indexed query (first call, builds indexes)':first,
+        'indexed query':timed(lambda:tables.query(args.zip_codes,args.bldg_types),args.repeat),
+        'indexed query + materialize tables':timed(lambda:materialized(tables.query(args.zip_codes,args.bldg_types)),args.repeat),
+    }
+    for name,seconds in results.items():
+        print(f'{name:<45}{seconds*1000:>10.2f} ms')
+    return results
+
+if __name__ == '__main__':
+    main()
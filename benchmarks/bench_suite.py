@@ -0,0 +1,147 @@
+"""
+Measures wall time and peak memory of the parse_* functions, Selector and its main methods on a synthetic
+export (see synthetic.py) or a real one, and saves the results so runs can be compared across commits.
+
+Each benchmark runs once under tracemalloc for its peak memory (memory allocated on top of what its setup
+left behind, memory mapped files are not counted) and then --repeat times without it for the wall time.
+
+Results are written to <results-dir>/<label>.json, the label defaults to `git describe --always --dirty`.
+
+Usage:
+    python benchmarks/bench_suite.py --properties 50000
+    python benchmarks/bench_suite.py --properties 50000 --compare benchmarks/results/<other label>.json
+"""
+import argparse
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime,timezone
+from pathlib import Path
+
+import fastparquet
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0,str(Path(__file__).parent))
+from synthetic import generate_export
+from tcad import tparser
+from tcad.selector import SINGLE_FAMILY,Selector
+
+PARSERS = {'PROP':tparser.parse_property_details,'IMP_INFO':tparser.parse_improvement_info,
+           'IMP_DET':tparser.parse_improvement_details,'IMP_ATR':tparser.parse_improvement_features}
+
+def measure(func,setup=None,repeat=3):
+    """ Median and minimum wall time over repeat runs and peak traced memory of one run, in seconds and bytes. """
+    state = setup() if setup else None
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    func(state)
+    peak = tracemalloc.get_traced_memory()[1]-base
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        func(state)
+        times.append(time.perf_counter()-start)
+    return statistics.median(times),min(times),peak
+
+def materialized(selector):
+    selector.prop_df,selector.imp_info_df,selector.imp_det_df,selector.imp_atr_df
+    return selector
+
+def benchmarks(export_dir,data_dir,*,engines,zip_codes,bldg_types):
+    """ (name,setup,func) of every benchmark, func gets what setup returned. """
+    runs = []
+    for table,parse in PARSERS.items():
+        input_file = tparser.find_export_file(export_dir,tparser.TABLES[table])
+        for engine in engines:
+            runs.append((f'{parse.__name__}[{engine}]',None,lambda _,parse=parse,input_file=input_file,engine=engine:parse(input_file,engine=engine)))
+    county = lambda:materialized(Selector(data_dir).query(bldg_types=[SINGLE_FAMILY]))
+    runs += [
+        ('Selector.__init__',None,lambda _:Selector(data_dir)),
+        ('Selector tables',lambda:Selector(data_dir),materialized),
+        ('Selector.query',lambda:materialized(Selector(data_dir)),lambda tables:materialized(tables.query(zip_codes,bldg_types))),
+        ('Selector(zip_codes,bldg_types)',None,lambda _:materialized(Selector(data_dir,zip_codes=zip_codes,bldg_types=bldg_types))),
+        ('unstack_improvement_details_table',county,lambda tables:tables.unstack_improvement_details_table()),
+        ('unstack_improvement_attributes_table',county,lambda tables:tables.unstack_improvement_attributes_table()),
+        ('get_single_family_building_summary[stored]',lambda:Selector(data_dir),lambda tables:tables.get_single_family_building_summary()),
+        ('get_single_family_building_summary[built]',lambda:materialized(Selector(data_dir)).copy(),
+         lambda tables:tables.get_single_family_building_summary()),
+    ]
+    return runs
+
+def git_label():
+    try:
+        return subprocess.run(['git','describe','--always','--dirty'],capture_output=True,text=True,check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return datetime.now().strftime('%Y%m%d-%H%M%S')
+
+def compare(results,baseline):
+    """ Both runs side by side, ratio > 1 means the current run is slower or uses more memory. """
+    current = pd.DataFrame(results['results']).set_index('name')
+    other = pd.DataFrame(baseline['results']).set_index('name')
+    df = pd.DataFrame({'seconds':current['seconds'],f"seconds {baseline['label']}":other['seconds'],
+                       'peak_mb':current['peak_mb'],f"peak_mb {baseline['label']}":other['peak_mb']})
+    df = df.reindex([*current.index,*other.index.difference(current.index)])
+    df['time ratio'] = df['seconds']/df[f"seconds {baseline['label']}"]
+    df['memory ratio'] = df['peak_mb']/df[f"peak_mb {baseline['label']}"]
+    return df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--export-dir',default=None,help='Export to benchmark (directory or zip), a synthetic one is generated if not given')
+    parser.add_argument('--properties',type=int,default=50_000,help='Size of the synthetic export')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--work-dir',default='data/benchmarks',help='Where the synthetic export and its parquet tables are kept')
+    parser.add_argument('--results-dir',default=str(Path(__file__).parent/'results'))
+    parser.add_argument('--label',default=None)
+    parser.add_argument('--engines',nargs='+',default=['numpy','fwf'])
+    parser.add_argument('--zip-codes',nargs='+',default=['78741','78733'])
+    parser.add_argument('--bldg-types',nargs='+',default=[SINGLE_FAMILY])
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--only',nargs='+',default=None,help='Only run benchmarks whose name starts with one of these')
+    parser.add_argument('--compare',default=None,help='Results file of another run to compare with')
+    args = parser.parse_args(argv)
+
+    work_dir = Path(args.work_dir)
+    export_dir = args.export_dir
+    if export_dir is None:
+        export_dir = work_dir/f'export_{args.properties}_{args.seed}'
+        if not (export_dir/'rows.json').exists():
+            rows = generate_export(export_dir,args.properties,seed=args.seed)
+            (export_dir/'rows.json').write_text(json.dumps({table:int(count) for table,count in rows.items()}))
+    data_dir = work_dir/f'tables_{Path(export_dir).stem}'
+    # Tables for the Selector benchmarks, parsed once per export
+    if not (data_dir/'SF_SUMMARY.parquet').exists():
+        tparser.ingest(export_dir,data_dir)
+
+    results = {'label':args.label or git_label(),'created':datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'export':str(export_dir),'properties':args.properties if args.export_dir is None else None,
+               'rows':{table:fastparquet.ParquetFile(str(data_dir/f'{table}.parquet')).count() for table in tparser.TABLES},
+               'python':platform.python_version(),'numpy':np.__version__,'pandas':pd.__version__,'repeat':args.repeat,'results':[]}
+    for name,setup,func in benchmarks(export_dir,data_dir,engines=args.engines,zip_codes=args.zip_codes,bldg_types=args.bldg_types):
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        seconds,min_seconds,peak = measure(func,setup,args.repeat)
+        results['results'].append({'name':name,'seconds':seconds,'min_seconds':min_seconds,'peak_mb':peak/2**20})
+        print(f'{name:<45}{seconds*1000:>12.1f} ms {peak/2**20:>10.1f} MB',flush=True)
+
+    path = Path(args.results_dir)/f"{results['label']}.json"
+    path.parent.mkdir(parents=True,exist_ok=True)
+    path.write_text(json.dumps(results,indent=1))
+    print(f'Saved {path}')
+    if args.compare:
+        print(compare(results,json.loads(Path(args.compare).read_text())).to_string(float_format='{:.3f}'.format))
+    return results
+
+if __name__ == '__main__':
+    main()
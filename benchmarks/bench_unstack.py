@@ -0,0 +1,86 @@
+"""
+Compares the Selector.unstack_* methods against the previous pivot_table/pivot based implementations
+and checks that both give the same tables.
+
+Usage: python benchmarks/bench_unstack.py data/processed/TCAD --bldg-types "1 FAM DWELLING"
+"""
+import argparse
+import statistics
+import time
+
+import pandas as pd
+
+from tcad.selector import Selector
+
+def legacy_unstack_improvement_details_table(imp_det_df):
+    """ Selector.unstack_improvement_details_table before the single pass version. """
+    floor_codes = ['1ST','2ND','3RD','4TH','5TH','ADDL']
+    floor_labels = {floor:floor+'_floor_area' for floor in floor_codes}
+
+    filtered_df = imp_det_df[imp_det_df['Imprv_det_type_cd'].isin(floor_codes+['095'])].copy()
+    filtered_df['Imprv_det_type_cd'] = filtered_df['Imprv_det_type_cd'].cat.remove_unused_categories()
+
+    pivoted_df = (filtered_df.pivot_table(index=['imprv_id'],columns='Imprv_det_type_cd',values='imprv_det_area',aggfunc='sum')
+                .rename(columns={'095':'HVAC_area',**floor_labels}))
+    pivoted_df.columns.name=None
+
+    floor_labels_in_table = [label for label in floor_labels.values() if label in pivoted_df.columns]
+    pivoted_df['num_floors']=(pivoted_df[floor_labels_in_table]>0).sum(axis=1)
+    pivoted_df['highest_floor']=pivoted_df[floor_labels_in_table].iloc[:,::-1].replace(0,pd.NA).isnull().idxmin(axis=1).str.replace('_floor_area','')
+    pivoted_df['main_area']=pivoted_df[floor_labels_in_table].sum(axis=1)
+    pivoted_df['yr_built']=filtered_df.groupby('imprv_id')['yr_built'].min()
+    return pivoted_df
+
+def legacy_unstack_improvement_attributes_table(imp_atr_df,imp_det_df):
+    """ Selector.unstack_improvement_attributes_table before the code based version. """
+    drop_cols = [col for col in ['Unique Feature', 'Location', 'Condo Floor', 'CDU','Multi Imp'] if col in imp_atr_df['imprv_attr_desc']]
+
+    pivoted_df = (imp_atr_df.drop_duplicates(subset=['prop_id','prop_val_yr','imprv_id','imprv_det_id','imprv_attr_desc'],keep=False)
+                            .pivot(index='imprv_det_id',columns='imprv_attr_desc',values='imprv_attr_cd')
+                            .drop(columns=drop_cols))
+    pivoted_df.columns.name=None
+
+    filtered_df = pivoted_df[pivoted_df['Floor Factor'].isin(['1ST','2ND','3RD','4TH','5TH'])]
+    merged_df = filtered_df.reset_index().merge(imp_det_df[['prop_id','imprv_det_id','imprv_id','imprv_det_area']],how='left',left_on='imprv_det_id',right_on='imprv_det_id')
+
+    return (merged_df.sort_values(['prop_id','imprv_id','Floor Factor','imprv_det_area'],ascending=[True,True,True,False])
+                     .drop_duplicates(subset=['prop_id','imprv_id','Floor Factor'])
+                     .groupby('imprv_id').first()
+                     .drop(columns=['prop_id','imprv_det_id','Floor Factor','imprv_det_area']))
+
+def timed(func,repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter()-start)
+    return statistics.median(times),result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir')
+    parser.add_argument('--zip-codes',nargs='+',default=None)
+    parser.add_argument('--bldg-types',nargs='+',default=None)
+    parser.add_argument('--repeat',type=int,default=5)
+    args = parser.parse_args(argv)
+
+    tables = Selector(args.data_dir)
+    if args.zip_codes or args.bldg_types:
+        tables = tables.query(args.zip_codes,args.bldg_types)
+    imp_det_df,imp_atr_df = tables.imp_det_df,tables.imp_atr_df
+
+    runs = {
+        'details':(lambda:legacy_unstack_improvement_details_table(imp_det_df),tables.unstack_improvement_details_table),
+        'attributes':(lambda:legacy_unstack_improvement_attributes_table(imp_atr_df,imp_det_df),tables.unstack_improvement_attributes_table),
+    }
+    results = {}
+    for name,(legacy,current) in runs.items():
+        legacy_seconds,expected = timed(legacy,args.repeat)
+        seconds,result = timed(current,args.repeat)
+        pd.testing.assert_frame_equal(result,expected)
+        results[name] = (legacy_seconds,seconds)
+        print(f'{name:<12}legacy {legacy_seconds*1000:>10.2f} ms   current {seconds*1000:>10.2f} ms   {legacy_seconds/seconds:>6.1f}x')
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Writes a synthetic TCAD export (PROP.TXT, IMP_INFO.TXT, IMP_DET.TXT and IMP_ATR.TXT) for benchmarking
+without the real export.
+
+Every table follows its layout schema (tparser.load_schema): each field is written at its offsets,
+numbers right aligned and text left aligned. The fields the parsers and Selector use get realistic values
+(Travis County zip codes, building types, floor details and their Floor Factor attributes), every other
+field gets random values of its type. Properties are written in chunks so memory does not depend on the scale.
+
+Usage: python benchmarks/synthetic.py data/synthetic/50k --properties 50000
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tcad import tparser
+
+ZIP_CODES = [str(zip_code) for zip_code in [*range(78701,78706),*range(78717,78760),78610,78613,78617,78620,78621,78641,78645,78652,78653,78660,78664,78669,78681]]
+STREET_WORDS = ['OAK','ELM','CEDAR','PECAN','WILLOW','RIVER','HILL','CREEK','VALLEY','RIDGE','MEADOW','SPRING','LAKE','MESA','BLUFF',
+                'BLUEBONNET','LAMAR','BURNET','MANCHACA','SLAUGHTER','PARMER','RUNDBERG','OLTORF','BARTON','CONGRESS','SHOAL','WALNUT','MOPAC']
+STREET_SUFFIXES = ['DR','ST','LN','RD','CV','BLVD','TRL','CT','WAY','PASS','LOOP','PL']
+
+# (imprv_type_cd, imprv_type_desc, share)
+IMPRV_TYPES = [('1','1 FAM DWELLING',0.70),('MH','MOHO SINGLE',0.04),('2','2 FAM DWELLING',0.04),('C','CONDO (STACKED)',0.06),
+               ('TH','TOWNHOMES',0.03),('APT','APARTMENT 5-25',0.02),('COM','OFFICE (SMALL)',0.06),('OB','OUTBUILDING',0.05)]
+# (Imprv_det_type_cd, Imprv_det_type_desc, share of the details after the first floor)
+DETAIL_TYPES = [('2ND','2nd Floor',0.08),('3RD','3rd Floor',0.01),('ADDL','Additional Floor',0.01),('095','HVAC RESIDENTIAL',0.22),
+                ('011','PORCH OPEN 1ST F',0.22),('041','GARAGE ATT 1ST F',0.20),('251','BATHROOM',0.14),('522','FIREPLACE',0.06),('612','TERRACE UNCOVERD',0.06)]
+FLOORS = {'1ST','2ND','3RD','4TH','5TH','ADDL'}
+# imprv_attr_desc and its codes, Floor Factor comes first on floor details
+ATTRIBUTES = {'Floor Factor':['1ST','2ND','3RD'],'Foundation':['SLAB','PIER AND B','WOOD POST'],
+              'Roof Covering':['COMPOSITIO','METAL','TILE','WOOD SHING'],'Roof Style':['GABLE','HIP','FLAT'],
+              'Grade Factor':['A','B','C','X'],'Shape Factor':['L','U','SQ'],'Ceiling Factor':['8','9','10'],
+              'Exterior Wall':['BRICK','FRAME','STONE','STUCCO'],'HVAC':['CENTRAL','NONE','WINDOW'],'Plumbing':['2.0','2.5','3.0'],
+              'CDU':['AV','GD'],'Location':['INT','CORNER']}
+
+def _digits(values,width,blank=None):
+    """ Right aligned decimal text of non negative integers as a (rows,width) byte array, blank rows are spaces. """
+    rest = np.asarray(values,dtype='int64').copy()
+    out = np.full((len(rest),width),ord(' '),dtype=np.uint8)
+    for j in range(width-1,-1,-1):
+        out[:,j] = np.where((rest > 0) | (j == width-1),ord('0')+rest%10,ord(' '))
+        rest //= 10
+    if blank is not None:
+        out[blank] = ord(' ')
+    return out
+
+def _text(vocab,width,right=False):
+    """ One fixed width byte row per value of a vocabulary, cut to width. """
+    rows = [value.encode('latin-1')[:width] for value in vocab]
+    rows = [row.rjust(width) if right else row.ljust(width) for row in rows]
+    return np.frombuffer(b''.join(rows),dtype=np.uint8).reshape(len(vocab),width)
+
+def _random_field(rng,n,width,dtype):
+    """ Values for a field the benchmarks do not care about: mostly blank, otherwise one of a few random values. """
+    blank = rng.random(n) < 0.5
+    if dtype == 'category':
+        letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+        vocab = [''.join(rng.choice(letters,min(width,rng.integers(1,9)))) for _ in range(16)]
+        block = _text(vocab,width)[rng.integers(0,len(vocab),n)]
+    elif dtype.startswith('Float'):
+        vocab = [f'{value:.2f}' for value in rng.random(64)*10.0**min(width-4,6)]
+        block = _text(vocab,width,right=True)[rng.integers(0,len(vocab),n)]
+    else:
+        block = _digits(rng.integers(0,10**min(width-1,6),n),width)
+    block[blank] = ord(' ')
+    return block
+
+def _records(layout,n,fields,rng):
+    """ Fixed width records of a table as a (rows,width+1) byte array ending in newlines. fields holds numbers or byte blocks. """
+    width = max(end for _,end in layout['col_spec'])
+    records = np.full((n,width+1),ord(' '),dtype=np.uint8)
+    records[:,-1] = ord('\n')
+    for name,(start,end),dtype in zip(layout['Field Name'],layout['col_spec'],layout['dtype']):
+        if name in fields:
+            value = fields[name]
+            records[:,start:end] = _digits(value,end-start) if value.ndim == 1 else value
+        else:
+            records[:,start:end] = _random_field(rng,n,end-start,dtype)
+    return records
+
+def _vocab(rng,vocab,n,p=None,width=None):
+    """ A block of values drawn from a vocabulary (with shares p), and the drawn positions. """
+    idx = rng.choice(len(vocab),n,p=p)
+    return _text(vocab,width)[idx],idx
+
+def _chunk(layouts,rng,prop_ids,next_ids,year,improvements,details,attributes,streets):
+    """ Records of the four tables for one chunk of properties. next_ids holds the next imprv, detail and attribute ids. """
+    n = len(prop_ids)
+    widths = {table:dict(zip(layout['Field Name'],[end-start for start,end in layout['col_spec']])) for table,layout in layouts.items()}
+    tables = {}
+
+    w = widths['PROP']
+    prop = {'prop_id':prop_ids,'prop_val_yr':np.full(n,year)}
+    prop['situs_num'] = _text([str(num) for num in rng.integers(1,20000,256)],w.get('situs_num',0))[rng.integers(0,256,n)]
+    prop['situs_street'] = _vocab(rng,streets,n,width=w.get('situs_street',0))[0]
+    prop['situs_street_prefx'] = _vocab(rng,['','N','S','E','W'],n,p=[0.8,0.05,0.05,0.05,0.05],width=w.get('situs_street_prefx',0))[0]
+    prop['situs_street_suffix'] = _vocab(rng,STREET_SUFFIXES,n,width=w.get('situs_street_suffix',0))[0]
+    prop['situs_city'] = _vocab(rng,['AUSTIN','PFLUGERVILLE','LAKEWAY','MANOR','DEL VALLE'],n,p=[0.8,0.08,0.05,0.04,0.03],width=w.get('situs_city',0))[0]
+    prop['situs_zip'] = _vocab(rng,ZIP_CODES,n,width=w.get('situs_zip',0))[0]
+    prop['prop_type_cd'] = _vocab(rng,['R','P','MH','MN'],n,p=[0.88,0.08,0.03,0.01],width=w.get('prop_type_cd',0))[0]
+    tables['PROP'] = _records(layouts['PROP'],n,{name:value for name,value in prop.items() if name in w},rng)
+
+    # Improvements per property, land only properties have none
+    per_prop = rng.poisson(improvements,n)
+    info_props = np.repeat(prop_ids,per_prop)
+    m = len(info_props)
+    imprv_ids = next_ids[0]+np.arange(m)
+    w = widths['IMP_INFO']
+    type_idx = rng.choice(len(IMPRV_TYPES),m,p=[share for _,_,share in IMPRV_TYPES])
+    info = {'prop_id':info_props,'prop_val_yr':np.full(m,year),'imprv_id':imprv_ids,
+            'imprv_type_cd':_text([cd for cd,_,_ in IMPRV_TYPES],w.get('imprv_type_cd',0))[type_idx],
+            'imprv_type_desc':_text([desc for _,desc,_ in IMPRV_TYPES],w.get('imprv_type_desc',0))[type_idx],
+            'imprv_val':rng.integers(1000,900_000,m)}
+    tables['IMP_INFO'] = _records(layouts['IMP_INFO'],m,{name:value for name,value in info.items() if name in w},rng)
+
+    # Details per improvement, the first one is always the first floor
+    per_imprv = 1+rng.poisson(max(details-1,0),m)
+    det_props,det_imprvs = np.repeat(info_props,per_imprv),np.repeat(imprv_ids,per_imprv)
+    q = len(det_imprvs)
+    det_ids = next_ids[1]+np.arange(q)
+    first = np.cumsum(per_imprv)-per_imprv
+    codes = [('1ST','1st Floor')]+[(cd,desc) for cd,desc,_ in DETAIL_TYPES]
+    code_idx = 1+rng.choice(len(DETAIL_TYPES),q,p=[share for _,_,share in DETAIL_TYPES])
+    code_idx[first] = 0
+    floor = np.isin(np.array([cd for cd,_ in codes])[code_idx],list(FLOORS))
+    w = widths['IMP_DET']
+    det = {'prop_id':det_props,'prop_val_yr':np.full(q,year),'imprv_id':det_imprvs,'imprv_det_id':det_ids,
+           'Imprv_det_type_cd':_text([cd for cd,_ in codes],w.get('Imprv_det_type_cd',0))[code_idx],
+           'Imprv_det_type_desc':_text([desc for _,desc in codes],w.get('Imprv_det_type_desc',0))[code_idx],
+           'Imprv_det_class_cd':_vocab(rng,['WW4','WW5','WW3','R4','R5'],q,width=w.get('Imprv_det_class_cd',0))[0],
+           'yr_built':np.repeat(np.clip(rng.normal(1990,20,m).astype('int64'),1900,year),per_imprv),
+           'depreciation_yr':np.full(q,year),
+           'imprv_det_area':np.where(floor,rng.integers(400,2500,q),rng.integers(20,800,q)),
+           'imprv_det_val':rng.integers(0,400_000,q)}
+    tables['IMP_DET'] = _records(layouts['IMP_DET'],q,{name:value for name,value in det.items() if name in w},rng)
+
+    # Attributes per detail, floor details start with their Floor Factor. A few are duplicated like in the export.
+    descs = list(ATTRIBUTES)
+    per_det = np.clip(rng.poisson(attributes,q),1,len(descs))
+    atr_det = np.repeat(np.arange(q),per_det)
+    atr_desc = np.arange(len(atr_det))-np.repeat(np.cumsum(per_det)-per_det,per_det)
+    # Details that are not floors skip the Floor Factor
+    atr_desc = np.where(floor[atr_det] | (atr_desc != 0),atr_desc,len(descs)-1)
+    dupes = rng.random(len(atr_det)) < 0.02
+    atr_det,atr_desc = np.r_[atr_det,atr_det[dupes]],np.r_[atr_desc,atr_desc[dupes]]
+    order = np.argsort(atr_det,kind='stable')
+    atr_det,atr_desc = atr_det[order],atr_desc[order]
+    r = len(atr_det)
+    attr_codes = sorted({code for values in ATTRIBUTES.values() for code in values}|{cd for cd,_ in codes})
+    code_pos = {code:i for i,code in enumerate(attr_codes)}
+    attr_code = np.empty(r,dtype='int64')
+    for i,(desc,values) in enumerate(ATTRIBUTES.items()):
+        rows = atr_desc == i
+        attr_code[rows] = np.array([code_pos[value] for value in values])[rng.integers(0,len(values),rows.sum())]
+    floor_factor = atr_desc == 0
+    attr_code[floor_factor] = np.array([code_pos[cd] for cd,_ in codes])[code_idx[atr_det[floor_factor]]]
+    w = widths['IMP_ATR']
+    atr = {'prop_id':det_props[atr_det],'prop_val_yr':np.full(r,year),'imprv_id':det_imprvs[atr_det],'imprv_det_id':det_ids[atr_det],
+           'imprv_attr_id':next_ids[2]+np.arange(r),
+           'imprv_attr_desc':_text(descs,w.get('imprv_attr_desc',0))[atr_desc],
+           'imprv_attr_cd':_text(attr_codes,w.get('imprv_attr_cd',0))[attr_code],
+           'imprv_attr_val':rng.integers(0,100,r)}
+    tables['IMP_ATR'] = _records(layouts['IMP_ATR'],r,{name:value for name,value in atr.items() if name in w},rng)
+
+    next_ids += [m,q,r]
+    return tables
+
+def generate_export(out_dir,properties=50_000,*,seed=0,year=2023,improvements=1.2,details=5.0,attributes=6.0,chunksize=10_000):
+    """
+    Writes a synthetic export with `properties` properties to out_dir and returns the number of records per table.
+
+    improvements is the mean number of improvements per property, details the mean number of details per
+    improvement and attributes the mean number of attributes per detail.
+    """
+    rng = np.random.default_rng(seed)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True,exist_ok=True)
+    layouts = {table:tparser.load_schema(table,filter=False) for table in tparser.TABLES}
+    streets = sorted({f'{a} {b}' if a != b else a for a in STREET_WORDS for b in rng.choice(STREET_WORDS,8)})
+    counts = dict.fromkeys(tparser.TABLES,0)
+    next_ids = np.array([1_000_000,10_000_000,100_000_000])
+    files = {table:open(out_dir/filename,'wb') for table,filename in tparser.TABLES.items()}
+    try:
+        for start in range(0,properties,chunksize):
+            prop_ids = 100_000+np.arange(start,min(start+chunksize,properties))
+            for table,records in _chunk(layouts,rng,prop_ids,next_ids,year,improvements,details,attributes,streets).items():
+                files[table].write(records.tobytes())
+                counts[table] += len(records)
+    finally:
+        for f in files.values():
+            f.close()
+    return pd.Series(counts)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--properties',type=int,default=50_000)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--improvements',type=float,default=1.2,help='Mean improvements per property')
+    parser.add_argument('--details',type=float,default=5.0,help='Mean details per improvement')
+    parser.add_argument('--attributes',type=float,default=6.0,help='Mean attributes per detail')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = generate_export(args.out_dir,args.properties,seed=args.seed,improvements=args.improvements,
+                             details=args.details,attributes=args.attributes)
+    print(counts.to_string())
+    print(f'{time.perf_counter()-start:.1f} s')
+    return counts
+
+if __name__ == '__main__':
+    main()
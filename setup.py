@@ -5,4 +5,5 @@ setup(
     author='Calvin J Lin',
     version='0.0.1',
     packages=find_packages(),
+    entry_points={'console_scripts':['tcad=tcad.cli:main']},
 )
\ No newline at end of file
@@ -0,0 +1,29 @@
+import argparse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='tcad',description='Tools for the Travis Central Appraisal District export.')
+    commands = parser.add_subparsers(dest='command',required=True)
+
+    ingest = commands.add_parser('ingest',help='Parse the export tables into parquet datasets in parallel.')
+    ingest.add_argument('export_dir',help='The export zip, or a directory containing the extracted export (PROP.TXT, IMP_INFO.TXT, ...)')
+    ingest.add_argument('out_dir',help='Directory the parquet datasets are written to')
+    ingest.add_argument('--workers',type=int,default=None,help='Number of worker processes (default: number of cores)')
+    ingest.add_argument('--split-size',type=int,default=64,help='Approximate size in MB of the byte ranges each file is split into')
+    ingest.add_argument('--chunksize',type=int,default=100_000,help='Records per parquet row group')
+    ingest.add_argument('--engine',choices=['numpy','fwf'],default='numpy')
+    ingest.add_argument('--tables',nargs='+',default=None,help='Subset of PROP IMP_INFO IMP_DET IMP_ATR')
+    ingest.add_argument('--no-summary',action='store_true',help='Skip building the single family summary table')
+    ingest.add_argument('--no-lookup',action='store_true',help='Skip building the prop_id and address lookup index')
+    ingest.add_argument('--incremental',action='store_true',help='Only write the changes to tables already in out_dir since the last incremental ingest as a new delta')
+
+    args = parser.parse_args(argv)
+    if args.command == 'ingest':
+        # Imported here so `tcad --help` stays fast
+        from tcad import tparser
+        stats = tparser.ingest(args.export_dir,args.out_dir,tables=args.tables,workers=args.workers,
+                               split_size=args.split_size*2**20,chunksize=args.chunksize,engine=args.engine,
+                               summary=not args.no_summary,lookup=not args.no_lookup,incremental=args.incremental)
+        print(stats.to_string(float_format='{:.1f}'.format))
+
+if __name__ == '__main__':
+    main()
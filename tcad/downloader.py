@@ -1,33 +1,34 @@
+import os
+from pathlib import Path
+
 import requests
-import warnings
 
-from pathlib import Path
-import subprocess
+DEFAULT_URL = "https://traviscad.org/wp-content/largefiles/2023%20Certified%20Appraisal%20Export%20Supp%200_07232022.zip"
+DEFAULT_HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/118.0"
+}
 
+def _download(url=None,headers=None,*,cache_dir='.cache',chunk_size=2**20,timeout=60):
+    """
+    Downloads the export zip into cache_dir and returns its path, without extracting it.
 
-def _download(url=None,headers=None):
-    """Deprecated: please download and extract manually"""
-    DEFAULT_URL = "https://traviscad.org/wp-content/largefiles/2023%20Certified%20Appraisal%20Export%20Supp%200_07232022.zip"
-    DEFAULT_HEADERS = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/118.0"
-    }
+    The response is streamed to disk chunk_size bytes at a time, so memory does not grow with the size of the
+    export. It is written to a .part file that is renamed once complete, and an already downloaded zip is reused.
+    The tparser functions and `tcad ingest` read the tables straight from the zip.
+    """
     url = url or DEFAULT_URL
     headers = headers or DEFAULT_HEADERS
 
-    Path('.cache').mkdir(parents=True,exist_ok=True)
-    
-    filepath = f'.cache/{url.split("/")[-1].replace("%20","_")}'
-
-    data = requests.get(url,headers=headers).content
-    with open(filepath,'wb') as f:
-        f.write(data)
-    
-    def extract():
-        try:
-            path_7zip = r"C:/Program Files/7-Zip/7z.exe"
-            command = [path_7zip,'x',filepath,'-o'+filepath.replace('.zip',''),'-aos']
-            subprocess.check_output(command)
-        except:
-            warnings.warn("Unable to extract with 7zip. Please extract the zip file in .cache manually.")
+    Path(cache_dir).mkdir(parents=True,exist_ok=True)
+    filepath = Path(cache_dir)/url.split("/")[-1].replace("%20","_")
+    if filepath.exists():
+        return filepath
 
-    extract()
+    tmp = filepath.with_name(filepath.name+'.part')
+    with requests.get(url,headers=headers,stream=True,timeout=timeout) as response:
+        response.raise_for_status()
+        with open(tmp,'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    os.replace(tmp,filepath)
+    return filepath
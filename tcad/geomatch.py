@@ -0,0 +1,147 @@
+"""
+Matches TCAD parcels (notebook 2.2) with OpenStreetMap building footprints (notebook 2.1).
+
+A building matches every parcel it intersects, and pct_bldg_in_parcel is the share of the building's
+area inside that parcel. The county is split into tiles of buildings that are matched in a process pool,
+so memory is bounded by the size of a tile rather than the county.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import math,os,time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+def _match_tile(parcels,buildings):
+    """
+    Matches two arrays of geometries, returns (parcel positions, building positions, share of the building
+    inside the parcel). Runs in a worker process.
+    """
+    building_pos,parcel_pos = shapely.STRtree(parcels).query(buildings,predicate='intersects')
+    area = shapely.area(buildings[building_pos])
+    # Most buildings lie inside one parcel, where the overlap is the building itself and the (much slower) overlay can be skipped
+    shapely.prepare(parcels)
+    inside = shapely.covers(parcels[parcel_pos],buildings[building_pos])
+    overlap = area.copy()
+    overlap[~inside] = shapely.area(shapely.intersection(parcels[parcel_pos[~inside]],buildings[building_pos[~inside]]))
+    with np.errstate(divide='ignore',invalid='ignore'):
+        pct = overlap/area
+    return parcel_pos,building_pos,pct
+
+def _tiles(buildings,buildings_per_tile):
+    """ Tile number of each building on a square grid over the buildings, by the center of its bounding box. """
+    bounds = shapely.bounds(buildings)
+    x,y = (bounds[:,0]+bounds[:,2])/2,(bounds[:,1]+bounds[:,3])/2
+    side = max(math.ceil(math.sqrt(len(buildings)/buildings_per_tile)),1)
+    def cell(values):
+        values = np.nan_to_num(values,nan=np.nanmin(values) if np.isfinite(values).any() else 0)
+        span = values.max()-values.min()
+        return np.zeros(len(values),dtype='int64') if span == 0 else np.minimum(((values-values.min())/span*side).astype('int64'),side-1)
+    return cell(x)*side+cell(y)
+
+def _index_level(df,name):
+    """ Values of an index level or column, OSM footprints from osmnx carry (element_type,osmid) as their index. """
+    if name in (df.index.names or []):
+        return df.index.get_level_values(name).to_numpy()
+    if name in df.columns:
+        return df[name].to_numpy()
+    return None
+
+def geospatial_match(tcad_parcels,osm_bldgs,*,workers=None,buildings_per_tile=20_000):
+    """
+    Finds every (parcel,building) pair whose geometries intersect.
+
+    Buildings are grouped into tiles of about buildings_per_tile buildings. For each tile only the parcels
+    whose bounding box touches the tile are sent to a worker, which queries them with all of the tile's
+    buildings at once and computes the intersection areas on aligned geometry arrays. Each building belongs
+    to exactly one tile so no pair is found twice. workers=1 runs everything in this process.
+
+    Returns the match table and a series of quality stats (see match_stats). The table has one row per pair with
+    the parcel's PROP_ID (tcad), osmid, osm_element_type, pct_bldg_in_parcel and the row positions of the
+    pair in the inputs (parcel, building), which with_geometries uses to add the geometries back.
+    """
+    started = time.time()
+    if tcad_parcels.crs != osm_bldgs.crs:
+        raise ValueError(f"tcad_parcels and osm_bldgs have different crs: {tcad_parcels.crs} and {osm_bldgs.crs}")
+    parcels = tcad_parcels.geometry.to_numpy()
+    buildings = osm_bldgs.geometry.to_numpy()
+
+    parcel_tree = shapely.STRtree(parcels)
+    tiles = _tiles(buildings,buildings_per_tile) if len(buildings) else np.array([],dtype='int64')
+    order = np.argsort(tiles,kind='stable')
+    starts = np.flatnonzero(np.r_[True,tiles[order][1:] != tiles[order][:-1]]) if len(order) else np.array([],dtype='int64')
+    tasks = []
+    for tile_buildings in np.split(order,starts[1:]) if len(order) else []:
+        tile_parcels = np.sort(parcel_tree.query(shapely.box(*shapely.total_bounds(buildings[tile_buildings]))))
+        if len(tile_parcels):
+            tasks.append((tile_parcels,tile_buildings))
+
+    if (workers or os.cpu_count()) > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            results = list(pool.map(_match_tile,[parcels[p] for p,_ in tasks],[buildings[b] for _,b in tasks]))
+    else:
+        results = [_match_tile(parcels[p],buildings[b]) for p,b in tasks]
+
+    parcel_pos = np.concatenate([p[pos] for (p,_),(pos,_,_) in zip(tasks,results)]) if tasks else np.array([],dtype='int64')
+    building_pos = np.concatenate([b[pos] for (_,b),(_,pos,_) in zip(tasks,results)]) if tasks else np.array([],dtype='int64')
+    pct = np.concatenate([pct for _,_,pct in results]) if tasks else np.array([],dtype='float64')
+    order = np.lexsort((parcel_pos,building_pos))
+
+    matches = pd.DataFrame({'parcel':parcel_pos[order],'building':building_pos[order]})
+    matches['tcad'] = tcad_parcels['PROP_ID'].to_numpy()[matches['parcel']]
+    for name,column in [('osmid','osmid'),('element_type','osm_element_type')]:
+        values = _index_level(osm_bldgs,name)
+        if values is not None:
+            matches[column] = values[matches['building']]
+    matches['pct_bldg_in_parcel'] = pct[order]
+
+    stats = match_stats(matches,parcels=len(tcad_parcels),buildings=len(osm_bldgs))
+    stats['tiles'] = len(tasks)
+    stats['seconds'] = time.time()-started
+    return matches,stats
+
+def match_stats(matches,*,parcels=None,buildings=None):
+    """
+    Quality stats of a match table: number of matches, buildings matched to more than one parcel and
+    parcels matched to more than one building (both potential false positives), and unmatched counts
+    when the number of parcels and buildings is given.
+    """
+    stats = {}
+    if parcels is not None:
+        stats['parcels'] = parcels
+    if buildings is not None:
+        stats['buildings'] = buildings
+    stats['matches'] = len(matches)
+    stats['osm_multiple_tcad'] = int(matches['building'].duplicated().sum())
+    stats['tcad_multiple_osm'] = int(matches['tcad'].duplicated().sum())
+    if parcels is not None:
+        stats['parcels_unmatched'] = parcels-matches['parcel'].nunique()
+    if buildings is not None:
+        stats['buildings_unmatched'] = buildings-matches['building'].nunique()
+    return pd.Series(stats,dtype='float64')
+
+def dedupe_and_clean(matches):
+    """
+    Drops matches without a share (buildings without area), then keeps one parcel per building, the one
+    holding the largest share of it. If a building is 60% in parcel A and 40% in parcel B, it belongs to A.
+    """
+    return (matches.dropna(subset='pct_bldg_in_parcel')
+                   .sort_values(['building','pct_bldg_in_parcel'],ascending=False)
+                   .drop_duplicates(subset='building'))
+
+def filter_single_fam(matches,prop_ids):
+    """
+    Keeps matches of the given (single family) properties. OSM also labels things like storage tanks and
+    garages as buildings, so when a parcel has several buildings only the largest share is kept.
+    """
+    matches = matches[matches['tcad'].isin(prop_ids)]
+    return (matches.sort_values(['tcad','pct_bldg_in_parcel'],ascending=False)
+                   .drop_duplicates('tcad').reset_index(drop=True))
+
+def with_geometries(matches,tcad_parcels,osm_bldgs):
+    """ Adds the parcel and building geometries of each match as tcad_geometry and osm_geometry (the active geometry). """
+    matches = pd.DataFrame(matches)
+    matches['tcad_geometry'] = gpd.GeoSeries(tcad_parcels.geometry.to_numpy()[matches['parcel']],index=matches.index,crs=tcad_parcels.crs)
+    matches['osm_geometry'] = gpd.GeoSeries(osm_bldgs.geometry.to_numpy()[matches['building']],index=matches.index,crs=osm_bldgs.crs)
+    return gpd.GeoDataFrame(matches,geometry='osm_geometry')
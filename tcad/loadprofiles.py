@@ -0,0 +1,93 @@
+"""
+Aggregates the ResStock timeseries of the buildings selected for TCAD properties (notebook 3.1) into load profiles
+per zip code, or any other grouping of the TCAD properties (notebook 3.2).
+
+A ResStock building selected by several properties of a group counts once per property. Every building file is
+read once (only the timestamp and value columns) and added to running per group sums, so memory depends on the
+number of groups and timestamps (8760 rows per year of hourly data) rather than on the number of buildings.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TIMESERIES_URL = ("https://oedi-data-lake.s3.amazonaws.com/nrel-pds-building-stock/end-use-load-profiles-for-us-building-stock/2022/"
+                  "resstock_amy2018_release_1.1/timeseries_individual_buildings/by_state/upgrade={upgrade}/state={state}")
+
+ELECTRICITY = 'out.electricity.total.energy_consumption'
+
+def timeseries_file(bldg_id,upgrade=0):
+    """ Name of a building's timeseries file, the same locally and in TIMESERIES_URL. """
+    return f'{bldg_id}-{upgrade}.parquet'
+
+def _read_timeseries(path,column):
+    df = pd.read_parquet(path,columns=['timestamp',column])
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values('timestamp',kind='stable')
+    return df['timestamp'].to_numpy(),df[column].to_numpy(dtype='float64')
+
+def _accumulate(paths,weights,column):
+    """
+    Weighted sums per group of the timeseries in paths, weights has one row per group and one column per path.
+    Returns (timestamps,sums). Runs in a worker process.
+    """
+    timestamps,sums = None,None
+    for path,weight in zip(paths,weights.T):
+        file_timestamps,values = _read_timeseries(path,column)
+        if sums is None:
+            timestamps,sums = file_timestamps,np.zeros((len(weights),len(values)))
+        elif not np.array_equal(file_timestamps,timestamps):
+            raise ValueError(f"{path} does not have the same timestamps as {paths[0]}")
+        groups = np.flatnonzero(weight)
+        sums[groups] += weight[groups,None]*values
+    return timestamps,sums
+
+def _sum_chunks(results):
+    """ Adds up the sums of every chunk as they arrive. """
+    timestamps,total = None,None
+    for chunk_timestamps,sums in results:
+        if total is None:
+            timestamps,total = chunk_timestamps,sums
+        elif not np.array_equal(chunk_timestamps,timestamps):
+            raise ValueError("The ResStock timeseries do not all have the same timestamps")
+        else:
+            total += sums
+    return timestamps,total
+
+def aggregate_load_profiles(tcad,folder,*,by='situs_zip',column=ELECTRICITY,upgrade=0,workers=None,chunk_size=64):
+    """
+    Sums the timeseries of every selected ResStock building (selected_resstock_id) per group of TCAD properties.
+
+    by is a column or list of columns of tcad, column the ResStock timeseries column to sum and folder the
+    directory holding the downloaded building files. Buildings are read in chunks of chunk_size files, each chunk
+    in a worker process that returns the sums of its own buildings, so at most one array per group and
+    worker is held at a time. workers=1 runs everything in this process.
+
+    Returns a frame indexed by timestamp with one column per group.
+    """
+    tcad = tcad[tcad['selected_resstock_id'].notna()]
+    groups = tcad.groupby(by,sort=True,observed=True)
+    group = groups.ngroup().fillna(-1).to_numpy(dtype='int64')
+    labels = groups.size().index
+    keep = group >= 0
+    # Ids are read as floats when some properties have no building
+    bldg,bldg_ids = pd.factorize(tcad['selected_resstock_id'].astype('int64').to_numpy()[keep],sort=True)
+    weights = np.bincount(group[keep]*len(bldg_ids)+bldg,minlength=len(labels)*len(bldg_ids)).reshape(len(labels),len(bldg_ids)).astype('float64')
+
+    paths = [Path(folder)/timeseries_file(bldg_id,upgrade) for bldg_id in bldg_ids]
+    missing = [path for path in paths if not path.exists()]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} ResStock timeseries are missing from {folder}, e.g. {missing[0]}")
+
+    chunks = [slice(start,start+chunk_size) for start in range(0,len(paths),chunk_size)]
+    args = ([paths[chunk] for chunk in chunks],[weights[:,chunk] for chunk in chunks],[column]*len(chunks))
+    if (workers or os.cpu_count()) > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            timestamps,total = _sum_chunks(pool.map(_accumulate,*args))
+    else:
+        timestamps,total = _sum_chunks(map(_accumulate,*args))
+    if total is None:
+        return pd.DataFrame(columns=labels)
+    return pd.DataFrame(total.T,index=pd.Index(timestamps,name='timestamp'),columns=labels)
@@ -0,0 +1,317 @@
+"""
+Persisted lookup index of prop_ids and addresses for point queries, stored next to the parquet tables.
+
+build_lookup_index writes data_dir/LOOKUP.index/, a directory of .npy arrays that LookupIndex memory maps:
+- for every table (and the stored single family summary), the prop_id of each row sorted, with the row offsets
+  and the other DELTA_KEYS columns in the same order
+- the normalized address of every property (see normalize_address_part) as one key sorted by street, number,
+  zip, prefix, suffix and unit, with the prop_id and PROP row offset of each
+
+Looking up a prop_id, an address or a street name prefix is a binary search in these arrays, so it takes
+microseconds and only reads the pages it touches. Row offsets are positions in the tables as read_table returns
+them without filters (deltas applied). The index records the tables_version it was built from and is only
+opened while it matches the tables next to it. update_lookup_index applies the deltas of an incremental
+ingest to the arrays instead of reading the tables again.
+"""
+import hashlib,json,re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tcad.profiling import staged
+from tcad.selector import (DELTA_KEYS,SUMMARY_FILE,SUMMARY_VERSION,isin_keys,read_table,summary_version,table_deltas,
+                           tables_version)
+
+LOOKUP_DIR = 'LOOKUP.index'
+
+# Bump when the layout of the index or the address normalization changes so indexes get rebuilt
+LOOKUP_VERSION = 2
+
+# Address parts in the order they make up the key, so a key prefix is a street, a street and number, ...
+ADDRESS_FIELDS = {'street':'situs_street','num':'situs_num','zip':'situs_zip','prefix':'situs_street_prefx',
+                  'suffix':'situs_street_suffix','unit':'situs_unit'}
+
+# Ends every part of a key, it sorts before every character a part can contain so 'MAIN' comes before 'MAINE'
+SEPARATOR = '\x1f'
+
+def normalize_address_part(value,field=None):
+    """
+    Upper case with punctuation other than '/' and '-' removed and runs of spaces collapsed, '' for missing values.
+    Leading zeros are dropped from house numbers and zip codes are cut to 5 digits.
+    """
+    if value is None or (not isinstance(value,str) and pd.isna(value)):
+        return ''
+    value = ' '.join(re.sub(r'[^A-Z0-9/\- ]',' ',str(value).upper()).split())
+    if field == 'num':
+        value = re.sub(r'^0+(?=\d)','',value)
+    elif field == 'zip':
+        value = value[:5]
+    return value
+
+def _normalize_column(series,field):
+    """ normalize_address_part of every value, computed once per distinct value. """
+    codes,uniques = pd.factorize(series)
+    normalized = np.array([normalize_address_part(value,field) for value in uniques]+[''],dtype=object)
+    return normalized[codes]
+
+def _table_arrays(table,df,keys=False):
+    """
+    Sorted prop_ids of a table with the row offsets in the same order, missing prop_ids are -1. With keys, the
+    other DELTA_KEYS columns of the table come along so the rows a delta replaces can be found in the index.
+    """
+    prop_ids = df['prop_id'].to_numpy(dtype='int64',na_value=-1)
+    order = np.argsort(prop_ids,kind='stable')
+    arrays = {f'{table}.prop_id':prop_ids[order],f'{table}.rows':order.astype('int64')}
+    for col in DELTA_KEYS[table][1:] if keys else []:
+        arrays[f'{table}.{col}'] = df[col].to_numpy(dtype='int64',na_value=-1)[order]
+    return arrays
+
+def _address_arrays(prop_df):
+    """ Sorted address keys of the properties in PROP with their prop_ids and row offsets. """
+    parts = [_normalize_column(prop_df[col],field) if col in prop_df else np.full(len(prop_df),'',dtype=object)
+             for field,col in ADDRESS_FIELDS.items()]
+    keys = np.array([''.join(part+SEPARATOR for part in key).encode() for key in zip(*parts)],dtype='S')
+    order = np.argsort(keys,kind='stable')
+    return {'address':keys[order],'address.prop_id':prop_df['prop_id'].to_numpy(dtype='int64',na_value=-1)[order],
+            'address.rows':order.astype('int64')}
+
+def _index_arrays(tables,keys=False):
+    """
+    Arrays of the index for a dict of tables, PROP has to have the address columns and every table prop_id.
+    """
+    arrays = {}
+    for table,df in tables.items():
+        arrays.update(_table_arrays(table,df,keys))
+    arrays.update(_address_arrays(tables['PROP']))
+    return arrays
+
+def _read_columns(path,columns):
+    # A table of an empty export file is a dataset without parts
+    if path.is_dir() and not any(path.iterdir()):
+        return pd.DataFrame({col:pd.Series(dtype=object if col in ADDRESS_FIELDS.values() else 'int64') for col in columns})
+    return read_table(path,columns=columns)
+
+def _index_columns(table):
+    return DELTA_KEYS[table] + (list(ADDRESS_FIELDS.values()) if table == 'PROP' else [])
+
+def _index_tables(data_dir,version):
+    """ Paths of the tables to index, the stored summary is only indexed while it matches the tables. """
+    paths = {table:data_dir/f'{table}.parquet' for table in ['PROP','IMP_INFO','IMP_DET','IMP_ATR']}
+    summary = data_dir/SUMMARY_FILE
+    if summary.exists() and summary_version(summary) == (str(SUMMARY_VERSION),version):
+        paths['SF_SUMMARY'] = summary
+    return paths
+
+def _table_state(path):
+    """ Fingerprint of a table's own files and the names of the deltas on top of it. """
+    files = sorted(path.rglob('*')) if path.is_dir() else [path]
+    base = [(str(file.relative_to(path.parent)),file.stat().st_size,file.stat().st_mtime_ns) for file in files]
+    return {'base':hashlib.sha1(repr(base).encode()).hexdigest(),'deltas':[keys.parent.name for _,keys in table_deltas(path)]}
+
+def _write_index(path,arrays,meta):
+    """ Saves arrays into the index at path, drops the arrays of the tables that are no longer indexed. """
+    path.mkdir(parents=True,exist_ok=True)
+    for old in path.glob('*.npy'):
+        if old.stem.split('.')[0] not in [*meta['tables'],'address']:
+            old.unlink()
+    for name,array in arrays.items():
+        np.save(path/f'{name}.npy',array)
+    (path/'meta.json').write_text(json.dumps(meta,indent=1))
+
+@staged()
+def build_lookup_index(data_dir):
+    """
+    Builds the lookup index of the tables in data_dir (and the stored summary if it is current) and writes it
+    to data_dir/LOOKUP.index/. Only the key and address columns are read. Returns the number of properties.
+    """
+    data_dir = Path(data_dir)
+    version = tables_version(data_dir)
+    paths = _index_tables(data_dir,version)
+    tables = {table:_read_columns(path,_index_columns(table)) for table,path in paths.items()}
+    path = data_dir/LOOKUP_DIR
+    for old in path.glob('*.npy'):
+        old.unlink()
+    meta = {'version':LOOKUP_VERSION,'tables_version':version,'tables':{table:_table_state(path) for table,path in paths.items()}}
+    _write_index(path,_index_arrays(tables,keys=True),meta)
+    return len(tables['PROP'])
+
+def _splice(arrays,key,keep,removed_rows,new):
+    """
+    Aligned index arrays sorted by arrays[key] (row offsets in arrays['rows']) without the entries where keep
+    is False and with new ones (the same arrays, sorted by key) inserted after the entries of equal keys.
+    Offsets move down by the number of removed rows before them.
+    """
+    arrays = {name:np.asarray(array)[keep] for name,array in arrays.items()}
+    arrays['rows'] = arrays['rows'] - np.searchsorted(removed_rows,arrays['rows'])
+    positions = np.searchsorted(arrays[key],new[key],'right')
+    return {name:np.insert(array.astype(np.result_type(array,new[name])),positions,new[name]) for name,array in arrays.items()}
+
+def _apply_delta(table,index,rows_path,keys_path):
+    """
+    Index arrays of a table (and the address arrays for PROP) after a delta, the same way read_table applies
+    it: the rows of its keys are dropped and its rows appended. Only the delta is read.
+    """
+    keys = pd.read_parquet(keys_path)
+    keys = pd.DataFrame({col:keys[col].to_numpy(dtype='int64',na_value=-1) for col in keys.columns})
+    # Rows of a replaced or deleted key, looked for among the rows of its prop_id
+    prop_ids = np.asarray(index[f'{table}.prop_id'])
+    wanted = np.unique(keys['prop_id'].to_numpy())
+    ranges = zip(np.searchsorted(prop_ids,wanted,'left'),np.searchsorted(prop_ids,wanted,'right'))
+    candidates = np.concatenate([np.arange(start,end) for start,end in ranges]+[np.array([],dtype='int64')])
+    removed = candidates[isin_keys(pd.DataFrame({col:np.asarray(index[f'{table}.{col}'])[candidates] for col in keys.columns}),keys)]
+    removed_rows = np.sort(np.asarray(index[f'{table}.rows'])[removed])
+    keep = np.ones(len(prop_ids),dtype=bool)
+    keep[removed] = False
+    # The delta's rows follow the remaining rows
+    remaining = len(prop_ids) - len(removed)
+    columns = _index_columns(table)
+    df = _read_columns(rows_path,columns) if rows_path.exists() else pd.DataFrame({col:pd.Series(dtype='int64') for col in columns})
+
+    new = _table_arrays(table,df,keys=True)
+    new[f'{table}.rows'] += remaining
+    names = {name.split('.',1)[1]:name for name in new}
+    spliced = _splice({short:index[name] for short,name in names.items()},'prop_id',keep,removed_rows,{short:new[name] for short,name in names.items()})
+    arrays = {name:spliced[short] for short,name in names.items()}
+    if table == 'PROP':
+        new = _address_arrays(df)
+        new['address.rows'] += remaining
+        names = {'key':'address','prop_id':'address.prop_id','rows':'address.rows'}
+        spliced = _splice({short:index[name] for short,name in names.items()},'key',~np.isin(index['address.rows'],removed_rows),
+                          removed_rows,{short:new[name] for short,name in names.items()})
+        arrays.update({name:spliced[short] for short,name in names.items()})
+    return arrays
+
+@staged()
+def update_lookup_index(data_dir):
+    """
+    Brings the lookup index in data_dir up to date with the tables next to it, for use after an incremental
+    ingest. The deltas written on top of a table since the index was built are applied to its arrays (see
+    _apply_delta), so only their rows are read. Tables that were rewritten since are read again, and the
+    index is built from scratch when there is none of this LOOKUP_VERSION. Returns the number of properties.
+    """
+    data_dir = Path(data_dir)
+    path = data_dir/LOOKUP_DIR
+    meta = json.loads((path/'meta.json').read_text()) if (path/'meta.json').exists() else {}
+    if meta.get('version') != LOOKUP_VERSION:
+        return build_lookup_index(data_dir)
+    version = tables_version(data_dir)
+    paths = _index_tables(data_dir,version)
+    states,arrays = {},{}
+    for table,table_path in paths.items():
+        states[table] = _table_state(table_path)
+        indexed = meta['tables'].get(table)
+        if indexed == states[table]:
+            continue
+        if indexed and indexed['base'] == states[table]['base'] and states[table]['deltas'][:len(indexed['deltas'])] == indexed['deltas']:
+            patterns = [f'{table}.*.npy'] + (['address*.npy'] if table == 'PROP' else [])
+            table_arrays = {file.stem:np.load(file) for pattern in patterns for file in path.glob(pattern)}
+            for rows,keys in table_deltas(table_path)[len(indexed['deltas']):]:
+                table_arrays = _apply_delta(table,table_arrays,rows,keys)
+        else:
+            df = _read_columns(table_path,_index_columns(table))
+            table_arrays = _table_arrays(table,df,keys=True) | (_address_arrays(df) if table == 'PROP' else {})
+        arrays.update(table_arrays)
+    _write_index(path,arrays,{'version':LOOKUP_VERSION,'tables_version':version,'tables':states})
+    return len(np.load(path/'PROP.prop_id.npy',mmap_mode='r'))
+
+def lookup_index_current(data_dir):
+    """ Whether data_dir has a lookup index built from the tables that are in it now. """
+    path = Path(data_dir)/LOOKUP_DIR/'meta.json'
+    if not path.exists():
+        return False
+    meta = json.loads(path.read_text())
+    return meta['version'] == LOOKUP_VERSION and meta['tables_version'] == tables_version(data_dir)
+
+def _prefix_range(keys,prefix):
+    """ Start and end of the keys starting with prefix in a sorted array of byte strings. """
+    if not prefix:
+        return 0,len(keys)
+    if len(prefix) > keys.dtype.itemsize:
+        return 0,0
+    # Keys only hold ascii characters, so incrementing the last byte bounds every key with the prefix
+    end = prefix[:-1] + bytes([prefix[-1]+1])
+    return int(np.searchsorted(keys,prefix,'left')),int(np.searchsorted(keys,end,'left'))
+
+class LookupIndex:
+    """
+    prop_id and address lookups on the arrays written by build_lookup_index, see LookupIndex.open.
+
+    rows(table,prop_ids) gives the row offsets of properties in a table, prop_ids(street,...) and
+    find_address(street,...) the properties at an address and search_street(prefix) the addresses on the
+    streets starting with prefix.
+    """
+    def __init__(self,arrays):
+        self.arrays = arrays
+        self.tables = [name.split('.')[0] for name in arrays if name.endswith('.rows') and name != 'address.rows']
+
+    @classmethod
+    def open(cls,data_dir,*,check=True):
+        """ Memory maps the index stored in data_dir. Raises ValueError when the tables changed since it was built, unless check is False. """
+        path = Path(data_dir)/LOOKUP_DIR
+        if not (path/'meta.json').exists():
+            raise FileNotFoundError(f"{path} not found, build it with build_lookup_index")
+        if check and not lookup_index_current(data_dir):
+            raise ValueError(f"{path} was built from other tables, rebuild it with build_lookup_index")
+        return cls({file.stem:np.load(file,mmap_mode='r') for file in sorted(path.glob('*.npy'))})
+
+    @classmethod
+    def from_tables(cls,prop_df,imp_info_df,imp_det_df,imp_atr_df):
+        """ Index of tables in memory, kept in memory. """
+        return cls(_index_arrays({'PROP':prop_df,'IMP_INFO':imp_info_df,'IMP_DET':imp_det_df,'IMP_ATR':imp_atr_df}))
+
+    def rows(self,table,prop_ids):
+        """ Sorted row offsets of the given properties in a table ('PROP', ..., 'SF_SUMMARY'). """
+        if table not in self.tables:
+            raise KeyError(f"{table} is not in the lookup index")
+        keys,rows = self.arrays[f'{table}.prop_id'],self.arrays[f'{table}.rows']
+        prop_ids = np.unique(np.asarray(prop_ids,dtype='int64'))
+        start = np.searchsorted(keys,prop_ids,'left')
+        end = np.searchsorted(keys,prop_ids,'right')
+        if len(prop_ids) == 1:
+            return np.sort(np.asarray(rows[start[0]:end[0]]))
+        return np.sort(np.concatenate([np.asarray(rows[i:j]) for i,j in zip(start,end)]+[np.array([],dtype='int64')]))
+
+    def _address_positions(self,street,num=None,zip_code=None,prefix=None,suffix=None,unit=None):
+        """ Positions in the address arrays of the addresses matching every given part. """
+        given = {'street':street,'num':num,'zip':zip_code,'prefix':prefix,'suffix':suffix,'unit':unit}
+        if street is None:
+            raise ValueError("street is required")
+        # The leading given parts select a range of keys, the other given parts are checked on the keys in it
+        leading = []
+        for field in ADDRESS_FIELDS:
+            if given[field] is None:
+                break
+            leading.append(normalize_address_part(given[field],field))
+        keys = self.arrays['address']
+        start,end = _prefix_range(keys,''.join(part+SEPARATOR for part in leading).encode())
+        positions = np.arange(start,end)
+        rest = {i:normalize_address_part(given[field],field) for i,field in enumerate(ADDRESS_FIELDS)
+                if i >= len(leading) and given[field] is not None}
+        if rest and len(positions):
+            parts = [key.decode().split(SEPARATOR) for key in keys[start:end]]
+            positions = positions[[all(key[i] == value for i,value in rest.items()) for key in parts]]
+        return positions
+
+    def prop_ids(self,street,num=None,zip_code=None,prefix=None,suffix=None,unit=None):
+        """ Sorted prop_ids at the address made of the given parts, parts that are not given match anything. """
+        return np.unique(np.asarray(self.arrays['address.prop_id'][self._address_positions(street,num,zip_code,prefix,suffix,unit)]))
+
+    def _addresses(self,positions):
+        keys = self.arrays['address'][positions]
+        parts = [key.decode().split(SEPARATOR)[:-1] for key in keys]
+        df = pd.DataFrame(parts,columns=list(ADDRESS_FIELDS.values())) if parts else pd.DataFrame(columns=list(ADDRESS_FIELDS.values()))
+        df.insert(0,'prop_id',self.arrays['address.prop_id'][positions])
+        df.insert(1,'row',self.arrays['address.rows'][positions])
+        return df
+
+    def find_address(self,street,num=None,zip_code=None,prefix=None,suffix=None,unit=None):
+        """ prop_id, PROP row offset and normalized address parts of the properties at an address. """
+        return self._addresses(self._address_positions(street,num,zip_code,prefix,suffix,unit))
+
+    def search_street(self,prefix,*,limit=None):
+        """ The addresses on every street whose normalized name starts with prefix, ordered by street, number and zip. """
+        start,end = _prefix_range(self.arrays['address'],normalize_address_part(prefix).encode())
+        if limit is not None:
+            end = min(end,start+limit)
+        return self._addresses(np.arange(start,end))
@@ -0,0 +1,132 @@
+"""
+Downloads the TCAD parcel polygons (the land associated with each property) from the Travis County ArcGIS service.
+
+The service returns at most 1000 features per request, so the area is split into tiles and every tile
+is read page by page. Pages are fetched concurrently over a bounded pool of connections, and each raw
+response is cached on disk so an interrupted download picks up where it stopped.
+
+You can open this dataset in an interactive map found here:
+http://www.arcgis.com/apps/mapviewer/index.html?url=https://services.arcgis.com/0L95CJ0VTaxqcmED/ArcGIS/rest/services/EXTERNAL_tcad_parcel/FeatureServer&source=sd
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib,json,math,os,time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import geopandas as gpd
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = 'https://gis.traviscountytx.gov/server1/rest/services/Boundaries_and_Jurisdictions/TCAD_public/MapServer/0/query'
+
+OUT_FIELDS = ('OBJECTID,PROP_ID,geo_id,situs_num,situs_street,situs_zip,situs_address,sub_dec,entities,tcad_acres,legal_desc,'
+              'hyperlink,SHAPE.STArea(),SHAPE.STLength(),situs_street_prefx,situs_street_suffix,situs_city')
+
+# Rectangle around Travis County (EPSG:4326)
+TRAVIS_BOUNDS = {'xmin':-98.18,'ymin':30.02,'xmax':-97.36,'ymax':30.63}
+
+def create_query_url(*,xmin,ymin,xmax,ymax,bbox_crs=4326,output_crs=4326,base_url=BASE_URL,**params):
+    """ Query url for the parcels intersecting a rectangle, extra params are added to (or replace) the query parameters. """
+    params = {
+        'f':'geojson',
+        'returnGeometry':True,
+        'spatialRel':'esriSpatialRelIntersects',
+        'geometry':f'{{xmin:{xmin},ymin:{ymin},xmax:{xmax},ymax:{ymax},spatialReference:{{wkid:{bbox_crs}}}}}',
+        'geometryType':'esriGeometryEnvelope',
+        'inSr':bbox_crs,
+        'outFields':OUT_FIELDS,
+        'outSR':output_crs,
+        **params
+    }
+    return base_url+'?'+urlencode(params,quote_via=(lambda s,*args,**kwargs:s))
+
+def get_bounds(polygon_row):
+    """ Gets the rectangle bounding a shape. """
+    if not (isinstance(polygon_row,gpd.GeoDataFrame) and len(polygon_row)==1):
+        raise ValueError("Please provide polygon_row in the form of a GeoDataFrame with one row")
+    bbox = polygon_row.exterior.bounds.iloc[0]
+    return {'xmin':bbox.minx,'ymin':bbox.miny,'xmax':bbox.maxx,'ymax':bbox.maxy}
+
+def get_tiles(bounds,tile_size):
+    """ Splits a rectangle into a grid of tiles of at most tile_size on each side. """
+    nx = max(math.ceil((bounds['xmax']-bounds['xmin'])/tile_size),1)
+    ny = max(math.ceil((bounds['ymax']-bounds['ymin'])/tile_size),1)
+    dx,dy = (bounds['xmax']-bounds['xmin'])/nx,(bounds['ymax']-bounds['ymin'])/ny
+    return [{'xmin':bounds['xmin']+i*dx,'ymin':bounds['ymin']+j*dy,
+             'xmax':bounds['xmax'] if i == nx-1 else bounds['xmin']+(i+1)*dx,
+             'ymax':bounds['ymax'] if j == ny-1 else bounds['ymin']+(j+1)*dy}
+            for i in range(nx) for j in range(ny)]
+
+class _Fetcher:
+    """ GETs json over a shared session, retrying failures, with every response cached on disk by its url. """
+    def __init__(self,cache_dir,workers,retries,timeout):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True,exist_ok=True)
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        # At most `workers` connections, threads wait for a free one instead of opening more
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=workers,pool_block=True)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+
+    def path(self,url):
+        return self.cache_dir/f'{hashlib.sha1(url.encode()).hexdigest()}.json'
+
+    def get(self,url):
+        path = self.path(url)
+        if path.exists():
+            return json.loads(path.read_bytes())
+        for attempt in range(self.retries+1):
+            try:
+                response = self.session.get(url,timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+                # ArcGIS reports errors such as timeouts with a 200 status
+                if 'error' in data:
+                    raise requests.HTTPError(f"{data['error']} for url: {url}")
+                break
+            except (requests.RequestException,ValueError):
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2**attempt,30))
+        # Written to a temporary file first so an interrupted download never leaves a partial page behind
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_bytes(response.content)
+        os.replace(tmp,path)
+        return data
+
+def fetch_parcels(export_file=None,*,bounds=TRAVIS_BOUNDS,tile_size=0.05,base_url=BASE_URL,cache_dir='cache/parcels',
+                  workers=8,page_size=1000,retries=5,timeout=120):
+    """
+    Downloads every parcel intersecting bounds (EPSG:4326, see get_bounds) and returns them as a GeoDataFrame,
+    also written to export_file as GeoParquet if given.
+
+    bounds is split into tiles of tile_size degrees. The number of parcels in each tile is requested first,
+    then all pages of all tiles are fetched on `workers` threads sharing at most `workers` connections.
+    Failed requests are retried with a backoff. Raw responses are kept in cache_dir, so running it again
+    after an interruption only fetches the missing pages; clear cache_dir to download a fresh copy.
+    Parcels that intersect more than one tile are only kept once.
+    """
+    fetcher = _Fetcher(cache_dir,workers,retries,timeout)
+    tiles = get_tiles(bounds,tile_size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(lambda tile:fetcher.get(create_query_url(**tile,base_url=base_url,f='json',returnCountOnly='true'))['count'],tiles))
+        pages = [(i,create_query_url(**tile,base_url=base_url,orderByFields='OBJECTID',resultOffset=offset,resultRecordCount=page_size))
+                 for i,(tile,count) in enumerate(zip(tiles,counts)) for offset in range(0,count,page_size)]
+        results = list(pool.map(fetcher.get,[url for _,url in pages]))
+
+    # The server caps pages at its own maxRecordCount, which would silently drop parcels
+    received = [0]*len(tiles)
+    for (i,_),page in zip(pages,results):
+        received[i] += len(page['features'])
+    if any(got < count for got,count in zip(received,counts)):
+        raise ValueError("Got fewer parcels than the server reported for some tiles, use a smaller page_size")
+
+    features = [feature for page in results for feature in page['features']]
+    parcels = gpd.GeoDataFrame.from_features(features,crs='EPSG:4326') if features else gpd.GeoDataFrame(geometry=[],crs='EPSG:4326')
+    parcels = parcels.drop_duplicates(subset='OBJECTID' if 'OBJECTID' in parcels else None,ignore_index=True)
+    if export_file:
+        Path(export_file).parent.mkdir(parents=True,exist_ok=True)
+        parcels.to_parquet(export_file)
+    return parcels
@@ -0,0 +1,180 @@
+"""
+Stage level instrumentation of the tparser and Selector pipeline.
+
+Every instrumented stage (reading the layout, read_fwf, decoding, typing, parquet writes, query filters,
+pivots, merges, ...) records an event with its duration, input and output row counts and, when memory is
+tracked, the bytes it allocated (peak) and kept (retained) according to tracemalloc. Events of nested stages
+point to their parent.
+
+Instrumentation is off by default and then costs one global lookup per stage. Turn it on with
+
+    with profiling.profile('events.json') as events:
+        Selector(data_dir).get_single_family_building_summary()
+
+or for a whole run with the TCAD_PROFILE environment variable set to the json file to write when the
+interpreter exits (TCAD_PROFILE_MEMORY=0 skips tracemalloc, which slows allocation heavy stages down).
+"""
+import atexit,json,os,time,tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+ENV_VAR = 'TCAD_PROFILE'
+
+# The profile being recorded, None when instrumentation is off
+_active = None
+
+class _NullStage:
+    """ Stands in for a stage when instrumentation is off. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        return False
+
+    def output(self,result,rows=None):
+        return result
+
+_NULL_STAGE = _NullStage()
+
+def _rows(value):
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+class _Stage:
+    def __init__(self,profile,name,rows_in,fields):
+        self.profile = profile
+        self.event = {'stage':name,'rows_in':rows_in,'rows_out':None,**fields}
+
+    def __enter__(self):
+        profile = self.profile
+        parent = profile.stack[-1] if profile.stack else None
+        self.event.update({'id':len(profile.events),'parent':parent.event['id'] if parent else None,'depth':len(profile.stack)})
+        profile.events.append(self.event)
+        if profile.memory:
+            current,peak = tracemalloc.get_traced_memory()
+            if parent:
+                parent.peak = max(parent.peak,peak)
+            tracemalloc.reset_peak()
+            self.start_memory,self.peak = current,current
+        profile.stack.append(self)
+        self.event['start'] = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self,*args):
+        self.event['seconds'] = time.perf_counter()-self.started
+        profile = self.profile
+        profile.stack.pop()
+        if profile.memory:
+            current,peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak,peak)
+            self.event['bytes_allocated'] = self.peak-self.start_memory
+            self.event['bytes_retained'] = current-self.start_memory
+            if profile.stack:
+                profile.stack[-1].peak = max(profile.stack[-1].peak,self.peak)
+        return False
+
+    def output(self,result,rows=None):
+        """ Records the output row count (len(result) unless rows is given) and returns result. """
+        self.event['rows_out'] = _rows(result) if rows is None else rows
+        return result
+
+class Profile:
+    """ The events recorded while instrumentation is on. """
+    def __init__(self,memory=True):
+        self.events = []
+        self.stack = []
+        self.memory = memory
+
+    def to_json(self,path=None):
+        """ The events as a json list, also written to path if given. """
+        text = json.dumps(self.events,indent=1,default=str)
+        if path:
+            with open(path,'w') as f:
+                f.write(text)
+        return text
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.events)
+
+def stage(name,rows_in=None,**fields):
+    """
+    Context manager timing one stage, extra fields are stored in its event. Call output(result) on it to record
+    the output rows. Returns a shared no-op object when instrumentation is off.
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active,name,rows_in,fields)
+
+def staged(name=None,rows_in=None,rows_out=None):
+    """
+    Decorator recording every call of a function as a stage named name (the function's qualified name by default).
+    rows_in gets the call's arguments and rows_out its result and return their row counts, len(result) by default.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+        @wraps(func)
+        def wrapper(*args,**kwargs):
+            if _active is None:
+                return func(*args,**kwargs)
+            with _Stage(_active,stage_name,rows_in(*args,**kwargs) if rows_in else None,{}) as event:
+                result = func(*args,**kwargs)
+                return event.output(result,rows_out(result) if rows_out else None)
+        return wrapper
+    return decorator
+
+def record(name,start,end,rows_in=None,rows_out=None,**fields):
+    """ Adds the event of a stage that ran elsewhere (e.g. in a worker process) from its start and end times. """
+    if _active is None:
+        return
+    parent = _active.stack[-1].event['id'] if _active.stack else None
+    _active.events.append({'stage':name,'rows_in':rows_in,'rows_out':rows_out,**fields,'id':len(_active.events),
+                           'parent':parent,'depth':len(_active.stack),'start':start,'seconds':end-start})
+
+def enabled():
+    return _active is not None
+
+@contextmanager
+def profile(path=None,*,memory=True):
+    """
+    Records the events of every stage run inside the block, yields the Profile and writes its events to
+    path as json when the block ends. With memory=False the bytes allocated are not measured.
+    """
+    global _active
+    previous = _active
+    _active = Profile(memory)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield _active
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        if path:
+            _active.to_json(path)
+        _active = previous
+
+def disable_in_worker():
+    """ Process pool initializer, forked worker processes would otherwise keep recording events nobody reads. """
+    global _active
+    if _active is not None and _active.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _active = None
+
+def _profile_from_env():
+    """ Profiles this process when TCAD_PROFILE is set, the variable is removed so worker processes do not profile themselves. """
+    global _active
+    path = os.environ.pop(ENV_VAR,None)
+    memory = os.environ.pop(f'{ENV_VAR}_MEMORY','1') != '0'
+    if not path:
+        return
+    _active = Profile(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    atexit.register(_active.to_json,path)
+
+_profile_from_env()
@@ -0,0 +1,191 @@
+"""
+Matches TCAD single family buildings to ResStock buildings (notebook 3.1).
+
+Each TCAD building is binned into ResStock's categories (vintage, stories, floor area, foundation and roof
+material) and matched to the ResStock buildings that share the most specific combination of them, falling
+back through MATCH_LEVELS until one has matches. One of the matches is then drawn at random.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+
+RESSTOCK_URL = ("https://oedi-data-lake.s3.amazonaws.com/nrel-pds-building-stock/end-use-load-profiles-for-us-building-stock/2022/"
+                "resstock_tmy3_release_1.1/metadata_and_annual_results/by_state/state={state}/parquet/{state}_baseline_metadata_and_annual_results.parquet")
+
+USECOLS = ['in.sqft','in.vintage','in.geometry_stories','in.geometry_floor_area',
+           'in.geometry_foundation_type','in.geometry_building_type_height','in.city',
+           'in.has_pv','in.cooling_setpoint','in.federal_poverty_level','in.income','in.roof_material']
+
+# TCAD column (added by add_match_keys) and the ResStock column it is matched on
+MATCH_KEYS = {'vintage':'in.vintage','num_floors':'in.geometry_stories','geometry_floor_area':'in.geometry_floor_area',
+              'geometry_foundation_type':'in.geometry_foundation_type','roof_material':'in.roof_material'}
+
+# Matching order, if there are no matches, fallback to next step
+MATCH_LEVELS = [
+    ['vintage','num_floors','geometry_floor_area','geometry_foundation_type','roof_material'],
+    ['vintage','num_floors','geometry_floor_area','roof_material'],
+    ['vintage','num_floors','geometry_floor_area','geometry_foundation_type'],
+    ['vintage','num_floors','geometry_floor_area'],
+    ['vintage','geometry_floor_area'],
+    ['vintage'],
+]
+
+def load_resstock(*,state='TX'):
+    return pd.read_parquet(RESSTOCK_URL.format(state=state))
+
+def select_single_family_detached(resstock_df_raw,city='TX, Austin'):
+    """ Single family detached buildings of a city, with the tile roof materials combined into 'Tile, all' to make matching easier. """
+    resstock = resstock_df_raw[(resstock_df_raw['in.city']==city)
+                               &(resstock_df_raw['in.geometry_building_type_height']=='Single-Family Detached')][USECOLS].copy()
+    resstock['in.roof_material'] = resstock['in.roof_material'].replace('Tile, Clay or Ceramic','Tile, all').replace('Tile, Concrete','Tile, all')
+    return resstock
+
+def _labels(values,format):
+    """ Formats an array of integers once per unique value. """
+    uniques,inverse = np.unique(values,return_inverse=True)
+    return np.array([format(value) for value in uniques],dtype=object)[inverse]
+
+def find_vintage(yr_built):
+    """ ResStock vintage of each year built, buildings from the 2020s get mapped to 2010s. Missing years have no vintage. """
+    yr = pd.Series(yr_built).to_numpy(dtype='float64',na_value=np.nan)
+    decade = np.where(np.isnan(yr),0,np.trunc(yr/10)).astype('int64')
+    vintage = np.where(yr < 1940,'<1940',np.where(yr > 2010,'2010s',_labels(decade,lambda n:f'{n}0s'))).astype(object)
+    vintage[np.isnan(yr)] = None
+    return pd.Series(vintage,index=getattr(yr_built,'index',None))
+
+def find_area_bin(main_area):
+    """ ResStock floor area bin of each TCAD main area. RESSTOCK has no buildings from 3500-8000. """
+    area = pd.Series(main_area).to_numpy(dtype='float64',na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        large = np.where(area >= 1000,np.trunc((area-1000)/500)*500+1000,0).astype('int64')
+        small = np.where(area >= 500,np.trunc((area-500)/250)*250+500,0).astype('int64')
+    bins = np.select([area >= 6000,area >= 3000,area >= 1000,area >= 500],
+                     ['4000+','3000-3999',_labels(large,lambda n:f'{n}-{n+499}'),_labels(small,lambda n:f'{n}-{n+249}')],
+                     '0-499').astype(object)
+    return pd.Series(bins,index=getattr(main_area,'index',None))
+
+def find_foundation(foundation):
+    foundation_map = {
+        'SLAB':'Slab',
+        'PIER AND B':'Ambient',
+        'WOOD POST':'Ambient'
+    }
+    return pd.Series(foundation).astype(object).map(foundation_map).astype(object).where(lambda s:s.notna(),None)
+
+def find_roof_material(roof_covering):
+    tcad_resstock_roof = {
+        'COMPOSITIO':'Composition Shingles',
+        'WOOD SHING':'Wood Shingles',
+        'METAL':'Metal, Dark',
+        'TILE':'Tile, all'
+    }
+    return pd.Series(roof_covering).astype(object).map(tcad_resstock_roof).astype(object).where(lambda s:s.notna(),None)
+
+def add_match_keys(tcad):
+    """ Adds the ResStock bins of each TCAD building as vintage, geometry_floor_area, geometry_foundation_type and roof_material. """
+    tcad = tcad.copy()
+    tcad['vintage'] = find_vintage(tcad['yr_built'])
+    tcad['geometry_floor_area'] = find_area_bin(tcad['main_area'])
+    tcad['geometry_foundation_type'] = find_foundation(tcad['Foundation'])
+    tcad['roof_material'] = find_roof_material(tcad['Roof Covering'])
+    return tcad
+
+class ResStockIndex:
+    """
+    ResStock buildings grouped by every combination of match keys in MATCH_LEVELS.
+
+    Key values are stored as integer codes. For each level the buildings are sorted by the combined code of
+    that level's keys (stable, so a group keeps the order of the ResStock frame), and looking up a TCAD
+    building is a binary search giving the first position and size of its group.
+    """
+    def __init__(self,resstock,levels=MATCH_LEVELS):
+        self.resstock = resstock
+        self.levels = levels
+        self.codes,self.uniques = {},{}
+        for key,col in MATCH_KEYS.items():
+            self.codes[key],self.uniques[key] = pd.factorize(resstock[col])
+        self.sizes = {key:len(uniques)+1 for key,uniques in self.uniques.items()}
+        self.groups = []
+        for level in levels:
+            keys = self._combine(level,self.codes)
+            order = np.argsort(keys,kind='stable')
+            self.groups.append((order,keys[order]))
+
+    def _combine(self,level,codes):
+        """ One int64 per building for the keys of a level, -1 when any key is missing. """
+        combined = np.zeros(len(codes[level[0]]),dtype='int64')
+        missing = np.zeros(len(combined),dtype=bool)
+        for key in level:
+            combined = combined*self.sizes[key] + codes[key]
+            missing |= codes[key] < 0
+        combined[missing] = -1
+        return combined
+
+    def _tcad_codes(self,tcad):
+        """ Codes of the TCAD keys in the ResStock key values, values ResStock does not have are -1. """
+        codes = {}
+        for key in MATCH_KEYS:
+            # The notebook compares stories as the string of the TCAD value, e.g. '2'
+            values = tcad[key].map(str) if key == 'num_floors' else tcad[key]
+            codes[key] = pd.Index(self.uniques[key]).get_indexer(values.astype(object).where(tcad[key].notna(),None))
+        return codes
+
+    def match(self,tcad):
+        """
+        Finds the candidates of each TCAD building (with the columns added by add_match_keys).
+
+        Returns a frame with the TCAD index and the level of MATCH_LEVELS that matched (resstock_level,
+        -1 when none did), the number of candidates (resstock_count) and where they start in that level's
+        group order (used by candidates and sample).
+        """
+        codes = self._tcad_codes(tcad)
+        level = np.full(len(tcad),-1)
+        start = np.zeros(len(tcad),dtype='int64')
+        count = np.zeros(len(tcad),dtype='int64')
+        for i,keys in enumerate(self.levels):
+            combined = self._combine(keys,codes)
+            _,sorted_keys = self.groups[i]
+            left = np.searchsorted(sorted_keys,combined,side='left')
+            found = (np.searchsorted(sorted_keys,combined,side='right') - left) * (combined >= 0)
+            use = (level < 0) & (found > 0)
+            level[use],start[use],count[use] = i,left[use],found[use]
+        return pd.DataFrame({'resstock_level':level,'resstock_count':count,'resstock_start':start},index=tcad.index)
+
+    def candidates(self,match):
+        """ The ResStock rows matching one row of a match frame, in the order of the ResStock frame. """
+        if match['resstock_level'] < 0:
+            return self.resstock.iloc[[]]
+        order,_ = self.groups[match['resstock_level']]
+        return self.resstock.iloc[order[match['resstock_start']:match['resstock_start']+match['resstock_count']]]
+
+    def sample(self,matches,seed=2024):
+        """
+        Draws one candidate per TCAD building and returns its ResStock id (the index of the ResStock frame).
+
+        The draws are made with random.Random(seed).randint(0,count-1) in row order, which gives the same
+        buildings as seeding the global generator and drawing row by row in the notebook. Buildings without
+        candidates get no id and do not consume a draw.
+        """
+        rng = random.Random(seed)
+        counts = matches['resstock_count'].to_numpy()
+        offsets = np.array([rng.randint(0,count-1) if count > 0 else 0 for count in counts.tolist()],dtype='int64')
+        ids = np.empty(len(matches),dtype=object)
+        for i,(order,_) in enumerate(self.groups):
+            rows = matches['resstock_level'].to_numpy() == i
+            ids[rows] = self.resstock.index.to_numpy()[order[matches['resstock_start'].to_numpy()[rows]+offsets[rows]]]
+        ids = pd.Series(ids,index=matches.index)
+        return ids.astype(self.resstock.index.dtype) if (counts > 0).all() else ids
+
+def match_resstock(tcad,resstock,*,seed=2024):
+    """
+    Adds the ResStock bins, the number of candidates (resstock_count), the level they matched at (resstock_level)
+    and a randomly drawn ResStock building (selected_resstock_id) to each TCAD building.
+    """
+    tcad = add_match_keys(tcad)
+    index = ResStockIndex(resstock)
+    matches = index.match(tcad)
+    tcad['resstock_count'] = matches['resstock_count']
+    tcad['resstock_level'] = matches['resstock_level']
+    tcad['selected_resstock_id'] = index.sample(matches,seed)
+    return tcad
@@ -1,5 +1,12 @@
+import hashlib,json,shutil
+from pathlib import Path
+
+import fastparquet
+import numpy as np
 import pandas as pd
 
+from tcad.profiling import stage,staged
+
 def validate_string_list_only(var,var_name='Variable'):
     if isinstance(var,str):
         return [var]
@@ -18,16 +25,239 @@ def filter_bldg_type(df,bldg_types):
     df = df[df['imprv_type_desc'].isin(bldg_types)]
     return df
 
-class Selector:
-    def __init__(self,data_dir,*,_copying=False):
-        if not _copying:
-            self.prop_df = pd.read_parquet(f'{data_dir}/PROP.parquet')
-            self.imp_det_df = pd.read_parquet(f'{data_dir}/IMP_DET.parquet')
-            self.imp_info_df = pd.read_parquet(f'{data_dir}/IMP_INFO.parquet')
-            self.imp_atr_df = pd.read_parquet(f'{data_dir}/IMP_ATR.parquet')
+KEY_COLUMNS = ['prop_id','prop_val_yr','imprv_id','imprv_det_id']
+
+# Rows with the same key are replaced together by a delta (see table_deltas)
+DELTA_KEYS = {'PROP':['prop_id','prop_val_yr'],'IMP_INFO':['prop_id','imprv_id','prop_val_yr'],
+              'IMP_DET':['prop_id','imprv_id','prop_val_yr'],'IMP_ATR':['prop_id','imprv_id','prop_val_yr'],
+              'SF_SUMMARY':['prop_id']}
+
+SINGLE_FAMILY = '1 FAM DWELLING'
+
+# Stored county wide summary, rebuilt when SUMMARY_VERSION is bumped or the tables change
+SUMMARY_FILE = 'SF_SUMMARY.parquet'
+SUMMARY_VERSION = 2
+
+SUMMARY_COLUMNS = ['prop_id', 'imprv_id', 'prop_val_yr_x', 'situs_num','situs_street_prefx', 'situs_street',
+       'situs_street_suffix', 'situs_unit','situs_city', 'situs_zip', 'appraised_val','HVAC_area', 
+       '1ST_floor_area', '2ND_floor_area','3RD_floor_area', '4TH_floor_area', '5TH_floor_area', 'ADDL_floor_area',
+       'num_floors', 'highest_floor', 'main_area', 'yr_built', 'Foundation',
+       'Grade Factor', 'Roof Covering', 'Roof Style', 'Shape Factor',
+       'Ceiling Factor'] 
+
+SUMMARY_EXTRA_COLUMNS = ['land_acres','imprv_val','imprv_state_cd_y','abs_subdv_cd', 'hood_cd', 'block',
+       'land_hstd_val', 'land_non_hstd_val', 'imprv_hstd_val',
+       'imprv_non_hstd_val', 'market_value', 'ten_percent_cap',
+       'assessed_val', 'imprv_homesite', 'imprv_homesite_pct','en_exempt', 'pc_exempt', 'so_exempt','eco_exempt']
+
+# Summary columns that only exist when a single family building of the selection has the detail or attribute
+SUMMARY_OPTIONAL_COLUMNS = ['HVAC_area','1ST_floor_area','2ND_floor_area','3RD_floor_area','4TH_floor_area','5TH_floor_area',
+       'ADDL_floor_area','Foundation','Grade Factor','Roof Covering','Roof Style','Shape Factor','Ceiling Factor']
+# Stored summary column with a bit per SUMMARY_OPTIONAL_COLUMNS column the property has
+SUMMARY_PRESENT_COLUMN = 'present_columns'
+
+def read_table(path,columns=None,filters=None,isin=None):
+    """
+    Reads a parquet table, restoring categories for tables that were written in chunks.
+
+    filters is a list of (column,op,value) tuples passed to the parquet reader, which skips the row groups
+    whose statistics rule them out, or a list of such lists to keep the row groups any of them allows. isin maps columns to the values to keep and is applied to the rows read.
+    Deltas written by an incremental ingest next to the table are applied in order, see table_deltas.
+    """
+    deltas = table_deltas(path)
+    key_cols = list(pd.read_parquet(deltas[0][1]).columns) if deltas else []
+    read_cols = columns + [col for col in key_cols if col not in columns] if columns else columns
+    df = _read_rows(path,read_cols,filters,isin)
+    for rows,keys in deltas:
+        # Rows of a replaced or deleted key are dropped, then the key's current rows are appended
+        with stage('apply_delta',len(df),delta=str(keys.parent)) as event:
+            df = df[~isin_keys(df,pd.read_parquet(keys))]
+            if rows.exists():
+                df = pd.concat([df,_read_rows(rows,read_cols,filters,isin)],ignore_index=True)
+            event.output(df)
+    if deltas and columns:
+        df = df[columns]
+    with stage('restore_categories',len(df)) as event:
+        obj_cols = df.select_dtypes(['object']).columns
+        df[obj_cols] = df[obj_cols].astype('category')
+    return event.output(df)
+
+def _read_rows(path,columns=None,filters=None,isin=None):
+    with stage('read_parquet',path=str(path)) as event:
+        df = event.output(pd.read_parquet(path,columns=columns,filters=filters or None))
+    for col,values in (isin or {}).items():
+        with stage('filter_isin',len(df),column=col) as event:
+            df = event.output(df[df[col].isin(values)])
+    return df
+
+def read_offsets(path,rows,columns=None):
+    """
+    Rows of a parquet table at the given sorted row offsets, reading only the row groups that hold them.
+    Deltas are not applied, the dtypes are those read_table gives.
+    """
+    pf = fastparquet.ParquetFile(str(path))
+    sizes = np.array([row_group.num_rows for row_group in pf.row_groups],dtype='int64')
+    starts = np.concatenate([[0],np.cumsum(sizes)])
+    groups = np.searchsorted(starts,rows,'right') - 1
+    selected = np.unique(groups)
+    with stage('read_row_groups',len(selected),path=str(path)) as event:
+        if len(selected):
+            df = pd.concat([pf[int(i)].to_pandas(columns=columns) for i in selected],ignore_index=True)
         else:
-            pass
-    
+            df = pd.read_parquet(path,columns=columns,filters=[('prop_id','in',[])])
+        event.output(df)
+    # fastparquet reads Float64 columns back as float64
+    floats = {col['name']:col['numpy_type'] for col in json.loads(pf.key_value_metadata['pandas'])['columns']
+              if col['numpy_type'] in ('Float32','Float64') and col['name'] in df}
+    positions = np.concatenate([[0],np.cumsum(sizes[selected])])[np.searchsorted(selected,groups)] + rows - starts[groups]
+    df = df.astype(floats).take(positions).reset_index(drop=True)
+    obj_cols = df.select_dtypes(['object']).columns
+    df[obj_cols] = df[obj_cols].astype('category')
+    return df
+
+def write_parquet(path,df,**kwargs):
+    """
+    fastparquet.write, except that nullable integer columns are recorded in the pandas metadata the way pandas'
+    own writer records them, which pd.read_parquet needs to read them back as Int64 etc. instead of int64 or float64.
+    """
+    fastparquet.write(str(path),df,**kwargs)
+    nullable = [col for col,dtype in df.dtypes.items() if isinstance(dtype,pd.api.extensions.ExtensionDtype) and dtype.kind in 'iu']
+    if nullable and not kwargs.get('append'):
+        # Appending keeps the metadata of the first write
+        metadata = json.loads(fastparquet.ParquetFile(str(path)).key_value_metadata['pandas'])
+        for col in metadata['columns']:
+            if col['name'] in nullable:
+                col['numpy_type'] = col['pandas_type']
+        fastparquet.update_file_custom_metadata(str(path),{'pandas':json.dumps(metadata)})
+
+def table_deltas(path):
+    """
+    (rows,keys) paths of the deltas written on top of the table at path by an incremental ingest, oldest first.
+
+    A delta lives in <table>.delta/<version>/ next to the table. keys.parquet lists every key (prop_id,
+    prop_val_yr and for improvement tables imprv_id) whose rows changed or were deleted, and rows.parquet
+    holds the current rows of the changed keys.
+    """
+    delta_dir = Path(path).with_suffix('.delta')
+    if not delta_dir.is_dir():
+        return []
+    return [(version/'rows.parquet',version/'keys.parquet') for version in sorted(delta_dir.iterdir()) if (version/'keys.parquet').exists()]
+
+def isin_keys(df,keys):
+    """ Mask of the rows of df whose key columns (the columns of keys) match a row of keys. """
+    cols = list(keys.columns)
+    mask = df[cols[0]].isin(keys[cols[0]]).to_numpy()
+    if mask.any() and len(cols) > 1:
+        matched = df.loc[mask,cols].merge(keys.drop_duplicates(),how='left',on=cols,indicator=True)['_merge']
+        mask[mask] = (matched == 'both').to_numpy()
+    return mask
+
+def table_columns(path):
+    """ Column names of a parquet table, read from its metadata only. """
+    return fastparquet.ParquetFile(path).columns
+
+def _id_range(col,ids):
+    """
+    Row group filter for a set of ids. A range is used rather than an 'in' filter since the reader
+    sorts the values of an 'in' filter for every row group.
+    """
+    if len(ids) == 0:
+        return [(col,'in',[])]
+    return [(col,'>=',ids.min()),(col,'<=',ids.max())]
+
+def _zip_ranges(zips):
+    """
+    Row group filter for a set of properties (prop_id and situs_zip) in a table sorted by situs_zip and
+    prop_id: the range of their prop_ids within each of their zip codes. A range over all prop_ids would
+    span every zip code and rule out nothing.
+    """
+    if len(zips) == 0:
+        return [('prop_id','in',[])]
+    ranges = zips.groupby(zips['situs_zip'].astype(object).fillna(''))['prop_id'].agg(['min','max'])
+    filters = []
+    for zip_code,(low,high) in zip(ranges.index,ranges.to_numpy()):
+        # Properties without a zip code are only bounded by prop_id
+        filters.append(([('situs_zip','==',zip_code)] if zip_code else [])+[('prop_id','>=',low),('prop_id','<=',high)])
+    return filters
+
+def _unique_ids(series):
+    return pd.unique(series.dropna().to_numpy())
+
+class IdIndex:
+    """
+    Row positions of a table grouped by the value of one column, built once and reused by every query.
+
+    The column is stored as integers (numbers as is, strings and categories as factorized codes) sorted
+    together with the row positions, so looking up a set of values is a binary search per value plus
+    a slice of the matching rows.
+    """
+    def __init__(self,series):
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            self.labels = None
+            values = series.to_numpy(dtype='int64',na_value=-1)
+        else:
+            values,self.labels = pd.factorize(series)
+        self.values = values
+        self.order = np.argsort(values,kind='stable')
+        self.keys = values[self.order]
+
+    def codes(self,labels):
+        """ Integer keys of the given values, unknown values are dropped. """
+        if self.labels is None:
+            return np.asarray(labels,dtype='int64')
+        codes = pd.Index(self.labels).get_indexer(labels)
+        return codes[codes >= 0]
+
+    def rows(self,keys):
+        """ Sorted row positions whose value is one of keys. """
+        keys = np.unique(keys)
+        keys = keys[keys >= 0]
+        start = np.searchsorted(self.keys,keys,side='left')
+        lengths = np.searchsorted(self.keys,keys,side='right') - start
+        # Expand each [start,start+length) run into consecutive positions without a python loop
+        offsets = np.repeat(start - np.cumsum(lengths) + lengths,lengths) + np.arange(lengths.sum())
+        return np.sort(self.order[offsets])
+
+    def contains(self,rows,keys):
+        """ Mask of which of the given rows have a value in keys. """
+        keys = np.unique(keys)
+        values = self.values[rows]
+        if len(keys) == 0:
+            return np.zeros(len(values),dtype=bool)
+        found = np.searchsorted(keys,values).clip(max=len(keys)-1)
+        return (keys[found] == values) & (values >= 0)
+
+class Selector:
+    """
+    Holds the four TCAD tables.
+
+    Tables are only read from data_dir when they are first used. zip_codes and bldg_types give the same
+    result as calling query() afterwards but are pushed down to the parquet reader, and columns limits which
+    property table columns are read (key columns are always included). For example,
+    Selector(data_dir,zip_codes='78741',columns=['situs_street']) only reads the parts of the files for 78741.
+    """
+    def __init__(self,data_dir,*,zip_codes=None,bldg_types=None,columns=None,_copying=False):
+        self.data_dir = data_dir
+        self._zip_codes = validate_string_list_only(zip_codes,'zip_codes') if zip_codes else None
+        self._bldg_types = validate_string_list_only(bldg_types,'bldg_types') if bldg_types else None
+        self._columns = columns
+        self._tables = {}
+        self._views = {}
+        self._indexes = {}
+        self._lookup = None
+        self._lookup_stored = False
+        self._ids = None
+        # Whether the tables are exactly what is in data_dir (or a query of it)
+        self._from_disk = not _copying
+
+    @classmethod
+    def _view(cls,views,data_dir=None,from_disk=False):
+        """ A selector whose tables are row selections of other tables, only materialized when accessed. """
+        obj = cls(data_dir,_copying = True)
+        obj._views = views
+        obj._from_disk = from_disk
+        return obj
+
     @classmethod
     def _copy(cls,prop_df,imp_info_df,imp_det_df,imp_atr_df):
         obj = cls(None,_copying = True)
@@ -39,6 +269,110 @@ class Selector:
     
     def copy(self):
         return Selector._copy(self.prop_df,self.imp_info_df,self.imp_det_df,self.imp_atr_df)
+
+    def _path(self,table):
+        return f'{self.data_dir}/{table}.parquet'
+
+    def _selected_ids(self):
+        """ prop_ids and imprv_ids passing the zip code and building type filters, read from the key columns only. """
+        if self._ids is None:
+            with stage('selected_ids') as event:
+                zip_isin = {'situs_zip':self._zip_codes} if self._zip_codes else {}
+                bldg_isin = {'imprv_type_desc':self._bldg_types} if self._bldg_types else {}
+                prop_df = read_table(self._path('PROP'),['prop_id','situs_zip'],[(col,'in',values) for col,values in zip_isin.items()],zip_isin)
+                prop_ids = _unique_ids(prop_df['prop_id'])
+                info_filters = [(col,'in',values) for col,values in bldg_isin.items()] + (_id_range('prop_id',prop_ids) if self._zip_codes else [])
+                if self._zip_codes and 'situs_zip' in table_columns(self._path('IMP_INFO')):
+                    info_filters.append(('situs_zip','in',self._zip_codes))
+                info_df = read_table(self._path('IMP_INFO'),['prop_id','imprv_id','imprv_type_desc'],info_filters,bldg_isin)
+                self._ids = (np.intersect1d(prop_ids,_unique_ids(info_df['prop_id'])),_unique_ids(info_df['imprv_id']))
+                event.output(self._ids[0])
+        return self._ids
+
+    def _load(self,table):
+        if table not in self._tables and table in self._views:
+            df,rows = self._views[table]
+            with stage('take_rows',len(df),table=table) as event:
+                self._tables[table] = event.output(df.take(rows))
+        if table not in self._tables:
+            path = self._path(table)
+            columns = self._read_columns(table)
+            zip_sorted = table != 'PROP' and 'situs_zip' in table_columns(path)
+            filters,isin = [],{}
+            if self._zip_codes or self._bldg_types:
+                prop_ids,imprv_ids = self._selected_ids()
+                filters,isin = _id_range('prop_id',prop_ids),{'prop_id':prop_ids}
+                if (table == 'PROP' or zip_sorted) and self._zip_codes:
+                    filters.append(('situs_zip','in',self._zip_codes))
+                if table == 'IMP_INFO' and self._bldg_types:
+                    filters.append(('imprv_type_desc','in',self._bldg_types))
+                if table != 'PROP':
+                    isin['imprv_id'] = imprv_ids
+            with stage('load_table',table=table) as event:
+                self._tables[table] = event.output(read_table(path,columns,filters,isin))
+        return self._tables[table]
+
+    def _read_columns(self,table):
+        """ Columns of a table that are read from data_dir, None for all. """
+        path = self._path(table)
+        if table == 'PROP' and self._columns:
+            return [col for col in table_columns(path) if col in KEY_COLUMNS+['situs_zip']+list(self._columns)]
+        # Improvement tables hold the zip code of their property to be sorted and filtered by, it is not read
+        if table != 'PROP' and 'situs_zip' in table_columns(path):
+            return [col for col in table_columns(path) if col != 'situs_zip']
+        return None
+
+    def _set(self,table,df):
+        self._from_disk = False
+        self._tables[table] = df
+        self._views.pop(table,None)
+        self._indexes = {key:index for key,index in self._indexes.items() if key[0] != table}
+        self._lookup = None
+
+    def _source(self,table):
+        """ The frame this selector's rows of a table come from, and the positions of those rows (None for all). """
+        if table in self._views and table not in self._tables:
+            return self._views[table]
+        return self._load(table),None
+
+    def _index(self,table,col):
+        if (table,col) not in self._indexes:
+            df,rows = self._source(table)
+            with stage('build_index',len(df) if rows is None else len(rows),table=table,column=col):
+                self._indexes[(table,col)] = IdIndex(df[col] if rows is None else df[col].take(rows))
+        return self._indexes[(table,col)]
+
+    @property
+    def prop_df(self):
+        return self._load('PROP')
+
+    @prop_df.setter
+    def prop_df(self,df):
+        self._set('PROP',df)
+
+    @property
+    def imp_info_df(self):
+        return self._load('IMP_INFO')
+
+    @imp_info_df.setter
+    def imp_info_df(self,df):
+        self._set('IMP_INFO',df)
+
+    @property
+    def imp_det_df(self):
+        return self._load('IMP_DET')
+
+    @imp_det_df.setter
+    def imp_det_df(self,df):
+        self._set('IMP_DET',df)
+
+    @property
+    def imp_atr_df(self):
+        return self._load('IMP_ATR')
+
+    @imp_atr_df.setter
+    def imp_atr_df(self,df):
+        self._set('IMP_ATR',df)
         
     @property
     def zip_codes(self):
@@ -52,29 +386,94 @@ class Selector:
     def detail_types(self):
         return self.imp_det_df['Imprv_det_type_desc'].unique().sort_values().tolist()
 
+    @staged(rows_out=lambda selector:len(selector._views['PROP'][1]))
     def query(self,zip_codes=None,bldg_types=None):
         """
         Filters the stored dataframes to only keep records with the specified zip_codes or building types.
-        """
-        prop_df = filter_zip(self.prop_df,zip_codes) if zip_codes else self.prop_df
-        imp_info_df = filter_bldg_type(self.imp_info_df,bldg_types) if bldg_types else self.imp_info_df
-        imp_det_df = self.imp_det_df
-        imp_atr_df = self.imp_atr_df
 
-        # These variables are used in the query strings below (code editor may say otherwise but ignore that).
-        prop_ids = list(set(prop_df['prop_id']).intersection(imp_info_df['prop_id']))
-        imprv_ids = imp_info_df['imprv_id']
-
-        query1 = "prop_id in @prop_ids"
-        query2 = query1 + " and imprv_id in @imprv_ids"
+        The filters are semi-joins on indexes of prop_id, imprv_id, situs_zip and imprv_type_desc that are built
+        the first time they are needed and kept for later queries. The returned selector holds row positions into
+        this selector's tables and only copies a table when it is accessed.
+        """
+        prop_index = self._index('PROP','prop_id')
+        info_index = self._index('IMP_INFO','prop_id')
+        prop_rows = np.arange(len(prop_index.values))
+        info_rows = np.arange(len(info_index.values))
+        if zip_codes:
+            zip_index = self._index('PROP','situs_zip')
+            prop_rows = zip_index.rows(zip_index.codes(validate_string_list_only(zip_codes,'zip_codes')))
+        if bldg_types:
+            bldg_index = self._index('IMP_INFO','imprv_type_desc')
+            info_rows = bldg_index.rows(bldg_index.codes(validate_string_list_only(bldg_types,'bldg_types')))
+
+        prop_ids = np.intersect1d(prop_index.values[prop_rows],info_index.values[info_rows])
+        imprv_ids = self._index('IMP_INFO','imprv_id').values[info_rows]
+
+        rows = {'PROP':np.intersect1d(prop_index.rows(prop_ids),prop_rows,assume_unique=True),
+                'IMP_INFO':np.intersect1d(info_index.rows(prop_ids),info_rows,assume_unique=True)}
+        for table in ['IMP_DET','IMP_ATR']:
+            rows[table] = self._index(table,'prop_id').rows(prop_ids)
+        for table in ['IMP_INFO','IMP_DET','IMP_ATR']:
+            rows[table] = rows[table][self._index(table,'imprv_id').contains(rows[table],imprv_ids)]
+
+        views = {}
+        for table,table_rows in rows.items():
+            df,source_rows = self._source(table)
+            views[table] = (df,table_rows if source_rows is None else source_rows[table_rows])
+        return Selector._view(views,self.data_dir,self._from_disk)
+    
+    def _lookup_index(self):
+        """
+        The lookup index stored in data_dir when it matches this selector's tables, otherwise one built from the
+        tables in memory. Row offsets of the stored index are positions in the whole tables.
+        """
+        # Imported here since tcad.lookup reads the tables with this module
+        from tcad.lookup import LookupIndex,lookup_index_current
+        if self._lookup is None:
+            with stage('open_lookup_index') as event:
+                self._lookup_stored = self._from_disk and not self._views and not (self._zip_codes or self._bldg_types) and lookup_index_current(self.data_dir)
+                if self._lookup_stored:
+                    self._lookup = LookupIndex.open(self.data_dir,check=False)
+                else:
+                    self._lookup = LookupIndex.from_tables(self.prop_df,self.imp_info_df,self.imp_det_df,self.imp_atr_df)
+                event.output(self._lookup.arrays['PROP.rows'])
+        return self._lookup
+
+    @staged(rows_out=lambda selector:len(selector._views['PROP'][1]))
+    def lookup(self,prop_ids=None,*,street=None,num=None,zip_code=None,prefix=None,suffix=None,unit=None):
+        """
+        Selector holding only the given properties, or the properties at an address when street is given.
 
-        prop_df2 = prop_df.query(query1)
-        imp_info_df2 = imp_info_df.query(query2)
-        imp_det_df2 = imp_det_df.query(query2)
-        imp_atr_df2 = imp_atr_df.query(query2)
+        Address parts are normalized (see lookup.normalize_address_part) and parts that are not given match
+        anything, e.g. lookup(street='Main',num='100') finds 100 Main in every zip code. With the lookup index
+        stored by build_lookup_index (tcad ingest does this) rows are found by binary search, without building
+        any index on the tables, and only the row groups holding them are read from tables that are not loaded yet.
+        Like query, the returned selector otherwise only holds row positions into this selector's tables.
+        """
+        if prop_ids is None and street is None:
+            raise ValueError("lookup needs prop_ids or a street")
+        index = self._lookup_index()
+        ids = np.array([],dtype='int64') if prop_ids is None else np.atleast_1d(np.asarray(prop_ids,dtype='int64'))
+        if street is not None:
+            ids = np.union1d(ids,index.prop_ids(street,num,zip_code,prefix,suffix,unit))
+        views = {}
+        for table in ['PROP','IMP_INFO','IMP_DET','IMP_ATR']:
+            rows = index.rows(table,ids)
+            if self._lookup_stored and table not in self._tables:
+                views[table] = (self._read_lookup_rows(table,rows,ids),np.arange(len(rows)))
+                continue
+            df,source_rows = self._source(table)
+            views[table] = (df,rows if source_rows is None else source_rows[rows])
+        return Selector._view(views,self.data_dir,self._from_disk)
+
+    def _read_lookup_rows(self,table,rows,prop_ids):
+        """ Rows of a table at row offsets of the stored lookup index, read without loading the whole table. """
+        path = self._path(table)
+        if table_deltas(path):
+            # Offsets count the rows of the deltas, which are found by prop_id instead
+            return read_table(path,self._read_columns(table),_id_range('prop_id',prop_ids),{'prop_id':prop_ids})
+        return read_offsets(path,rows,self._read_columns(table))
 
-        return Selector._copy(prop_df2,imp_info_df2,imp_det_df2,imp_atr_df2)
-    
     def get_properties_table(self):
         """ 
         Returns dataframe where each record is for a property or land parcel.
@@ -121,6 +520,7 @@ class Selector:
         """
         return self.imp_atr_df
     
+    @staged(rows_in=lambda self:len(self.imp_det_df))
     def unstack_improvement_details_table(self):
         """
         This function takes the improvement details table as input, and returns a table with
@@ -129,6 +529,8 @@ class Selector:
         This only works for single family buildings due to the ways floors are handled for taller buildings in TCAD.
         Floor counts >=5 could be 5+.
 
+        The table is built in one pass over integer arrays (detail type codes and improvement ids) rather than
+        with pivot_table and groupby, the output is the same as the previous pandas version.
         """
         imp_det_df = self.imp_det_df
 
@@ -136,29 +538,58 @@ class Selector:
         floor_codes = ['1ST','2ND','3RD','4TH','5TH','ADDL']
         floor_labels = {floor:floor+'_floor_area' for floor in floor_codes}
 
-        # Only interested in details that are floors 1-5 or residential hvac (095)
-        filtered_df = imp_det_df[imp_det_df['Imprv_det_type_cd'].isin(floor_codes+['095'])].copy()
-        filtered_df['Imprv_det_type_cd'] = filtered_df['Imprv_det_type_cd'].cat.remove_unused_categories()
-
-        # The details rotate to become columns, aggfun=sum because if there are 2 first floors in the same building we sum the areas.
-        pivoted_df = (filtered_df.pivot_table(index=['imprv_id'],columns='Imprv_det_type_cd',values='imprv_det_area',aggfunc='sum')
-                    .rename(columns={'095':'HVAC_area',**floor_labels}))
-        pivoted_df.columns.name=None
+        # Only interested in details that are floors 1-5 or residential hvac (095), columns follow the category order
+        type_cd = imp_det_df['Imprv_det_type_cd']
+        categories = type_cd.cat.categories
+        wanted = np.flatnonzero(categories.isin(floor_codes+['095']))
+        column_of = np.full(len(categories)+1,-1)
+        column_of[wanted] = np.arange(len(wanted))
+        columns = column_of[type_cd.cat.codes.to_numpy()]
+
+        imprv_id = imp_det_df['imprv_id']
+        keep = (columns >= 0) & imprv_id.notna().to_numpy()
+        present = np.bincount(columns[columns >= 0],minlength=len(wanted)) > 0
+        ids,groups = np.unique(imprv_id.to_numpy(dtype='int64',na_value=0)[keep],return_inverse=True)
+        columns = columns[keep]
+
+        # Sum the areas of each (building,detail type), 2 first floors in the same building are summed
+        area = imp_det_df['imprv_det_area'].to_numpy(dtype='float64',na_value=0)[keep]
+        sums = np.bincount(groups*len(wanted)+columns,weights=area,minlength=len(ids)*len(wanted)).reshape(len(ids),len(wanted))
+        if pd.api.types.is_integer_dtype(imp_det_df['imprv_det_area'].dtype):
+            sums = sums.astype('int64')
+
+        labels = [{'095':'HVAC_area',**floor_labels}.get(code,code) for code in categories[wanted]]
+        area_dtype = imp_det_df['imprv_det_area'].dtype
+        pivoted_df = pd.DataFrame({label:pd.array(sums[:,i],dtype=area_dtype) for i,label in enumerate(labels) if present[i]},
+                                  index=pd.Index(ids,name='imprv_id').astype(imprv_id.dtype))
 
         # To avoid a column not in df error (5th floor can exist but not always)
         floor_labels_in_table = [label for label in floor_labels.values() if label in pivoted_df.columns]
+        floors = sums[:,[labels.index(label) for label in floor_labels_in_table]]
+
+        # Same dtypes pandas gives when counting and summing the floor columns: nullable columns stay nullable,
+        # numpy integer columns are widened to 64 bits
+        nullable = isinstance(area_dtype,pd.api.extensions.ExtensionDtype)
+        count_dtype = 'Int64' if nullable else 'int64'
+        sum_dtype = area_dtype if nullable else np.zeros(1,dtype=area_dtype).sum().dtype
 
         # Counts number of actual floors, may act weird if there is a floor over garage.
-        pivoted_df['num_floors']=(pivoted_df[floor_labels_in_table]>0).sum(axis=1)
+        pivoted_df['num_floors'] = pd.array((floors > 0).sum(axis=1),dtype=count_dtype)
 
-        pivoted_df['highest_floor']=pivoted_df[floor_labels_in_table].iloc[:,::-1].replace(0,pd.NA).isnull().idxmin(axis=1).str.replace('_floor_area','')
+        # Highest floor with an area, falls back to the highest floor column when a building has no floor area
+        highest = [label.replace('_floor_area','') for label in floor_labels_in_table[::-1]]
+        pivoted_df['highest_floor'] = np.array(highest,dtype=object)[(floors[:,::-1] > 0).argmax(axis=1)] if highest else np.nan
         # Note: this only sums floors 1-5, but TCAD will also sum things like half floors for their website. TODO
-        pivoted_df['main_area']=pivoted_df[floor_labels_in_table].sum(axis=1)
+        pivoted_df['main_area'] = pd.array(floors.sum(axis=1),dtype=sum_dtype)
 
         # Determined by the oldest detail(floor) in each improvement(building)
-        pivoted_df['yr_built']=filtered_df.groupby('imprv_id')['yr_built'].min()
+        order = np.argsort(groups,kind='stable')
+        starts = np.searchsorted(groups[order],np.arange(len(ids)))
+        yr_built = imp_det_df['yr_built'].to_numpy(dtype='float64',na_value=np.nan)[keep][order]
+        pivoted_df['yr_built'] = pd.array(np.fmin.reduceat(yr_built,starts) if len(ids) else yr_built,dtype=imp_det_df['yr_built'].dtype)
         return pivoted_df
     
+    @staged(rows_in=lambda self:len(self.imp_atr_df))
     def unstack_improvement_attributes_table(self):
         """
         Improvement attributes table: goal is to pull info like foundation and roof into parent tables.
@@ -173,6 +604,9 @@ class Selector:
         - When an attribute like foundation or roof material is unknown, TCAD seems to add rows for all available options.
             - To handle this, all rows for that attribute are dropped for the given building.
         - Attributes tend to be assigned to the first floor of a building with the others devoid of attributes.
+
+        Only the floor rows are sorted and deduplicated as a frame, the attribute values are gathered with the
+        category codes of imprv_attr_cd so the detail x attribute pivot is never built for the whole table.
         """
 
         imp_atr_df = self.imp_atr_df
@@ -181,74 +615,151 @@ class Selector:
         # Columns to remove but make sure they're in df first
         drop_cols = [col for col in ['Unique Feature', 'Location', 'Condo Floor', 'CDU','Multi Imp'] if col in imp_atr_df['imprv_attr_desc']]
 
-        # Improvement attributes table: goal is to pull info like foundation and roof into parent tables
-        pivoted_df = (imp_atr_df.drop_duplicates(subset=['prop_id','prop_val_yr','imprv_id','imprv_det_id','imprv_attr_desc'],keep=False)
-                                .pivot(index='imprv_det_id',columns='imprv_attr_desc',values='imprv_attr_cd')
-                                .drop(columns=drop_cols))
-        pivoted_df.columns.name=None
+        # Attributes listed more than once for a detail are unknown, drop all of their rows
+        unique,det_values,desc = _unrepeated_attributes(imp_atr_df)
 
+        # Same check as DataFrame.pivot, a detail can only have one value per attribute
+        if ((det_values[unique[1:]] == det_values[unique[:-1]]) & (desc[unique[1:]] == desc[unique[:-1]])).any():
+            raise ValueError('Index contains duplicate entries, cannot reshape')
+        det_values,desc = det_values[unique],desc[unique]
+        attr_cd = imp_atr_df['imprv_attr_cd'].cat.codes.to_numpy()[unique]
 
-        filtered_df = pivoted_df[pivoted_df['Floor Factor'].isin(['1ST','2ND','3RD','4TH','5TH'])]
+        descs = imp_atr_df['imprv_attr_desc'].cat.categories
+        columns = [code for code in np.flatnonzero(np.bincount(desc[desc >= 0],minlength=len(descs))) if descs[code] not in drop_cols]
+        floor_factor = descs.get_loc('Floor Factor') if 'Floor Factor' in descs and (desc == descs.get_loc('Floor Factor')).any() else None
+        if floor_factor is None:
+            raise KeyError('Floor Factor')
+        columns = [code for code in columns if code != floor_factor]
 
-        # Add some columns that will be useful when removing duplicates
-        merged_df = filtered_df.reset_index().merge(imp_det_df[['prop_id','imprv_det_id','imprv_id','imprv_det_area']],how='left',left_on='imprv_det_id',right_on='imprv_det_id')
+        # Details whose Floor Factor is one of the first five floors, with that floor as a code for sorting
+        cd_categories = imp_atr_df['imprv_attr_cd'].cat.categories
+        floors = np.flatnonzero(cd_categories.isin(['1ST','2ND','3RD','4TH','5TH']))
+        is_floor = (desc == floor_factor) & np.isin(attr_cd,floors) & (det_values >= 0)
+        floor_df = pd.DataFrame({'imprv_det_id':det_values[is_floor],'Floor Factor':attr_cd[is_floor]})
 
-        # Combine attributes for all floors for a given building into one row.
-        final_df = (merged_df.sort_values(['prop_id','imprv_id','Floor Factor','imprv_det_area'],ascending=[True,True,True,False])
-                            .drop_duplicates(subset=['prop_id','imprv_id','Floor Factor'])
-                            .groupby('imprv_id').first()
-                            .drop(columns=['prop_id','imprv_det_id','Floor Factor','imprv_det_area']))
+        # Add some columns that will be useful when removing duplicates
+        merged_df = floor_df.merge(imp_det_df[['prop_id','imprv_det_id','imprv_id','imprv_det_area']],how='left',on='imprv_det_id')
+
+        # One detail per floor of a building, the largest
+        merged_df = (merged_df.sort_values(['prop_id','imprv_id','Floor Factor','imprv_det_area'],ascending=[True,True,True,False])
+                              .drop_duplicates(subset=['prop_id','imprv_id','Floor Factor']))
+        merged_df = merged_df[merged_df['imprv_id'].notna()]
+        ids = np.unique(merged_df['imprv_id'].to_numpy(dtype='int64'))
+
+        # Attribute code of every kept detail, -1 when it does not have the attribute
+        kept_dets = np.unique(merged_df['imprv_det_id'].to_numpy(dtype='int64'))
+        det_pos = np.searchsorted(kept_dets,det_values).clip(max=max(len(kept_dets)-1,0))
+        in_kept = (kept_dets[det_pos] == det_values) if len(kept_dets) else np.zeros(len(det_values),dtype=bool)
+        column_of = np.full(len(descs)+1,-1)
+        column_of[columns] = np.arange(len(columns))
+        in_kept &= column_of[desc] >= 0
+        codes = np.full((len(kept_dets),len(columns)),-1,dtype=attr_cd.dtype)
+        codes[det_pos[in_kept],column_of[desc[in_kept]]] = attr_cd[in_kept]
+
+        # Combine attributes for all floors for a given building into one row, first known value in floor order
+        row_codes = codes[np.searchsorted(kept_dets,merged_df['imprv_det_id'].to_numpy(dtype='int64'))]
+        groups = np.searchsorted(ids,merged_df['imprv_id'].to_numpy(dtype='int64'))
+        order = np.argsort(groups,kind='stable')
+        groups,row_codes = groups[order],row_codes[order]
+        final_df = pd.DataFrame(index=pd.Index(ids,name='imprv_id').astype(imp_det_df['imprv_id'].dtype))
+        for i,code in enumerate(columns):
+            rows = np.flatnonzero(row_codes[:,i] >= 0)
+            first = rows[np.r_[True,groups[rows[1:]] != groups[rows[:-1]]]] if len(rows) else rows
+            values = np.full(len(ids),-1,dtype=row_codes.dtype)
+            values[groups[first]] = row_codes[first,i]
+            final_df[descs[code]] = pd.Categorical.from_codes(values,dtype=imp_atr_df['imprv_attr_cd'].dtype)
 
         return final_df
 
-    def get_single_family_building_summary(self,extended_info=True,remove_nonunique_columns=False):
+    @staged()
+    def _build_single_family_building_summary(self,present_columns=False):
         """
-        This function returns a summary dataframe and is suitable for single family homes only. 
-        
-        This function ensures this by also querying for single family buildings.
-
-        TODO: this function assumes that there is one building per property. However, there are instances of multiple single family buildings 
-        in the same parcel.
-        
+        Merges the four tables into one row per single family property, see get_single_family_building_summary.
+        present_columns adds the SUMMARY_PRESENT_COLUMN column that the stored summary keeps.
         """
 
         # Ensures that only single family buildings are included, could be removed once functionality improves
-        sf = self.query(bldg_types='1 FAM DWELLING')
+        sf = self.query(bldg_types=SINGLE_FAMILY)
+
+        details_df = sf.unstack_improvement_details_table()
+        attributes_df = sf.unstack_improvement_attributes_table()
 
         # Merge all four tables into one at the building level (one row per building, can be multiple buildings per property)
-        merged_df = sf.prop_df.merge(
-            sf.imp_info_df.set_index('imprv_id')
-            .merge(sf.unstack_improvement_details_table(),
-                   how='outer',left_index=True, right_index=True)
-            .merge(sf.unstack_improvement_attributes_table(),
-                   how='outer',left_index=True, right_index=True)
-                   .reset_index(),
-            on='prop_id', how='outer')
-        
+        with stage('merge_tables') as event:
+            merged_df = event.output(sf.prop_df.merge(
+                sf.imp_info_df.set_index('imprv_id')
+                .merge(details_df,
+                       how='outer',left_index=True, right_index=True)
+                .merge(attributes_df,
+                       how='outer',left_index=True, right_index=True)
+                       .reset_index(),
+                on='prop_id', how='outer'))
+
         # Move improvement id column to front
         merged_df.insert(1,'imprv_id',merged_df.pop('imprv_id'))
-        
-        merged_df
-        
+
         # Reduce to one building per property by keeping largest area
-        merged_df = (merged_df.sort_values(['prop_id','main_area'],ascending=[True,False])
-                    .drop_duplicates(subset='prop_id',keep='first',ignore_index=True))
+        with stage('keep_largest_building',len(merged_df)) as event:
+            merged_df = event.output(merged_df.sort_values(['prop_id','main_area'],ascending=[True,False])
+                                     .drop_duplicates(subset='prop_id',keep='first',ignore_index=True))
 
+        if present_columns:
+            merged_df[SUMMARY_PRESENT_COLUMN] = _present_columns(sf).reindex(merged_df['prop_id'],fill_value=0).to_numpy()
+            return merged_df[[col for col in SUMMARY_COLUMNS+SUMMARY_EXTRA_COLUMNS+[SUMMARY_PRESENT_COLUMN] if col in merged_df]]
+        return merged_df[[col for col in SUMMARY_COLUMNS+SUMMARY_EXTRA_COLUMNS if col in merged_df]]
+
+    def _summary_prop_ids(self):
+        """
+        prop_ids of this selector that the stored summary can be sliced to, None when it has to be built instead.
+
+        The stored summary is only valid for tables straight from data_dir or queries of them, since a query
+        keeps or drops every single family building of a property together.
+        """
+        if not self._from_disk or not Path(f'{self.data_dir}/{SUMMARY_FILE}').exists():
+            return None
+        if summary_version(f'{self.data_dir}/{SUMMARY_FILE}') != (str(SUMMARY_VERSION),tables_version(self.data_dir)):
+            return None
+        if not self._views and not (self._zip_codes or self._bldg_types):
+            return slice(None)
+        if not self._views:
+            if self._bldg_types and SINGLE_FAMILY not in self._bldg_types:
+                return np.array([],dtype='int64')
+            return self._selected_ids()[0]
+        bldg_index = self._index('IMP_INFO','imprv_type_desc')
+        info_rows = bldg_index.rows(bldg_index.codes([SINGLE_FAMILY]))
+        return np.intersect1d(self._index('IMP_INFO','prop_id').values[info_rows],self._index('PROP','prop_id').values)
+
+    @staged()
+    def get_single_family_building_summary(self,extended_info=True,remove_nonunique_columns=False):
+        """
+        This function returns a summary dataframe and is suitable for single family homes only. 
         
-        main_cols = ['prop_id', 'imprv_id', 'prop_val_yr_x', 'situs_num','situs_street_prefx', 'situs_street',
-       'situs_street_suffix', 'situs_unit','situs_city', 'situs_zip', 'appraised_val','HVAC_area', 
-       '1ST_floor_area', '2ND_floor_area','3RD_floor_area', '4TH_floor_area', '5TH_floor_area', 'ADDL_floor_area',
-       'num_floors', 'highest_floor', 'main_area', 'yr_built', 'Foundation',
-       'Grade Factor', 'Roof Covering', 'Roof Style', 'Shape Factor',
-       'Ceiling Factor'] 
-        
-        extra_cols = ['land_acres','imprv_val','imprv_state_cd_y','abs_subdv_cd', 'hood_cd', 'block',
-       'land_hstd_val', 'land_non_hstd_val', 'imprv_hstd_val',
-       'imprv_non_hstd_val', 'market_value', 'ten_percent_cap',
-       'assessed_val', 'imprv_homesite', 'imprv_homesite_pct','en_exempt', 'pc_exempt', 'so_exempt','eco_exempt']
+        This function ensures this by also querying for single family buildings.
+
+        If the county wide summary was stored with build_single_family_summary (tcad ingest does this) and the tables
+        have not changed since, the rows for this selector are read from it instead of being rebuilt.
+
+        TODO: this function assumes that there is one building per property. However, there are instances of multiple single family buildings 
+        in the same parcel.
         
+        """
+        prop_ids = self._summary_prop_ids()
+        if prop_ids is None:
+            merged_df = self._build_single_family_building_summary()
+        elif isinstance(prop_ids,slice):
+            with stage('read_summary') as event:
+                merged_df = event.output(read_table(f'{self.data_dir}/{SUMMARY_FILE}').sort_values('prop_id',ignore_index=True))
+            merged_df = merged_df.drop(columns=SUMMARY_PRESENT_COLUMN).astype({'highest_floor':object})
+        else:
+            filters = [('situs_zip','in',self._zip_codes)] if self._zip_codes and not self._views else []
+            with stage('read_summary',len(prop_ids)) as event:
+                merged_df = event.output(read_table(f'{self.data_dir}/{SUMMARY_FILE}',filters=filters+_id_range('prop_id',prop_ids),isin={'prop_id':prop_ids})
+                                         .sort_values('prop_id',ignore_index=True))
+            merged_df = _slice_columns(merged_df)
+
+        main_cols = list(SUMMARY_COLUMNS)
         if extended_info:
-            main_cols += extra_cols
+            main_cols += SUMMARY_EXTRA_COLUMNS
 
         if remove_nonunique_columns:
             merged_df = merged_df.drop(columns=[col for col in merged_df.nunique()
@@ -256,4 +767,169 @@ class Selector:
                                                 if col not in ['prop_val_yr_x']])
             
         main_cols = [col for col in main_cols if col in merged_df]
-        return merged_df[main_cols]
\ No newline at end of file
+        return merged_df[main_cols]
+
+def _unrepeated_attributes(imp_atr_df):
+    """
+    Positions of the attribute rows that are not listed more than once for their detail, sorted by key,
+    detail and attribute, with the imprv_det_id and imprv_attr_desc codes of every row.
+    """
+    keys = [imp_atr_df[col].to_numpy(dtype='int64',na_value=-1) for col in ['prop_val_yr','imprv_id','prop_id']]
+    det_values = imp_atr_df['imprv_det_id'].to_numpy(dtype='int64',na_value=-1)
+    desc = imp_atr_df['imprv_attr_desc'].cat.codes.to_numpy()
+    order = np.lexsort(keys+[desc,det_values])
+    same = np.ones(max(len(order)-1,0),dtype=bool)
+    for values in keys+[desc,det_values]:
+        same &= values[order[1:]] == values[order[:-1]]
+    repeated = np.zeros(len(order),dtype=bool)
+    repeated[order[1:][same]] = True
+    repeated[order[:-1][same]] = True
+    return order[~repeated[order]],det_values,desc
+
+def _present_columns(sf):
+    """
+    Bits of the SUMMARY_OPTIONAL_COLUMNS that the single family buildings of each property have a detail or
+    attribute for, by prop_id. A summary built for some properties has the columns of the union of their bits.
+    """
+    bit = {col:1<<i for i,col in enumerate(SUMMARY_OPTIONAL_COLUMNS)}
+    labels = {'095':'HVAC_area',**{floor:floor+'_floor_area' for floor in ['1ST','2ND','3RD','4TH','5TH','ADDL']}}
+    type_cd = sf.imp_det_df['Imprv_det_type_cd']
+    det_bits = np.array([bit.get(labels.get(code),0) for code in type_cd.cat.categories]+[0],dtype='int64')[type_cd.cat.codes.to_numpy()]
+    unique,_,desc = _unrepeated_attributes(sf.imp_atr_df)
+    descs = sf.imp_atr_df['imprv_attr_desc'].cat.categories
+    atr_bits = np.array([bit.get(label,0) for label in descs]+[0],dtype='int64')[desc[unique]]
+    pairs = pd.DataFrame({'prop_id':np.r_[sf.imp_det_df['prop_id'].to_numpy(dtype='int64',na_value=-1),
+                                          sf.imp_atr_df['prop_id'].to_numpy(dtype='int64',na_value=-1)[unique]],
+                          'bit':np.r_[det_bits,atr_bits]})
+    # Every distinct bit of a property once, so their sum is the bitwise or
+    return pairs[pairs['bit'] > 0].drop_duplicates().groupby('prop_id')['bit'].sum()
+
+def _slice_columns(summary):
+    """
+    Makes the rows of some properties read from the stored summary look like the summary built for them:
+    the optional columns none of them has are dropped, and buildings without floor area get the highest floor
+    column of the slice as their highest floor instead of the one of the county.
+    """
+    present = np.bitwise_or.reduce(summary.pop(SUMMARY_PRESENT_COLUMN).to_numpy(dtype='int64'))
+    summary = summary.drop(columns=[col for i,col in enumerate(SUMMARY_OPTIONAL_COLUMNS) if not present>>i & 1 and col in summary])
+    return _highest_floor_fallback(summary)
+
+def _county_columns(summary,dtypes):
+    """
+    Makes the summary rows built for some properties look like the rows of the county wide summary: its
+    columns with its dtypes where the values fit, buildings with details have no area (0) for the floors they
+    lack, and buildings without floor area get the highest floor column of the county as their highest floor.
+    """
+    has_details = summary['main_area'].notna()
+    summary = summary.reindex(columns=list(dtypes))
+    for col,dtype in dtypes.items():
+        if col.endswith('_area') and col != 'main_area':
+            summary.loc[has_details & summary[col].isna(),col] = 0
+        try:
+            summary[col] = summary[col].astype(dtype)
+        except (TypeError,ValueError):
+            # Missing values in a column the county has none of
+            pass
+    return _highest_floor_fallback(summary)
+
+def _highest_floor_fallback(summary):
+    """ Sets the highest floor of buildings without floor area to the highest floor column of the summary. """
+    floors = [col for col in SUMMARY_OPTIONAL_COLUMNS if col.endswith('_floor_area') and col in summary]
+    no_area = summary['highest_floor'].notna() & ~(summary[floors].fillna(0) > 0).any(axis=1)
+    summary = summary.astype({'highest_floor':object})
+    summary.loc[no_area,'highest_floor'] = floors[-1].replace('_floor_area','') if floors else np.nan
+    return summary
+
+def tables_version(data_dir):
+    """ Fingerprint of the four parquet tables (and their deltas) in data_dir that changes whenever one of them is rewritten. """
+    files = []
+    for table in ['PROP','IMP_INFO','IMP_DET','IMP_ATR']:
+        for path in [Path(f'{data_dir}/{table}.parquet'),Path(f'{data_dir}/{table}.delta')]:
+            if not path.exists():
+                continue
+            for file in sorted(path.rglob('*')) if path.is_dir() else [path]:
+                stat = file.stat()
+                files.append((table,str(file.relative_to(data_dir)),stat.st_size,stat.st_mtime_ns))
+    return hashlib.sha1(repr(files).encode()).hexdigest()
+
+def summary_version(path):
+    """ Summary format version and tables fingerprint a stored summary was built with, or last updated for. """
+    deltas = table_deltas(path)
+    metadata = fastparquet.ParquetFile(str(deltas[-1][1]) if deltas else path).key_value_metadata
+    return metadata.get('tcad_summary_version'),metadata.get('tcad_tables_version')
+
+@staged(rows_out=lambda rows:rows)
+def build_single_family_summary(data_dir,*,source=None):
+    """
+    Builds the single family summary for the whole county once and stores it as data_dir/SF_SUMMARY.parquet.
+
+    The file records SUMMARY_VERSION and a fingerprint of the tables it was built from (and optionally the
+    source export it came from), so Selector only uses it while it matches the tables next to it. Row groups
+    are clustered by zip code. Returns the number of properties in the summary.
+    """
+    summary = Selector(data_dir)._build_single_family_building_summary(present_columns=True)
+    return _write_summary(data_dir,summary,source)
+
+@staged(rows_in=lambda data_dir,prop_ids,**kwargs:len(prop_ids),rows_out=lambda rows:rows)
+def update_single_family_summary(data_dir,prop_ids,*,source=None,zips=None):
+    """
+    Rebuilds the rows of the stored summary for the given properties only, for use after an incremental
+    ingest changed them. They are stored as a delta of the summary (see table_deltas) and the rest of it is
+    kept as is. zips is the prop_id and situs_zip of the properties, read from PROP when not given; the
+    tables are sorted by both, so only the row groups of the properties' zip codes and prop_ids are read.
+    Returns the number of properties rebuilt.
+    """
+    prop_ids = np.unique(np.asarray(prop_ids,dtype='int64'))
+    path = Path(f'{data_dir}/{SUMMARY_FILE}')
+    if zips is None:
+        zips = read_table(f'{data_dir}/PROP.parquet',['prop_id','situs_zip'],isin={'prop_id':prop_ids})
+    zips = zips[zips['prop_id'].isin(prop_ids)]
+    tables = []
+    for table in ['PROP','IMP_INFO','IMP_DET','IMP_ATR']:
+        table_path = f'{data_dir}/{table}.parquet'
+        columns = [col for col in table_columns(table_path) if table == 'PROP' or col != 'situs_zip']
+        tables.append(read_table(table_path,columns,_zip_ranges(zips),{'prop_id':prop_ids}))
+    changed = Selector._copy(*tables)
+    if SINGLE_FAMILY in changed.imp_info_df['imprv_type_desc'].astype(object).tolist():
+        changed = changed._build_single_family_building_summary(present_columns=True)
+        cat_cols = changed.select_dtypes(['category']).columns
+        changed[cat_cols] = changed[cat_cols].astype(object)
+    else:
+        changed = None
+    stored = fastparquet.ParquetFile(str(path)).dtypes
+    if changed is not None and not set(changed.columns) <= set(stored):
+        # Columns the stored summary does not have yet, it is written again
+        summary = read_table(path)
+        summary = pd.concat([summary[~summary['prop_id'].isin(prop_ids)],changed],ignore_index=True)
+        _write_summary(data_dir,summary[[col for col in SUMMARY_COLUMNS+SUMMARY_EXTRA_COLUMNS+[SUMMARY_PRESENT_COLUMN] if col in summary]],source)
+        return len(changed)
+
+    versions = [int(version.name) for version in path.with_suffix('.delta').glob('*') if version.name.isdigit()]
+    delta = path.with_suffix('.delta')/f'{max(versions,default=0)+1:05d}'
+    delta.mkdir(parents=True)
+    if changed is not None and len(changed):
+        with stage('write_summary',len(changed)):
+            write_parquet(delta/'rows.parquet',_county_columns(changed,stored).sort_values(['situs_zip','prop_id'],ignore_index=True),
+                          write_index=False,object_encoding='utf8',stats=True)
+    # Written last, the delta is only applied once its keys exist
+    fastparquet.write(str(delta/'keys.parquet'),pd.DataFrame({'prop_id':prop_ids}),write_index=False,
+                      custom_metadata=_summary_metadata(data_dir,source))
+    return 0 if changed is None else len(changed)
+
+def _summary_metadata(data_dir,source=None):
+    metadata = {'tcad_summary_version':str(SUMMARY_VERSION),'tcad_tables_version':tables_version(data_dir)}
+    if source:
+        metadata['tcad_source_export'] = str(source)
+    return metadata
+
+def _write_summary(data_dir,summary,source=None):
+    summary = summary.sort_values('situs_zip',kind='stable',ignore_index=True)
+    cat_cols = summary.select_dtypes(['category']).columns
+    summary[cat_cols] = summary[cat_cols].astype(object)
+    codes,_ = pd.factorize(summary['situs_zip'])
+    row_groups = np.flatnonzero(np.r_[True,codes[1:] != codes[:-1]]).tolist() if len(summary) else [0]
+    with stage('write_summary',len(summary)):
+        write_parquet(f'{data_dir}/{SUMMARY_FILE}',summary,row_group_offsets=row_groups,write_index=False,
+                      object_encoding='utf8',stats=True,custom_metadata=_summary_metadata(data_dir,source))
+    shutil.rmtree(Path(f'{data_dir}/{SUMMARY_FILE}').with_suffix('.delta'),ignore_errors=True)
+    return len(summary)
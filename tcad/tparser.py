@@ -1,15 +1,47 @@
 # This file is named tparser because 'parser' is already a part of the standard python library.
+from concurrent.futures import FIRST_COMPLETED,ProcessPoolExecutor,wait
+from contextlib import nullcontext
 from io import BytesIO
+from functools import lru_cache
+import codecs,json,os,shutil,time
 import zipfile,requests
 from pathlib import Path
 
+import fastparquet
+import numpy as np
 import pandas as pd
 
+from tcad.lookup import lookup_index_current,update_lookup_index
+from tcad.profiling import disable_in_worker,record,stage,staged
+from tcad.selector import (DELTA_KEYS,SUMMARY_FILE,SUMMARY_VERSION,build_single_family_summary,isin_keys,read_table,
+                           summary_version,table_deltas,tables_version,update_single_family_summary,write_parquet)
+
 LAYOUT_URL = 'https://traviscad.org/wp-content/largefiles/Legacy8.0.25-Export-Layouts-07242023.zip'
 LAYOUT_FILE = 'Legacy8.0.25-Appraisal Export Layout07242023.xlsx'
 
 TCAD_DIR = 'data/raw/2023_Certified_Appraisal_Export_Supp_0_07232022'
 
+# Bump when the compiled schema format or the dtype rules change so cached schema files get rebuilt.
+SCHEMA_VERSION = 3
+
+# Columns each table's row groups are clustered on so readers can skip row groups by their statistics
+CLUSTER_ON = {'PROP':'situs_zip','IMP_INFO':'imprv_type_desc'}
+
+# Row groups only end on a change of the clustered column once they hold this many rows, every row group
+# repeats the per column overhead so smaller ones make writing and reading slower without pruning much more
+MIN_ROW_GROUP_ROWS = 10_000
+
+# The export is written in latin-1, one byte per character so fields start at the same byte and character offsets
+ENCODING = 'latin-1'
+
+# Text read_fwf reads as missing by default, the numpy engine treats it the same way
+NA_VALUES = {'','#N/A','#N/A N/A','#NA','-1.#IND','-1.#QNAN','-NaN','-nan','1.#IND','1.#QNAN','<NA>','N/A','NA','NULL','NaN',
+             'None','n/a','nan','null'}
+
+# Sparse or irrelevant property columns that are dropped by default
+PROP_FILTER = 'sup_|flag|mineral|ag_|rendition_|timber_|_agent_|py_|jan1_|appr_|ex_|mortgage_|(?<!co|en|so|pc)_exempt|qualify_yr|_prorate'
+
+@staged()
 def get_layout(url=LAYOUT_URL,*,skiprows=None,nrows=None,cache_dir='cache',filename=LAYOUT_FILE):
     """ Loads or downloads the layout excel file """
     if not Path(f'{cache_dir}/{filename}').exists():
@@ -21,7 +53,336 @@ def _to_parquet(df,export_filepath):
     """ Convenience function """
     dir, filename = export_filepath.rsplit('/',maxsplit=1) 
     Path(dir).mkdir(parents=True,exist_ok=True)
-    df.to_parquet(f'{dir}/{filename}')
+    with stage('write_parquet',len(df)):
+        df.to_parquet(f'{dir}/{filename}')
+
+def _layout_schema(layout):
+    """ Final dtype for each column in a layout: nullable numbers and categorical strings. """
+    dtypes = {'int16':'Int16','int32':'Int32','int64':'Int64','float32':'Float32','float64':'Float64'}
+    types = layout['dtype'] if 'dtype' in layout else layout.apply(lambda row:select_type(row),axis=1)
+    return {name:dtypes.get(dtype,dtype) if isinstance(dtype,str) else 'category' for name,dtype in zip(layout['Field Name'],types)}
+
+def _number_errors(table,name):
+    """
+    How a number column handles text that is not a number. Value columns get the same hyphen fix as optimize_memory
+    ('00-123' is 123) and other text becomes missing, except in IMP_DET which only ever coerced its values to numbers.
+    Text in any other number column, keys included, raises.
+    """
+    if not name.endswith(('_val','_value')):
+        return 'raise'
+    return 'coerce' if table == 'IMP_DET' else 'strip'
+
+def _layout_errors(layout):
+    """ _number_errors of each column of a layout, layouts from the workbook are not tied to a table. """
+    if 'errors' in layout:
+        return dict(zip(layout['Field Name'],layout['errors']))
+    return {name:_number_errors(None,name) for name in layout['Field Name']}
+
+def _to_number(values,errors):
+    """ Strings to numbers as _number_errors says, missing values are None. """
+    if errors == 'strip':
+        # Numeric fields occasionally come through as '00-123'
+        values = values.str.replace('00-','',regex=False)
+    numbers = pd.to_numeric(values,errors='coerce')
+    if errors == 'raise' and (bad := numbers.isna() & values.notna()).any():
+        raise ValueError(f"{values.name or 'number field'} has text that is not a number: {values[bad].iloc[0]!r}")
+    return numbers
+
+@staged('apply_schema',rows_in=lambda df,*args,**kwargs:len(df))
+def _apply_schema(df,schema,errors,categorize=True):
+    """ Types a frame that was read in as strings so every chunk ends up with identical dtypes. """
+    for col,dtype in schema.items():
+        if dtype == 'category':
+            if categorize:
+                df[col] = df[col].astype('category')
+            continue
+        df[col] = _to_number(df[col],errors[col]).astype(dtype)
+    return df
+
+@staged()
+def compile_schemas(*,cache_dir='cache',filename=LAYOUT_FILE):
+    """
+    Reads every table layout from the layout workbook once and stores the column offsets and
+    final dtypes in a versioned json file next to the workbook. Returns the path of that file.
+    """
+    layouts = {'PROP':load_property_layout(filter=False),'IMP_INFO':load_improvement_info_layout(),
+               'IMP_DET':load_improvement_details_layout(),'IMP_ATR':load_improvement_features_layout()}
+    tables = {table:[{'name':name,'start':int(start),'end':int(end),'dtype':dtype,'errors':_number_errors(table,name)}
+                     for (name,dtype),(start,end) in zip(_layout_schema(layout).items(),layout['col_spec'])]
+              for table,layout in layouts.items()}
+    path = _schema_path(cache_dir,filename)
+    path.parent.mkdir(parents=True,exist_ok=True)
+    path.write_text(json.dumps({'version':SCHEMA_VERSION,'layout_file':filename,'tables':tables},indent=1))
+    return path
+
+def _schema_path(cache_dir,filename):
+    return Path(cache_dir)/f'{Path(filename).stem}.schema.json'
+
+@lru_cache
+def _read_schemas(path,mtime):
+    return json.loads(Path(path).read_text())
+
+@staged()
+def load_schema(table,*,filter=True,cache_dir='cache',filename=LAYOUT_FILE):
+    """
+    Returns the compiled layout of a table ('PROP','IMP_INFO','IMP_DET' or 'IMP_ATR') with the same
+    'Field Name','col_spec' and 'dtype' columns as the load_*_layout functions.
+
+    The layout workbook is only read (which requires openpyxl) when there is no compiled schema for it yet
+    or the schema was compiled by an older version of this module.
+    """
+    path = _schema_path(cache_dir,filename)
+    schemas = _read_schemas(str(path),path.stat().st_mtime) if path.exists() else None
+    if not schemas or schemas['version'] != SCHEMA_VERSION or schemas['layout_file'] != filename:
+        path = compile_schemas(cache_dir=cache_dir,filename=filename)
+        schemas = _read_schemas(str(path),path.stat().st_mtime)
+    layout = pd.DataFrame(schemas['tables'][table])
+    layout = pd.DataFrame({'Field Name':layout['name'],'col_spec':list(zip(layout['start'],layout['end'])),'dtype':layout['dtype'],
+                           'errors':layout['errors']})
+    if table == 'PROP' and filter:
+        layout = layout[~layout['Field Name'].str.contains(PROP_FILTER,regex=True)].reset_index(drop=True)
+    return layout
+
+def _parse_chunked(input_file,layout,export_file,chunksize,engine='fwf',cluster_on=None,encoding=ENCODING):
+    """ Streams a fixed width file into a parquet file without loading the whole file. """
+    if not export_file:
+        raise ValueError("export_file is required when parsing in chunks")
+    if engine == 'numpy' and isinstance(input_file,zipfile.Path):
+        chunks = (_decode_records(records,layout,encoding) for records in _stream_records(input_file,chunksize))
+    elif engine == 'numpy':
+        records = _fixed_width_records(input_file)
+        chunks = (_decode_records(records[start:start+chunksize],layout,encoding) for start in range(0,len(records),chunksize))
+    else:
+        chunks = _read_fwf_chunks(input_file,layout,chunksize,encoding)
+    _to_parquet_chunked(chunks,export_file,cluster_on,_empty_frame(layout,encoding))
+
+def _empty_frame(layout,encoding=ENCODING):
+    """ A frame without rows that has the columns and dtypes of the layout schema. """
+    return _decode_records(np.empty((0,1),dtype=np.uint8),layout,encoding)
+
+def _read_fwf_chunks(input_file,layout,chunksize,encoding=ENCODING):
+    """ Reads a fixed width file with read_fwf in chunks typed by the layout schema. """
+    schema,errors = _layout_schema(layout),_layout_errors(layout)
+    with _open_export(input_file) as f:
+        reader = pd.read_fwf(f,names=layout['Field Name'].tolist(),colspecs=layout['col_spec'].tolist(),
+                             header=None,dtype=str,chunksize=chunksize,encoding=encoding)
+        while True:
+            # Not a for loop so the read is timed on its own, a stage must not span a yield
+            with stage('read_fwf') as event:
+                chunk = event.output(next(reader,None))
+            if chunk is None:
+                break
+            yield _apply_schema(chunk,schema,errors,categorize=False)
+
+def _open_export(input_file):
+    """ Export files inside a zip archive (zipfile.Path) are read as a stream of the decompressed member. """
+    return input_file.open('rb') if isinstance(input_file,zipfile.Path) else nullcontext(input_file)
+
+def _row_group_offsets(keys,min_rows,max_rows=None):
+    """
+    Start of every row group of rows sorted by keys: a row group ends where the key changes once it holds
+    min_rows rows, and after max_rows rows in any case. The statistics of row groups that hold few keys each
+    let readers skip the ones they do not filter on.
+    """
+    offsets,start = [0],0
+    for end in [*(np.flatnonzero(keys[1:] != keys[:-1])+1).tolist(),len(keys)]:
+        while max_rows and end-start > max_rows:
+            start += max_rows
+            offsets.append(start)
+        if end-start >= min_rows and end < len(keys):
+            offsets.append(end)
+            start = end
+    return offsets
+
+def _to_parquet_chunked(chunks,export_file,cluster_on=None,empty=None):
+    """ Writes each chunk as its own row group so memory is bounded by the chunk size.
+
+    Numbers keep their nullable dtypes, see write_parquet. Without any chunks, empty (a frame without rows)
+    is written instead when given so the file still has the columns.
+
+    Strings are kept as plain strings on disk since categories would differ from one row group to the next.
+    With cluster_on, each chunk is sorted by that column and split into row groups that end where its value
+    changes (see _row_group_offsets), so the row group statistics let readers skip the values they do not filter on.
+    """
+    Path(export_file).parent.mkdir(parents=True,exist_ok=True)
+    append = False
+    for chunk in chunks:
+        cat_cols = chunk.select_dtypes(['category']).columns
+        chunk[cat_cols] = chunk[cat_cols].astype(object)
+        with stage('write_row_groups',len(chunk)) as event:
+            row_groups = [0]
+            if cluster_on and len(chunk):
+                chunk = chunk.sort_values(cluster_on,kind='stable',ignore_index=True)
+                codes,_ = pd.factorize(chunk[cluster_on])
+                row_groups = _row_group_offsets(codes,MIN_ROW_GROUP_ROWS)
+            write_parquet(export_file,chunk,row_group_offsets=row_groups,append=append,write_index=False,
+                          object_encoding='utf8',stats=True)
+            event.output(chunk)
+        append = True
+    if not append and empty is not None:
+        return _to_parquet_chunked([empty],export_file)
+    return append
+
+def _parse(input_file,layout,engine,optimize=True,encoding=ENCODING):
+    """ Reads a whole fixed width file with the selected engine, typed by the layout schema unless optimize is False. """
+    if engine == 'numpy':
+        return _decode_records(_fixed_width_records(input_file),layout,encoding)
+    if engine != 'fwf':
+        raise ValueError("engine must be 'fwf' or 'numpy'")
+    with _open_export(input_file) as f, stage('read_fwf') as event:
+        if not optimize:
+            return event.output(pd.read_fwf(f,names=layout['Field Name'].tolist(),header=None,colspecs=layout['col_spec'].tolist(),
+                                            encoding=encoding))
+        df = event.output(pd.read_fwf(f,names=layout['Field Name'].tolist(),header=None,colspecs=layout['col_spec'].tolist(),dtype=str,
+                                      encoding=encoding))
+    return _apply_schema(df,_layout_schema(layout),_layout_errors(layout))
+
+@staged('read_records')
+def _fixed_width_records(input_file):
+    """
+    Memory maps a file of fixed length records as a 2d array of bytes, one row per record (newline included).
+    A member of a zip archive cannot be mapped and is decompressed into memory instead.
+    """
+    if isinstance(input_file,zipfile.Path):
+        with input_file.open('rb') as f:
+            return _as_records(np.frombuffer(f.read(),dtype=np.uint8),input_file)
+    if Path(input_file).stat().st_size == 0:
+        return np.empty((0,1),dtype=np.uint8)
+    return _as_records(np.memmap(input_file,dtype=np.uint8,mode='r'),input_file)
+
+def _stream_records(input_file,chunksize):
+    """ Reads a zip archive member of fixed length records chunksize records at a time. """
+    with input_file.open('rb') as f:
+        first = f.readline()
+        data = first + f.read(len(first)*(chunksize-1))
+        while data:
+            yield _as_records(np.frombuffer(data,dtype=np.uint8),input_file)
+            data = f.read(len(first)*chunksize)
+
+def _as_records(data,input_file):
+    if len(data) == 0:
+        return np.empty((0,1),dtype=np.uint8)
+    newlines = np.flatnonzero(data[:1<<16] == ord('\n'))
+    record_len = newlines[0]+1 if len(newlines) else len(data)
+    if short := len(data) % record_len:
+        # Like read_fwf, accept a last record without its line ending or with its trailing blanks cut off
+        eol = b'\r\n' if record_len > 1 and data[record_len-2] == ord('\r') else b'\n'
+        last = bytes(data[len(data)-short:]).rstrip(b'\r\n')
+        if b'\n' in last or len(last) > record_len-len(eol):
+            raise ValueError(f"{input_file} does not contain records of equal length, use engine='fwf' instead")
+        tail = [np.frombuffer(last.ljust(record_len-len(eol))+eol,dtype=np.uint8)] if last else []
+        data = np.concatenate([data[:len(data)-short],*tail])
+    records = data.reshape(-1,record_len)
+    if len(newlines) and (records[:,-1] != ord('\n')).any():
+        raise ValueError(f"{input_file} does not contain records of equal length, use engine='fwf' instead")
+    return records
+
+@staged('decode_records',rows_in=lambda records,*args,**kwargs:len(records))
+def _decode_records(records,layout,encoding=ENCODING):
+    """
+    Decodes a 2d array of fixed width records into a dataframe typed by the layout schema.
+
+    Fields are sliced out as columns of the byte array so no python string is created per cell.
+    Numbers are accumulated digit by digit across the whole column and strings become categories
+    that are decoded once per unique value. Fields are sliced by byte, so the encoding must have one
+    byte per character for the fields to line up with the characters read_fwf slices.
+    """
+    if not _single_byte(encoding):
+        raise ValueError(f"engine='numpy' needs an encoding with one byte per character, not {encoding}, use engine='fwf' instead")
+    schema,errors = _layout_schema(layout),_layout_errors(layout)
+    width = _record_width(records)
+    df = {}
+    for name,(start,end) in zip(layout['Field Name'],layout['col_spec']):
+        block = records[:,min(start,width):min(end,width)]
+        if schema[name] == 'category':
+            df[name] = _decode_strings(block,encoding)
+        else:
+            df[name] = _cast_numbers(_decode_numbers(block,encoding,errors[name]),schema[name])
+    return pd.DataFrame(df)
+
+@lru_cache
+def _single_byte(encoding):
+    """ Whether every byte decodes to a character on its own, which a multi byte encoding like utf-8 holds back. """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    return all(decoder.decode(bytes([byte])) for byte in range(256))
+
+def _cast_numbers(values,dtype):
+    """
+    values.astype(dtype), except that values which do not fit an integer dtype (negative, too large or
+    fractional) raise the same TypeError as the fwf engine's astype instead of wrapping around or truncating.
+    """
+    target = pd.api.types.pandas_dtype(dtype)
+    if pd.api.types.is_integer_dtype(target):
+        known = values.dropna()
+        info = np.iinfo(target.numpy_dtype)
+        if len(known) and ((known % 1 != 0).any() or known.min() < info.min or known.max() > info.max):
+            raise TypeError(f"cannot safely cast non-equivalent {values.dtype.numpy_dtype} to {target.numpy_dtype}")
+    return values.astype(target)
+
+def _record_width(records):
+    """ Width of the records without their line ending, which is not part of any field. """
+    eol = bytes(records[0,-2:]) if len(records) else b''
+    return records.shape[1] - (2 if eol == b'\r\n' else 1 if eol.endswith(b'\n') else 0)
+
+def _decode_strings(block,encoding):
+    """ Strips and decodes each unique value in a block of fixed width text into a categorical. """
+    if block.shape[1] == 0:
+        return pd.Categorical([None]*len(block))
+    values = np.ascontiguousarray(block).view(f'S{block.shape[1]}').ravel()
+    uniques,inverse = np.unique(values,return_inverse=True)
+    labels = [value.decode(encoding).strip(' \t') for value in uniques]
+    labels = [None if label in NA_VALUES else label for label in labels]
+    # Different paddings of the same value collapse into one category, sorted like astype('category') sorts them
+    labels = pd.Series(labels,dtype=object)
+    categories = pd.Index(labels.dropna().unique()).sort_values()
+    return pd.Categorical.from_codes(categories.get_indexer(labels)[inverse.ravel()],categories=categories)
+
+def _decode_numbers(block,encoding,errors='raise'):
+    """
+    Parses a block of right aligned numbers without going through strings.
+
+    Rows that are not a plain (optionally signed or decimal) number go through the same
+    string based conversion as the fwf engine (see _number_errors) so both engines return identical values.
+    """
+    n,width = block.shape
+    if width == 0:
+        return pd.Series(pd.array([None]*n,dtype='Float64'))
+    digit = (block >= 48) & (block <= 57)
+    space = (block == 32) | (block == 9)
+    dot = block == 46
+    minus = block == 45
+    filled = ~space
+    mantissa = np.zeros(n,dtype=np.int64)
+    scale = np.zeros(n,dtype=np.int64)
+    after_dot = np.zeros(n,dtype=bool)
+    for j in range(width):
+        mantissa = np.where(digit[:,j],mantissa*10+(block[:,j].astype(np.int64)-48),mantissa)
+        scale += digit[:,j] & after_dot
+        after_dot |= dot[:,j]
+    first = np.where(filled.any(axis=1),filled.argmax(axis=1),0)
+    last = width-1-filled[:,::-1].argmax(axis=1)
+    has_digits = digit.any(axis=1)
+    bad = ((filled & ~(digit|dot|minus)).any(axis=1)
+           | (filled.sum(axis=1) != np.where(filled.any(axis=1),last-first+1,0))
+           | (dot.sum(axis=1) > 1)
+           | (minus.sum(axis=1) > 1)
+           | (minus.any(axis=1) & (block[np.arange(n),first] != 45))
+           | (filled.any(axis=1) & ~has_digits)
+           # More digits than the int64 mantissa holds
+           | (digit.sum(axis=1) > 18))
+    missing = ~has_digits
+    sign = np.where(minus.any(axis=1),-1,1)
+    if scale.any():
+        values = pd.arrays.FloatingArray(sign*mantissa/10.0**scale,missing)
+    else:
+        values = pd.arrays.IntegerArray(sign*mantissa,missing)
+    values = pd.Series(values)
+    if bad.any():
+        raw = pd.Series([value.decode(encoding).strip(' \t') for value in np.ascontiguousarray(block[bad]).view(f'S{width}').ravel()])
+        raw = raw.where(~raw.isin(NA_VALUES),None)
+        values = values.astype('Float64')
+        values[bad] = _to_number(raw,errors).to_numpy(dtype='float64',na_value=np.nan)
+    return values
 
 def load_improvement_info_layout():
     """ Loads in header info and metadata for improvement info file."""
@@ -29,26 +390,53 @@ def load_improvement_info_layout():
     imp_info_layout['col_spec'] = imp_info_layout.apply(lambda row:(row['Start']-1,row['End']),axis=1)
     return imp_info_layout
 
-def parse_improvement_info(input_file=f'{TCAD_DIR}/IMP_INFO.TXT',*,export_file=None,optimize=True):
-    """ Load and parse improvement info data. """
-    imp_info_layout = load_improvement_info_layout()
-    imp_info_df = pd.read_fwf(input_file,names=imp_info_layout['Field Name'].tolist(),header=None,colspecs=imp_info_layout['col_spec'].tolist())
-    if optimize:
-        imp_info_df = optimize_memory(imp_info_df)
+@staged()
+def parse_improvement_info(input_file=f'{TCAD_DIR}/IMP_INFO.TXT',*,export_file=None,optimize=True,chunksize=None,engine='fwf',encoding=ENCODING):
+    """ Load and parse improvement info data.
+
+    Columns are typed by the compiled schema as they are decoded; optimize=False returns read_fwf's own inference instead.
+    If chunksize is given, the file is streamed into export_file chunksize records at a time and nothing is returned.
+    engine='numpy' decodes the memory mapped file directly instead of using read_fwf.
+    Both engines decode text with encoding, the numpy engine only takes encodings with one byte per character.
+    input_file can also be a file inside the export zip (see find_export_file), which is read as a stream when chunksize is given.
+    """
+    imp_info_layout = load_schema('IMP_INFO')
+    if chunksize:
+        return _parse_chunked(input_file,imp_info_layout,export_file,chunksize,engine,CLUSTER_ON['IMP_INFO'],encoding)
+    imp_info_df = _parse(input_file,imp_info_layout,engine,optimize,encoding)
     if export_file:
         _to_parquet(imp_info_df,export_file)
     return imp_info_df
 
-def parse_improvement_details(input_file=f'{TCAD_DIR}/IMP_DET.TXT',*,export_file=None):
-    """ Load and parse improvement details data. """
-    imp_det_df = pd.read_fwf(input_file,widths=[12,4,12,12,10,25,10,4,4,15,14],header=None,
-            names=['prop_id','prop_val_yr','imprv_id','imprv_det_id','Imprv_det_type_cd',
-                   'Imprv_det_type_desc','Imprv_det_class_cd','yr_built','depreciation_yr',
-                   'imprv_det_area','imprv_det_val'],dtype={'prop_id':'UInt32','prop_val_yr':'UInt16','imprv_id':'UInt32','imprv_det_id':'UInt32','Imprv_det_type_cd':'category',
-                   'Imprv_det_type_desc':'category','Imprv_det_class_cd':'category','yr_built':'UInt16','depreciation_yr':'UInt16',
-                   'imprv_det_area':'Float32'})
-    imp_det_df['imprv_det_area'] = imp_det_df['imprv_det_area'].astype("UInt32")
-    imp_det_df['imprv_det_val'] = pd.to_numeric(imp_det_df['imprv_det_val'],errors='coerce').astype('UInt32')
+IMP_DET_WIDTHS = [12,4,12,12,10,25,10,4,4,15,14]
+IMP_DET_NAMES = ['prop_id','prop_val_yr','imprv_id','imprv_det_id','Imprv_det_type_cd',
+                 'Imprv_det_type_desc','Imprv_det_class_cd','yr_built','depreciation_yr',
+                 'imprv_det_area','imprv_det_val']
+IMP_DET_DTYPES = {'prop_id':'UInt32','prop_val_yr':'UInt16','imprv_id':'UInt32','imprv_det_id':'UInt32','Imprv_det_type_cd':'category',
+                  'Imprv_det_type_desc':'category','Imprv_det_class_cd':'category','yr_built':'UInt16','depreciation_yr':'UInt16',
+                  'imprv_det_area':'UInt32','imprv_det_val':'UInt32'}
+
+def load_improvement_details_layout():
+    """ Builds a layout for the improvement details file from the hard-coded widths. """
+    ends = pd.Series(IMP_DET_WIDTHS).cumsum()
+    imp_det_layout = pd.DataFrame({'Field Name':IMP_DET_NAMES,'Start':ends-pd.Series(IMP_DET_WIDTHS)+1,'End':ends})
+    imp_det_layout['col_spec'] = imp_det_layout.apply(lambda row:(row['Start']-1,row['End']),axis=1)
+    imp_det_layout['dtype'] = imp_det_layout['Field Name'].map(IMP_DET_DTYPES)
+    return imp_det_layout
+
+@staged()
+def parse_improvement_details(input_file=f'{TCAD_DIR}/IMP_DET.TXT',*,export_file=None,chunksize=None,engine='fwf',encoding=ENCODING):
+    """ Load and parse improvement details data.
+
+    If chunksize is given, the file is streamed into export_file chunksize records at a time and nothing is returned.
+    engine='numpy' decodes the memory mapped file directly instead of using read_fwf.
+    Both engines decode text with encoding, the numpy engine only takes encodings with one byte per character.
+    input_file can also be a file inside the export zip (see find_export_file), which is read as a stream when chunksize is given.
+    """
+    imp_det_layout = load_schema('IMP_DET')
+    if chunksize:
+        return _parse_chunked(input_file,imp_det_layout,export_file,chunksize,engine,encoding=encoding)
+    imp_det_df = _parse(input_file,imp_det_layout,engine,encoding=encoding)
     if export_file:
         _to_parquet(imp_det_df,export_file)
     return imp_det_df
@@ -59,11 +447,20 @@ def load_improvement_features_layout():
     imp_atr_layout['dtype']=imp_atr_layout.apply(lambda row:select_type(row),axis=1)
     return imp_atr_layout
 
-def parse_improvement_features(input_file=f'{TCAD_DIR}/IMP_ATR.TXT',*,export_file=None,optimize=True):
-    imp_atr_layout = load_improvement_features_layout()
-    imp_atr_df = pd.read_fwf(input_file,names=imp_atr_layout['Field Name'].tolist(),header=None,colspecs=imp_atr_layout['col_spec'].tolist())
-    if optimize:
-        imp_atr_df = optimize_memory(imp_atr_df)
+@staged()
+def parse_improvement_features(input_file=f'{TCAD_DIR}/IMP_ATR.TXT',*,export_file=None,optimize=True,chunksize=None,engine='fwf',encoding=ENCODING):
+    """ Load and parse improvement features data.
+
+    Columns are typed by the compiled schema as they are decoded; optimize=False returns read_fwf's own inference instead.
+    If chunksize is given, the file is streamed into export_file chunksize records at a time and nothing is returned.
+    engine='numpy' decodes the memory mapped file directly instead of using read_fwf.
+    Both engines decode text with encoding, the numpy engine only takes encodings with one byte per character.
+    input_file can also be a file inside the export zip (see find_export_file), which is read as a stream when chunksize is given.
+    """
+    imp_atr_layout = load_schema('IMP_ATR')
+    if chunksize:
+        return _parse_chunked(input_file,imp_atr_layout,export_file,chunksize,engine,encoding=encoding)
+    imp_atr_df = _parse(input_file,imp_atr_layout,engine,optimize,encoding)
     if export_file:
         _to_parquet(imp_atr_df,export_file)
     return imp_atr_df
@@ -75,20 +472,559 @@ def load_property_layout(filter=True):
     prop_layout = prop_layout.loc[~prop_layout['Field Name'].isin(['filler','mineral_lease_name','mineral_lease_operator'])]
     prop_layout['dtype'] = prop_layout.apply(lambda row:select_type(row),axis=1)
     if filter:
-        return prop_layout[~prop_layout['Field Name'].str.contains('sup_|flag|mineral|ag_|rendition_|timber_|_agent_|py_|jan1_|appr_|ex_|mortgage_|(?<!co|en|so|pc)_exempt|qualify_yr|_prorate',regex=True)].reset_index(drop=True)
+        return prop_layout[~prop_layout['Field Name'].str.contains(PROP_FILTER,regex=True)].reset_index(drop=True)
     return prop_layout
 
-def parse_property_details(input_file=f'{TCAD_DIR}/PROP.TXT',*,export_file=None,optimize=True,filter=True):
-    property_layout = load_property_layout(filter=filter)
-    prop_df = pd.read_fwf(input_file,names=property_layout['Field Name'].tolist(),
-                      colspecs=property_layout['col_spec'].tolist(),header=None)
-    if optimize:
-        prop_df = optimize_memory(prop_df)
+@staged()
+def parse_property_details(input_file=f'{TCAD_DIR}/PROP.TXT',*,export_file=None,optimize=True,filter=True,chunksize=None,engine='fwf',encoding=ENCODING):
+    """ Load and parse property data.
+
+    Columns are typed by the compiled schema as they are decoded; optimize=False returns read_fwf's own inference instead.
+    If chunksize is given, the file is streamed into export_file chunksize records at a time and nothing is returned.
+    This keeps memory use flat for PROP.TXT, which is by far the largest file in the export. The streamed row groups
+    are clustered by zip code so Selector can read a few zip codes without touching the rest of the file.
+    engine='numpy' decodes the memory mapped file directly instead of using read_fwf.
+    Both engines decode text with encoding, the numpy engine only takes encodings with one byte per character.
+    input_file can also be a file inside the export zip (see find_export_file), which is read as a stream when chunksize is given.
+    """
+    property_layout = load_schema('PROP',filter=filter)
+    if chunksize:
+        return _parse_chunked(input_file,property_layout,export_file,chunksize,engine,CLUSTER_ON['PROP'],encoding)
+    prop_df = _parse(input_file,property_layout,engine,optimize,encoding)
     if export_file:
         _to_parquet(prop_df,export_file)
         # prop_df.to_parquet(export_file)
     return prop_df
 
+TABLES = {'PROP':'PROP.TXT','IMP_INFO':'IMP_INFO.TXT','IMP_DET':'IMP_DET.TXT','IMP_ATR':'IMP_ATR.TXT'}
+
+def find_export_file(export,filename):
+    """
+    Path of one of the export files (e.g. 'PROP.TXT') in an extracted export directory, or a zipfile.Path to it
+    when export is the export zip itself, which every parse function and ingest read without extracting it.
+    Export file names are not consistently upper case.
+    """
+    if zipfile.is_zipfile(export):
+        with zipfile.ZipFile(export) as archive:
+            matches = [name for name in archive.namelist() if name.rstrip('/').rsplit('/',1)[-1].upper() == filename]
+        if matches:
+            return zipfile.Path(export,at=matches[0])
+    else:
+        matches = [path for path in Path(export).iterdir() if path.name.upper() == filename]
+        if matches:
+            return matches[0]
+    raise FileNotFoundError(f"{filename} not found in {export}")
+
+def _export_blocks(input_file,split_size):
+    """
+    Splits an export file into blocks of roughly split_size that start and end on record boundaries, as
+    (input,byte_range) pairs. Blocks of a file on disk are only its byte ranges, workers read them themselves.
+    A zip archive member is decompressed once, as a stream, and each block carries its own bytes.
+    """
+    if not isinstance(input_file,zipfile.Path):
+        for byte_range in _record_ranges(input_file,split_size):
+            yield input_file,byte_range
+        return
+    start = 0
+    with input_file.open('rb') as f:
+        while block := f.read(split_size):
+            block += f.readline()
+            yield block,(start,start+len(block))
+            start += len(block)
+    if start == 0:
+        yield b'',(0,0)
+
+def _record_ranges(input_file,split_size):
+    """ Splits a file into byte ranges of roughly split_size that start and end on record boundaries. """
+    size = Path(input_file).stat().st_size
+    bounds = [0]
+    with open(input_file,'rb') as f:
+        while bounds[-1] + split_size < size:
+            f.seek(bounds[-1] + split_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1],bounds[1:]))
+
+def _range_records(input_file,byte_range):
+    """ Records of a byte range of a file, or of a block of bytes read from a zip archive (see _export_blocks). """
+    if isinstance(input_file,bytes):
+        return _as_records(np.frombuffer(input_file,dtype=np.uint8),'block')
+    start,end = byte_range
+    if end == start:
+        return np.empty((0,1),dtype=np.uint8)
+    # Only the range is mapped, so a last record that has to be padded (see _as_records) copies one block, not the file
+    return _as_records(np.memmap(input_file,dtype=np.uint8,mode='r',offset=start,shape=(end-start,)),input_file)
+
+def _parse_range(input_file,layout,byte_range,export_file,chunksize,engine,cluster_on=None,keys=None,encoding=ENCODING):
+    """
+    Parses one byte range of an export file into its own parquet file. Runs in a worker process.
+    With keys (a dataframe of key values), only the records of those keys are parsed.
+    """
+    started = time.time()
+    start,end = byte_range
+    if engine == 'numpy':
+        records = _range_records(input_file,byte_range)
+        chunks = (records[i:i+chunksize] for i in range(0,len(records),chunksize))
+        if keys is not None:
+            chunks = (chunk[_record_isin(chunk,layout,keys)] for chunk in chunks)
+        chunks = (_decode_records(chunk,layout,encoding) for chunk in chunks if len(chunk))
+    elif keys is not None:
+        raise ValueError("incremental ingest needs engine='numpy'")
+    elif isinstance(input_file,bytes):
+        chunks = _read_fwf_chunks(BytesIO(input_file),layout,chunksize,encoding)
+    else:
+        with open(input_file,'rb') as f:
+            f.seek(start)
+            chunks = _read_fwf_chunks(BytesIO(f.read(end-start)),layout,chunksize,encoding)
+    rows = 0
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+    # Full parses always write a part, so a table without records still has its columns
+    written = _to_parquet_chunked(counted(chunks),export_file,cluster_on,_empty_frame(layout,encoding) if keys is None else None)
+    return export_file if written else None,rows,started,time.time()
+
+def _prop_zips(out_dir):
+    """ prop_id and situs_zip of every property in out_dir/PROP.parquet (deltas applied), None without it. """
+    path = Path(out_dir)/'PROP.parquet'
+    if not path.exists() or (path.is_dir() and not any(path.iterdir())):
+        return None
+    zips = read_table(path,['prop_id','situs_zip']).astype({'situs_zip':object})
+    return zips.dropna(subset=['prop_id']).drop_duplicates('prop_id',keep='last')
+
+def _moved_props(out_dir,parts):
+    """ prop_ids whose situs_zip in the PROP part files of a new delta differs from the one in out_dir. """
+    zips = _prop_zips(out_dir)
+    if not parts or zips is None:
+        return np.array([],dtype='int64')
+    new = pd.concat([fastparquet.ParquetFile(part).to_pandas(columns=['prop_id','situs_zip']) for part in parts],ignore_index=True)
+    merged = new.astype({'prop_id':'int64'}).merge(zips.astype({'prop_id':'int64'}),on='prop_id',suffixes=('_new','_old'))
+    moved = merged['situs_zip_new'].fillna('').astype(str) != merged['situs_zip_old'].fillna('').astype(str)
+    return np.unique(merged.loc[moved,'prop_id'].to_numpy())
+
+# Least rows read at a time from each sorted run when the runs of a table are merged, more when the runs are few
+# enough to share max_rows. fastparquet writes and reads many small row groups slowly.
+MERGE_ROWS = 10_000
+
+def _cluster_dataset(path,zips,min_rows,max_rows):
+    """
+    Rewrites a parquet dataset written by ingest as one part file sorted by situs_zip and prop_id, with row
+    groups that end on zip code boundaries (see _row_group_offsets). zips (prop_id and situs_zip, see
+    _prop_zips) sets the situs_zip column of an improvement table. Runs in a worker process.
+
+    The sort is external so memory is bounded by max_rows rather than the table: the dataset is read about
+    max_rows rows at a time, each block is sorted into a run file, and the runs are merged a few rows at a time.
+    """
+    started = time.time()
+    path = Path(path)
+    parts = sorted(path.glob('part.*.parquet'))
+    rows = sum(fastparquet.ParquetFile(str(part)).count() for part in parts)
+    if not rows:
+        return 0,started,time.time()
+    tmp = path/'_cluster'
+    shutil.rmtree(tmp,ignore_errors=True)
+    tmp.mkdir()
+    step = max(max_rows//-(-rows//max_rows),MERGE_ROWS)
+    runs,zip_codes = [],set()
+    for block in _blocks((df for part in parts for df in _row_groups(part)),max_rows):
+        if zips is not None:
+            positions = pd.Index(zips['prop_id'].to_numpy(dtype='int64')).get_indexer(block['prop_id'].to_numpy(dtype='int64',na_value=-1))
+            block['situs_zip'] = np.append(zips['situs_zip'].to_numpy(dtype=object),None)[positions]
+        codes = pd.factorize(block['situs_zip'],sort=True)[0] if 'situs_zip' in block else np.zeros(len(block),dtype='int64')
+        block = block.take(np.lexsort([block['prop_id'].to_numpy(dtype='int64',na_value=-1),codes])).reset_index(drop=True)
+        zip_codes.update(block['situs_zip'].dropna().unique() if 'situs_zip' in block else [])
+        runs.append(tmp/f'run.{len(runs):05d}.parquet')
+        write_parquet(runs[-1],block,row_group_offsets=step,write_index=False,object_encoding='utf8',stats=False)
+    clustered = tmp/'clustered.parquet'
+    _merge_runs(runs,clustered,np.array(sorted(zip_codes),dtype=object),min_rows,max_rows)
+    for old in [*parts,path/'_metadata',path/'_common_metadata']:
+        old.unlink(missing_ok=True)
+    clustered.rename(path/'part.00000.parquet')
+    shutil.rmtree(tmp)
+    fastparquet.writer.merge([str(path/'part.00000.parquet')])
+    return rows,started,time.time()
+
+def _row_groups(path):
+    """ Row groups of a parquet file one at a time, with the dtypes pd.read_parquet reads the file with. """
+    pf = fastparquet.ParquetFile(str(path))
+    # fastparquet reads Float64 columns back as float64
+    floats = {col['name']:col['numpy_type'] for col in json.loads(pf.key_value_metadata['pandas'])['columns']
+              if col['numpy_type'] in ('Float32','Float64')}
+    for df in pf.iter_row_groups():
+        yield df.astype(floats)
+
+def _blocks(frames,rows):
+    """ Concatenates a stream of frames into blocks of at least rows rows, except the last one. """
+    block,size = [],0
+    for df in frames:
+        block.append(df)
+        size += len(df)
+        if size >= rows:
+            yield pd.concat(block,ignore_index=True)
+            block,size = [],0
+    if block:
+        yield pd.concat(block,ignore_index=True)
+
+def _cluster_keys(df,zip_codes):
+    """ Position of each row's situs_zip in the sorted zip_codes and its prop_id, both -1 when missing. """
+    codes = pd.Categorical(df['situs_zip'],categories=zip_codes).codes.astype('int64') if 'situs_zip' in df else np.zeros(len(df),dtype='int64')
+    return codes,df['prop_id'].to_numpy(dtype='int64',na_value=-1)
+
+def _sorted_count(codes,prop_ids,key,side):
+    """ Number of rows sorted by (codes,prop_ids) that sort before key, or also equal to it with side='right'. """
+    lo,hi = np.searchsorted(codes,key[0],'left'),np.searchsorted(codes,key[0],'right')
+    return int(lo + np.searchsorted(prop_ids[lo:hi],key[1],side))
+
+def _merge_runs(runs,export_file,zip_codes,min_rows,max_rows):
+    """
+    Merges run files that are each sorted by situs_zip and prop_id into one file sorted the same way, stable in
+    the order of the runs, with row groups cut by _row_group_offsets. Only a row group of every run and the rows
+    of the row group being filled are held at once.
+    """
+    readers = [_row_groups(run) for run in runs]
+    def head(reader):
+        df = next(reader,None)
+        return None if df is None else (df,*_cluster_keys(df,zip_codes))
+    heads = [head(reader) for reader in readers]
+    pending,append = None,False
+    while any(heads):
+        # Every run is sorted, so no row to come sorts before the smallest last key of the rows held. Rows of that
+        # key are only taken from the runs up to the first one that ends on it, which may have more of them to come.
+        last = min((codes[-1],prop_ids[-1]) for _,codes,prop_ids in filter(None,heads))
+        first = min(i for i,held in enumerate(heads) if held and (held[1][-1],held[2][-1]) == last)
+        taken = [pending] if pending else []
+        for i,held in enumerate(heads):
+            if not held:
+                continue
+            n = _sorted_count(held[1],held[2],last,'right' if i <= first else 'left')
+            taken.append(tuple(part[:n] for part in held))
+            heads[i] = tuple(part[n:] for part in held) if n < len(held[0]) else head(readers[i])
+        codes,prop_ids = np.concatenate([codes for _,codes,_ in taken]),np.concatenate([prop_ids for _,_,prop_ids in taken])
+        order = np.lexsort([prop_ids,codes])
+        merged = pd.concat([df for df,_,_ in taken],ignore_index=True).take(order).reset_index(drop=True)
+        codes,prop_ids = codes[order],prop_ids[order]
+        offsets = _row_group_offsets(codes,min_rows,max_rows)
+        # Row groups before the last one are final, the last one can still grow
+        done = offsets[-1] if any(heads) else len(merged)
+        if done:
+            write_parquet(export_file,merged.iloc[:done],row_group_offsets=[offset for offset in offsets if offset < done],append=append,
+                          write_index=False,object_encoding='utf8',stats=True)
+            append = True
+        pending = (merged.iloc[done:],codes[done:],prop_ids[done:])
+
+def _bounded_submit(pool,limit):
+    """ pool.submit that first waits while limit tasks are pending, so at most limit blocks read from a zip are held at once. """
+    pending = set()
+    def submit(func,*args):
+        nonlocal pending
+        pending = {future for future in pending if not future.done()}
+        while len(pending) >= limit:
+            _,pending = wait(pending,return_when=FIRST_COMPLETED)
+        future = pool.submit(func,*args)
+        pending.add(future)
+        return future
+    return submit
+
+def _mix(values):
+    """ splitmix64 finalizer, spreads the bits of 64 bit values. """
+    values = values.astype(np.uint64)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94d049bb133111eb)
+    values ^= values >> np.uint64(31)
+    return values
+
+def _record_keys(records,layout,keys):
+    """ Key columns of a block of records as int64 arrays, -1 where a key is missing. """
+    width = _record_width(records)
+    spec = dict(zip(layout['Field Name'],layout['col_spec']))
+    return {key:_decode_numbers(records[:,min(spec[key][0],width):min(spec[key][1],width)],'latin-1').to_numpy(dtype='int64',na_value=-1)
+            for key in keys}
+
+def _record_isin(records,layout,keys):
+    """ Mask of the records whose key columns match a row of keys. """
+    return isin_keys(pd.DataFrame(_record_keys(records,layout,keys.columns)),keys)
+
+def _record_hashes(records,layout):
+    """
+    64 bit hash of the bytes of each record that belong to the layout's fields, so fields dropped by the
+    layout and line endings do not count. The bytes are read as 64 bit words and combined with a weighted sum.
+    """
+    width = _record_width(records)
+    cols = np.concatenate([np.arange(min(start,width),min(end,width)) for start,end in layout['col_spec']])
+    words = -(-len(cols)//8)
+    block = np.zeros((len(records),words*8),dtype=np.uint8)
+    block[:,:len(cols)] = records[:,cols]
+    return _mix(block.view(np.uint64) @ _mix(np.arange(1,words+1,dtype=np.uint64)))
+
+def _group_hashes(keys,hashes):
+    """ One hash per distinct key, the sum of the hashes of its records so record order does not matter. """
+    names = list(keys)
+    values = [np.asarray(keys[name]) for name in names]
+    order = np.lexsort(values[::-1])
+    values = [value[order] for value in values]
+    changes = np.zeros(max(len(order)-1,0),dtype=bool)
+    for value in values:
+        changes |= value[1:] != value[:-1]
+    starts = np.flatnonzero(np.r_[True,changes]) if len(order) else np.array([],dtype='int64')
+    df = pd.DataFrame({name:value[starts] for name,value in zip(names,values)})
+    df['hash'] = np.add.reduceat(hashes[order],starts) if len(order) else np.array([],dtype=np.uint64)
+    return df
+
+def _range_hashes(input_file,layout,byte_range,keys,chunksize):
+    """ Key hashes of one byte range of an export file. Runs in a worker process. """
+    started = time.time()
+    records = _range_records(input_file,byte_range)
+    frames = [_group_hashes(_record_keys(chunk,layout,keys),_record_hashes(chunk,layout))
+              for chunk in (records[i:i+chunksize] for i in range(0,len(records),chunksize))]
+    frames = frames or [_group_hashes({key:np.array([],dtype='int64') for key in keys},np.array([],dtype=np.uint64))]
+    return pd.concat(frames,ignore_index=True),started,time.time()
+
+def _combine_hashes(frames,keys):
+    """ Key hashes of a whole file from the hashes of its byte ranges, a key can span two ranges. """
+    df = pd.concat(frames,ignore_index=True)
+    return _group_hashes({key:df[key].to_numpy() for key in keys},df['hash'].to_numpy(dtype=np.uint64))
+
+def _diff_hashes(old,new,keys):
+    """ Keys added, changed and deleted between two sets of key hashes. """
+    merged = old.merge(new,how='outer',on=keys,suffixes=('_old','_new'),indicator=True)
+    changed = (merged['_merge'] == 'both') & (merged['hash_old'] != merged['hash_new'])
+    return {'added':merged.loc[merged['_merge'] == 'right_only',keys],'changed':merged.loc[changed,keys],
+            'deleted':merged.loc[merged['_merge'] == 'left_only',keys]}
+
+def _next_delta_version(out_dir):
+    versions = [int(version.name) for delta_dir in Path(out_dir).glob('*.delta') for version in delta_dir.iterdir() if version.name.isdigit()]
+    return max(versions,default=0) + 1
+
+@staged(rows_out=lambda stats:int(stats['rows'].sum()))
+def ingest(export_dir,out_dir,*,tables=None,workers=None,split_size=64*2**20,chunksize=100_000,engine='numpy',encoding=ENCODING,summary=True,lookup=True,incremental=False):
+    """
+    Parses the export tables in parallel and writes each one as a parquet dataset in out_dir.
+    export_dir is the extracted export or the export zip, which is read without extracting it.
+    engine and encoding are passed on to the parse functions.
+
+    Large files are split into record aligned byte ranges of about split_size bytes, every range is parsed
+    in a worker process into its own part file, and the parts are combined into a dataset with a shared
+    _metadata file (out_dir/PROP.parquet/ etc.) that pd.read_parquet and Selector read as one table.
+    The members of a zip are decompressed once as a stream and their ranges are handed to the workers as
+    bytes, with at most two ranges per worker in flight.
+    Every table is then sorted by zip code and prop_id into row groups of at least MIN_ROW_GROUP_ROWS and at
+    most chunksize rows that end on zip code boundaries, the improvement tables get the situs_zip of their
+    property for this. Selector's zip code filters skip the row groups of other zip codes in all four tables.
+    The sort is external (see _cluster_dataset), so it holds about chunksize rows per table at a time.
+    When PROP is ingested on its own, the improvement tables already in out_dir are sorted by its zip codes again.
+    Once all four tables are in out_dir, the county wide single family summary is stored next to them unless summary is False,
+    and so is the prop_id and address lookup index (see tcad.lookup) unless lookup is False.
+
+    With incremental=True, a hash of the records of every key in DELTA_KEYS is stored with each table
+    (out_dir/PROP.hashes.parquet etc.), and tables that are already in out_dir with their hashes are compared
+    with the export by them. Only the rows of added and changed keys are parsed. They are written as a new
+    delta together with the changed and deleted keys, which Selector applies on top of the table when reading
+    it (see selector.table_deltas). The rows of properties that moved to another zip code are rewritten in
+    every improvement table. The summary rows of the affected properties are rebuilt into a delta of the
+    stored summary, and the lookup index is patched with the deltas instead of being rebuilt. The export
+    still has to be read once to hash it, but parsing and writing scale with the number of changes.
+    A table without hashes, such as one from an ingest without incremental=True, is ingested in full the first time.
+    Incremental ingest needs fixed length records. A full ingest of a table removes its deltas.
+
+    Returns a dataframe with the number of parts, rows, wall time and time spent sorting by zip code for each
+    table, and the number of added, changed and deleted keys for incremental tables.
+    """
+    tables = [table for table in TABLES if table in (tables or TABLES)]
+    out_dir = Path(out_dir)
+    updates = [table for table in tables if incremental and (out_dir/f'{table}.parquet').exists() and (out_dir/f'{table}.hashes.parquet').exists()]
+    summary_file = out_dir/SUMMARY_FILE
+    summary_current = summary_file.exists() and summary_version(summary_file) == (str(SUMMARY_VERSION),tables_version(out_dir))
+    version = _next_delta_version(out_dir)
+    inputs = {table:find_export_file(export_dir,TABLES[table]) for table in tables}
+    layouts = {table:load_schema(table) for table in tables}
+    datasets = _prepare_datasets(out_dir,[table for table in tables if table not in updates])
+
+    stats,changed_props = [],[]
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers,initializer=disable_in_worker) as pool:
+        submit = _bounded_submit(pool,2*workers)
+        hash_futures,futures = {},{}
+        for table in tables:
+            hash_futures[table],futures[table] = [],[]
+            for i,(block,byte_range) in enumerate(_export_blocks(inputs[table],split_size)):
+                if incremental:
+                    # Only needed to compare the next incremental ingest with this one
+                    hash_futures[table].append(submit(_range_hashes,block,layouts[table],byte_range,DELTA_KEYS[table],chunksize))
+                if table in datasets:
+                    futures[table].append(submit(_parse_range,block,layouts[table],byte_range,str(datasets[table]/f'part.{i:05d}.parquet'),
+                                                 chunksize,engine,None,None,encoding))
+        hashes,timings,diffs = {},{},{}
+        moved = np.array([],dtype='int64')
+        for table in (tables if incremental else []):
+            hashes[table],timings[table] = _table_hashes(table,hash_futures[table],table in updates)
+            if table not in updates:
+                continue
+            diffs[table] = _diff_table(out_dir,table,hashes[table],moved)
+            keys = pd.concat([diffs[table]['added'],diffs[table]['changed']],ignore_index=True).astype('int64')
+            if len(keys):
+                # Parse only the added and changed keys of the export into the delta
+                rows_dir = out_dir/f'{table}.delta'/f'{version:05d}'/'rows.parquet'
+                rows_dir.mkdir(parents=True,exist_ok=True)
+                futures[table] = [submit(_parse_range,block,layouts[table],byte_range,str(rows_dir/f'part.{i:05d}.parquet'),chunksize,'numpy',None,keys,encoding)
+                                  for i,(block,byte_range) in enumerate(_export_blocks(inputs[table],split_size))]
+            if table == 'PROP' and len(keys):
+                # PROP comes first, the zip codes of its changed rows decide which improvement rows move
+                moved = _moved_props(out_dir,[part for part,_,_,_ in (future.result() for future in futures['PROP']) if part])
+
+        for table in tables:
+            table_stats,changed = _finish_table(out_dir,table,[future.result() for future in futures[table]],timings.get(table,[]),
+                                                diffs.get(table),hashes.get(table),version,export_dir)
+            stats.append(table_stats)
+            if changed is not None:
+                changed_props.append(changed)
+        zips = _cluster_tables(pool,out_dir,datasets,diffs,version,len(moved) > 0,chunksize,stats)
+
+    if summary and all((out_dir/f'{table}.parquet').exists() for table in TABLES):
+        _store_summary(out_dir,export_dir,changed_props if summary_current and not datasets else None,zips,stats)
+    if lookup and all((out_dir/f'{table}.parquet').exists() for table in TABLES) and not lookup_index_current(out_dir):
+        started = time.time()
+        rows = update_lookup_index(out_dir)
+        stats.append({'table':'LOOKUP','parts':1,'rows':rows,'worker_seconds':time.time()-started,'wall_seconds':time.time()-started})
+    return pd.DataFrame(stats).set_index('table')
+
+def _prepare_datasets(out_dir,tables):
+    """
+    Empties out_dir/<table>.parquet/ for each table that is ingested in full and removes its deltas and hashes,
+    which belong to the rows it held. Returns the dataset directory of each table.
+    """
+    datasets = {}
+    for table in tables:
+        dataset = Path(out_dir)/f'{table}.parquet'
+        if dataset.is_file():
+            dataset.unlink()
+        dataset.mkdir(parents=True,exist_ok=True)
+        for old in dataset.glob('*'):
+            old.unlink()
+        shutil.rmtree(Path(out_dir)/f'{table}.delta',ignore_errors=True)
+        (Path(out_dir)/f'{table}.hashes.parquet').unlink(missing_ok=True)
+        datasets[table] = dataset
+    return datasets
+
+def _table_hashes(table,futures,update):
+    """
+    Key hashes of a whole table from the futures of _range_hashes and the (start,end) times of its ranges.
+    Records of different lengths (fwf engine) cannot be hashed, the hashes are None then and the table can only
+    be ingested in full, so a table that is updated raises instead.
+    """
+    try:
+        results = [future.result() for future in futures]
+    except ValueError:
+        if update:
+            raise
+        return None,[]
+    for df,start,end in results:
+        record('hash_block',start,end,rows_out=len(df),table=table)
+    with stage('combine_hashes',sum(len(df) for df,_,_ in results),table=table) as event:
+        hashes = event.output(_combine_hashes([df for df,_,_ in results],DELTA_KEYS[table]))
+    return hashes,[(start,end) for _,start,end in results]
+
+def _diff_table(out_dir,table,hashes,moved):
+    """
+    Keys added, changed and deleted in a table since its hashes in out_dir were stored. The keys of the
+    improvement rows of moved properties (prop_ids) count as changed, so they are sorted under their new zip code.
+    """
+    with stage('diff_hashes',len(hashes),table=table) as event:
+        diff = _diff_hashes(pd.read_parquet(Path(out_dir)/f'{table}.hashes.parquet'),hashes,DELTA_KEYS[table])
+        event.output(diff,rows=sum(len(keys) for keys in diff.values()))
+    if table != 'PROP' and len(moved):
+        moved_keys = hashes.loc[hashes['prop_id'].isin(moved),DELTA_KEYS[table]]
+        changed = pd.concat([diff['added'],diff['changed']],ignore_index=True)
+        diff['changed'] = pd.concat([diff['changed'],moved_keys[~isin_keys(moved_keys,changed)]],ignore_index=True)
+    return diff
+
+def _finish_table(out_dir,table,results,timings,diff,hashes,version,export_dir):
+    """
+    Combines the part files a table was parsed into (results of _parse_range), writes the keys of its delta
+    when diff is given and its hashes when they were computed. Returns the table's stats and the prop_ids of
+    the delta (None without one).
+    """
+    for _,rows,start,end in results:
+        record('parse_block',start,end,rows_out=rows,table=table)
+    parts = [part for part,_,_,_ in results if part]
+    if parts:
+        with stage('merge_parts',len(parts),table=table):
+            fastparquet.writer.merge(parts)
+    times = [(start,end) for _,_,start,end in results] + timings
+    table_stats = {'table':table,'parts':len(parts),'rows':sum(rows for _,rows,_,_ in results),
+                   'worker_seconds':sum(end-start for start,end in times),
+                   'wall_seconds':max(end for _,end in times)-min(start for start,_ in times) if times else 0.0}
+    changed = None
+    if diff is not None:
+        table_stats.update({name:len(keys) for name,keys in diff.items()})
+        replaced = pd.concat(diff.values(),ignore_index=True)
+        if len(replaced):
+            delta = Path(out_dir)/f'{table}.delta'/f'{version:05d}'
+            if not parts:
+                shutil.rmtree(delta/'rows.parquet',ignore_errors=True)
+            delta.mkdir(parents=True,exist_ok=True)
+            replaced = replaced.astype('int64').replace(-1,pd.NA).astype('Int64')
+            fastparquet.write(str(delta/'keys.parquet'),replaced,write_index=False,
+                              custom_metadata={'tcad_source_export':str(Path(export_dir).resolve())})
+            changed = replaced['prop_id'].dropna().to_numpy(dtype='int64')
+    if hashes is not None:
+        fastparquet.write(str(Path(out_dir)/f'{table}.hashes.parquet'),hashes,write_index=False)
+    return table_stats,changed
+
+def _cluster_tables(pool,out_dir,datasets,diffs,version,moved,chunksize,stats):
+    """
+    Sorts what an ingest wrote by zip code (see _cluster_dataset): the tables ingested in full (datasets), the
+    rows of this version's deltas, and when zip codes changed (PROP ingested in full or properties moved) the
+    improvement tables that are not part of the ingest. Adds the time spent to stats and returns the prop_id
+    and situs_zip of every property (see _prop_zips).
+    """
+    out_dir = Path(out_dir)
+    zips = _prop_zips(out_dir)
+    rezip = 'PROP' in datasets or moved
+    futures = {}
+    for table in TABLES:
+        if table in datasets:
+            paths = [datasets[table]]
+        elif table in diffs:
+            paths = [out_dir/f'{table}.delta'/f'{version:05d}'/'rows.parquet']
+        elif rezip and table != 'PROP' and (out_dir/f'{table}.parquet').is_dir():
+            paths = [out_dir/f'{table}.parquet',*(rows for rows,_ in table_deltas(out_dir/f'{table}.parquet'))]
+        else:
+            continue
+        futures[table] = [pool.submit(_cluster_dataset,str(path),None if table == 'PROP' else zips,min(MIN_ROW_GROUP_ROWS,chunksize),chunksize)
+                          for path in paths if path.is_dir()]
+    by_table = {table_stats['table']:table_stats for table_stats in stats}
+    for table,table_futures in futures.items():
+        results = [future.result() for future in table_futures]
+        for rows,start,end in results:
+            record('cluster_table',start,end,rows_out=rows,table=table)
+        if table not in by_table:
+            by_table[table] = {'table':table,'parts':0,'rows':0,'worker_seconds':0.0,'wall_seconds':0.0}
+            stats.append(by_table[table])
+        by_table[table]['cluster_seconds'] = max((end for _,_,end in results),default=0.0)-min((start for _,start,_ in results),default=0.0)
+    return zips
+
+def _store_summary(out_dir,export_dir,changed_props,zips,stats):
+    """
+    Rebuilds the rows of the stored summary for the properties of the deltas written by an incremental ingest
+    (changed_props, a list of prop_id arrays), or the whole summary when changed_props is None.
+    """
+    started = time.time()
+    source = Path(export_dir).resolve()
+    if changed_props is None:
+        rows = build_single_family_summary(out_dir,source=source)
+    elif changed_props:
+        rows = update_single_family_summary(out_dir,np.concatenate(changed_props),source=source,zips=zips)
+    else:
+        return
+    stats.append({'table':'SF_SUMMARY','parts':1,'rows':rows,'worker_seconds':time.time()-started,'wall_seconds':time.time()-started})
+
 def optimize_memory(df):
     """ Downcasting numeric variables to save memory"""
     df = df.copy()
@@ -126,12 +1062,14 @@ def optimize_memory(df):
 def select_type(row):
     value = row["Datatype"]
     dtype = value.split("(")[0]
-    length = int(value.split("(")[1].split(")")[0])
+    # numeric(precision) or numeric(precision,scale)
+    length,*scale = [int(part) for part in value.split("(")[1].split(")")[0].split(",")]
     match dtype:
         case "numeric":
             if "_yr" in row["Field Name"]:
                 return "int16"
-            return "float32"
+            # float32 only keeps 24 bits, values like appraised_val need the full precision
+            return "float64" if scale and scale[0] > 0 else "int64"
         case "int":
             if length < 5:
                 return "int16"
@@ -0,0 +1,74 @@
+"""
+Fixtures shared by the tests. The layout workbook is replaced by a small layout that has the fields tparser
+and Selector use, so the tests neither download nor need it.
+"""
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from tcad import tparser
+
+# benchmarks/synthetic.py writes exports that follow whatever layout is loaded
+sys.path.insert(0,str(Path(__file__).parents[1]/'benchmarks'))
+
+# (Field Name, Datatype) of each table in the layout workbook, IMP_DET has a fixed layout in tparser
+PROP_FIELDS = [('prop_id','int(12)'),('prop_type_cd','char(5)'),('prop_val_yr','numeric(5)'),('situs_num','char(15)'),
+               ('situs_street_prefx','char(10)'),('situs_street','char(50)'),('situs_street_suffix','char(10)'),
+               ('situs_unit','char(5)'),('situs_city','char(30)'),('situs_zip','char(10)'),('appraised_val','numeric(15)'),
+               ('land_acres','numeric(20)'),('market_value','numeric(14)'),('py_owner_name','char(70)'),('filler','char(3)')]
+IMP_INFO_FIELDS = [('prop_id','int(12)'),('prop_val_yr','numeric(4)'),('imprv_id','int(12)'),('imprv_type_cd','char(10)'),
+                   ('imprv_type_desc','char(25)'),('imprv_state_cd','char(5)'),('imprv_homesite','char(1)'),('imprv_val','numeric(14)')]
+IMP_ATR_FIELDS = [('prop_id','int(12)'),('prop_val_yr','numeric(4)'),('imprv_id','int(12)'),('imprv_det_id','int(12)'),
+                  ('imprv_attr_id','int(12)'),('imprv_attr_desc','char(25)'),('imprv_attr_cd','char(10)'),('imprv_attr_val','numeric(15,2)')]
+# get_layout is called with the first row of each table in the workbook
+LAYOUTS = {54:PROP_FIELDS,875:IMP_INFO_FIELDS,926:IMP_ATR_FIELDS}
+
+def _layout(fields):
+    rows,start = [],1
+    for name,datatype in fields:
+        length = int(datatype.split('(')[1].split(')')[0].split(',')[0])
+        rows.append({'Field Name':name,'Datatype':datatype,'Start':start,'End':start+length-1,'Length':length,'Description':''})
+        start += length
+    return pd.DataFrame(rows)
+
+@pytest.fixture
+def layout(tmp_path,monkeypatch):
+    """ Runs a test in tmp_path with the small layout, schemas are compiled into tmp_path/cache. """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tparser,'get_layout',lambda url=None,*,skiprows=None,nrows=None,**kwargs:_layout(LAYOUTS[skiprows]))
+    return tmp_path
+
+def write_records(path,table,rows,*,newline='\n',last_newline=True):
+    """
+    Writes rows (dicts of field values, missing fields are blank) as fixed width records of a table.
+    Text is left aligned and numbers right aligned, values are written as given otherwise.
+    """
+    layout = tparser.load_schema(table,filter=False)
+    lines = []
+    for row in rows:
+        line = ''
+        for name,(start,end),dtype in zip(layout['Field Name'],layout['col_spec'],layout['dtype']):
+            value = str(row.get(name,''))
+            line += value.ljust(end-start) if dtype == 'category' else value.rjust(end-start)
+        lines.append(line)
+    Path(path).write_bytes((newline.join(lines)+(newline if last_newline else '')).encode('latin-1'))
+    return path
+
+@pytest.fixture
+def export(layout):
+    """ A synthetic export of 1000 properties (see benchmarks/synthetic.py) in tmp_path/export. """
+    from synthetic import generate_export
+    generate_export(layout/'export',1000,seed=0)
+    return layout/'export'
+
+def set_field(path,table,field,rows,value):
+    """ Overwrites a field of some records (positions) of a fixed width file, numbers right aligned. """
+    layout = tparser.load_schema(table,filter=False)
+    start,end = dict(zip(layout['Field Name'],layout['col_spec']))[field]
+    data = bytearray(Path(path).read_bytes())
+    record_len = data.index(b'\n')+1
+    for row in rows:
+        data[row*record_len+start:row*record_len+end] = str(value).rjust(end-start).encode()
+    Path(path).write_bytes(bytes(data))
@@ -0,0 +1,49 @@
+"""
+geospatial_match against the single sindex query and overlay of notebook 2.3 on a seeded grid of parcels.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from tcad import geomatch
+
+@pytest.fixture
+def frames():
+    """ (parcels,buildings) of a 20 x 20 parcel grid, buildings are scattered across parcel and tile borders. """
+    rng = np.random.default_rng(0)
+    x,y = np.meshgrid(np.arange(20.0),np.arange(20.0))
+    parcels = gpd.GeoDataFrame({'PROP_ID':rng.permutation(np.arange(100000,100400))},
+                               geometry=shapely.box(x.ravel(),y.ravel(),x.ravel()+1,y.ravel()+1),crs='EPSG:3081')
+    # Mostly small footprints, some a few parcels wide and one without area
+    n = 1000
+    size = np.where(rng.random(n) < 0.05,rng.uniform(1,4,n),rng.uniform(0.05,0.6,n))
+    left,bottom = rng.uniform(-1,20,n),rng.uniform(-1,20,n)
+    geometry = shapely.box(left,bottom,left+size,bottom+size*rng.uniform(0.5,1.5,n))
+    geometry[0] = shapely.LineString([(3.5,3.5),(4.5,3.5)])
+    index = pd.MultiIndex.from_arrays([np.where(rng.random(n) < 0.9,'way','relation'),rng.permutation(n)*7+1],names=['element_type','osmid'])
+    return parcels,gpd.GeoDataFrame(geometry=geometry,index=index,crs='EPSG:3081')
+
+def _notebook_matches(tcad_parcels,osm_bldgs):
+    matches = pd.DataFrame(tcad_parcels['geometry'].sindex.query(osm_bldgs['geometry'],predicate='intersects')).T
+    tcad_geometry = gpd.GeoSeries(tcad_parcels.geometry.to_numpy()[matches[1]])
+    osm_geometry = gpd.GeoSeries(osm_bldgs.geometry.to_numpy()[matches[0]])
+    return pd.DataFrame({'parcel':matches[1],'building':matches[0],'tcad':tcad_parcels['PROP_ID'].to_numpy()[matches[1]],
+                         'osmid':osm_bldgs.index.get_level_values('osmid')[matches[0]],
+                         'osm_element_type':osm_bldgs.index.get_level_values('element_type')[matches[0]],
+                         'pct_bldg_in_parcel':tcad_geometry.intersection(osm_geometry).area/osm_geometry.area})
+
+@pytest.mark.parametrize('workers',[1,2])
+def test_tiles_match_naive_join(frames,workers):
+    parcels,buildings = frames
+    with np.errstate(divide='ignore',invalid='ignore'):
+        matches,stats = geomatch.geospatial_match(parcels,buildings,workers=workers,buildings_per_tile=40)
+        expected = _notebook_matches(parcels,buildings)
+    assert stats['tiles'] > 1
+    # Parcels on tile borders are matched with the buildings of several tiles, each pair still once
+    tiles = geomatch._tiles(buildings.geometry.to_numpy(),40)
+    assert (pd.Series(tiles[matches['building']]).groupby(matches['parcel'].to_numpy()).nunique() > 1).sum() > 20
+    expected = expected.sort_values(['building','parcel'],ignore_index=True)
+    pd.testing.assert_frame_equal(matches.reset_index(drop=True),expected,check_dtype=False)
+    assert np.isnan(matches.loc[matches['building'] == 0,'pct_bldg_in_parcel']).all()
@@ -0,0 +1,49 @@
+"""
+aggregate_load_profiles against the concat, pivot and weighting of notebook 3.2 on a few small timeseries files.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from tcad import loadprofiles
+from tcad.loadprofiles import ELECTRICITY
+
+@pytest.fixture
+def timeseries(tmp_path):
+    """ (tcad,folder) with 12 building files of 3 days of hourly data, one of them out of order, and 200 properties. """
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2018-01-01 00:15',periods=72,freq='h')
+    bldg_ids = rng.choice(np.arange(1,500000),12,replace=False)
+    for i,bldg_id in enumerate(bldg_ids):
+        # ResStock files are indexed by bldg_id and hold every column, the notebook only reads two
+        df = pd.DataFrame({'timestamp':timestamps,ELECTRICITY:rng.uniform(0,5,len(timestamps)),'out.natural_gas.total.energy_consumption':0.0},
+                          index=pd.Index(np.full(len(timestamps),bldg_id),name='bldg_id'))
+        if i == 3:
+            df = df.iloc[rng.permutation(len(df))]
+        df.to_parquet(tmp_path/loadprofiles.timeseries_file(bldg_id))
+    ids = rng.choice(bldg_ids,200).astype('float64')
+    ids[rng.random(200) < 0.05] = np.nan
+    tcad = pd.DataFrame({'situs_zip':rng.choice(['78701','78733','78741'],200),'selected_resstock_id':ids})
+    return tcad,tmp_path
+
+def _notebook_profiles(tcad,folder):
+    filepaths = sorted(folder.glob('*.parquet'))
+    resstock_all_bldgs = pd.concat([pd.read_parquet(path,columns=['timestamp',ELECTRICITY]) for path in filepaths])
+    pivoted_df = resstock_all_bldgs.reset_index().pivot(columns='bldg_id',values=ELECTRICITY,index='timestamp')
+    profiles = {}
+    for zipcode,tcad_zipcode in tcad.groupby('situs_zip'):
+        profiles[zipcode] = sum([count*pivoted_df[int(id)] for id,count in tcad_zipcode['selected_resstock_id'].value_counts().to_dict().items()])
+    return pd.DataFrame(profiles)
+
+@pytest.mark.parametrize('workers,chunk_size',[(1,64),(2,5)])
+def test_matches_notebook(timeseries,workers,chunk_size):
+    tcad,folder = timeseries
+    profiles = loadprofiles.aggregate_load_profiles(tcad,folder,workers=workers,chunk_size=chunk_size)
+    expected = _notebook_profiles(tcad,folder)
+    pd.testing.assert_frame_equal(profiles,expected,check_names=False,check_freq=False)
+
+def test_missing_files_raise(timeseries):
+    tcad,folder = timeseries
+    next(folder.glob('*.parquet')).unlink()
+    with pytest.raises(FileNotFoundError):
+        loadprofiles.aggregate_load_profiles(tcad,folder,workers=1)
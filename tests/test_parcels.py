@@ -0,0 +1,125 @@
+"""
+fetch_parcels against a local stand in for the ArcGIS query service, which can fail requests, cap pages and
+go down part way through a download.
+"""
+import json,re,threading,time
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from urllib.parse import parse_qs,urlparse
+
+import numpy as np
+import pytest
+import shapely
+
+from tcad import parcels
+
+BOUNDS = {'xmin':-97.9,'ymin':30.2,'xmax':-97.5,'ymax':30.5}
+
+# Parcels are small squares, some of them cross the border between two tiles
+rng = np.random.default_rng(0)
+FEATURES = [{'type':'Feature','properties':{'OBJECTID':i+1,'PROP_ID':100000+i,'situs_zip':'78741'},
+             'geometry':shapely.geometry.mapping(shapely.box(x,y,x+0.01,y+0.01))}
+            for i,(x,y) in enumerate(zip(-97.9+rng.random(300)*0.39,30.2+rng.random(300)*0.29))]
+SHAPES = [shapely.geometry.shape(feature['geometry']) for feature in FEATURES]
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self,*args):
+        pass
+
+    def _send(self,status,data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        with state['lock']:
+            state['requests'] += 1
+            request = state['requests']
+            attempt = state['attempts'][self.path] = state['attempts'].get(self.path,0) + 1
+            state['concurrent'] += 1
+            state['peak'] = max(state['peak'],state['concurrent'])
+        try:
+            time.sleep(0.005)
+            if state['down_after'] is not None and request > state['down_after']:
+                return self._send(503)
+            if attempt <= state['fail_first']:
+                # Either a failed request or an error payload with a 200 status, as ArcGIS sends for timeouts
+                return self._send(500) if attempt % 2 else self._send(200,{'error':{'code':500,'message':'timeout'}})
+            query = {key:values[0] for key,values in parse_qs(urlparse(self.path).query).items()}
+            box = dict(re.findall(r'(xmin|ymin|xmax|ymax):(-?[\d.]+)',query['geometry']))
+            box = shapely.box(*(float(box[key]) for key in ['xmin','ymin','xmax','ymax']))
+            features = [feature for feature,shape in zip(FEATURES,SHAPES) if box.intersects(shape)]
+            if query.get('returnCountOnly') == 'true':
+                return self._send(200,{'count':len(features)})
+            offset,count = int(query['resultOffset']),min(int(query['resultRecordCount']),state['max_records'])
+            self._send(200,{'type':'FeatureCollection','features':features[offset:offset+count]})
+        finally:
+            with state['lock']:
+                state['concurrent'] -= 1
+
+@pytest.fixture
+def server(monkeypatch):
+    """ (query url,state) of a local parcel service, state sets how it misbehaves and counts the requests. """
+    monkeypatch.setattr(parcels.time,'sleep',lambda seconds:None)
+    httpd = ThreadingHTTPServer(('127.0.0.1',0),_Handler)
+    httpd.state = {'lock':threading.Lock(),'requests':0,'concurrent':0,'peak':0,'attempts':{},'fail_first':0,'down_after':None,'max_records':1000}
+    thread = threading.Thread(target=httpd.serve_forever,daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/query',httpd.state
+    httpd.shutdown()
+    httpd.server_close()
+
+def _fetch(url,cache_dir,**kwargs):
+    return parcels.fetch_parcels(bounds=BOUNDS,tile_size=0.1,base_url=url,cache_dir=cache_dir,workers=4,page_size=20,**kwargs)
+
+def test_every_parcel_once(server,tmp_path):
+    url,_ = server
+    df = _fetch(url,tmp_path/'cache',export_file=tmp_path/'parcels.parquet')
+    # Parcels on the border of two tiles are returned for both
+    tiles = [shapely.box(*tile.values()) for tile in parcels.get_tiles(BOUNDS,0.1)]
+    assert sum(tile.intersects(shape) for tile in tiles for shape in SHAPES) > len(FEATURES)
+    assert sorted(df['OBJECTID']) == list(range(1,len(FEATURES)+1))
+    assert len(parcels.gpd.read_parquet(tmp_path/'parcels.parquet')) == len(FEATURES)
+
+def test_retries_failed_requests(server,tmp_path):
+    url,state = server
+    # Every request fails twice, once with a 500 and once with an error payload
+    state['fail_first'] = 2
+    with pytest.raises(parcels.requests.HTTPError):
+        _fetch(url,tmp_path/'cache',retries=1)
+    state['attempts'] = {}
+    df = _fetch(url,tmp_path/'cache',retries=2)
+    assert sorted(df['OBJECTID']) == list(range(1,len(FEATURES)+1))
+
+def test_resumes_after_interruption(server,tmp_path):
+    url,state = server
+    state['down_after'] = 30
+    with pytest.raises(parcels.requests.HTTPError):
+        _fetch(url,tmp_path/'cache',retries=0)
+    assert len(list((tmp_path/'cache').glob('*.json'))) == 30
+    assert not list((tmp_path/'cache').glob('*.tmp'))
+
+    state.update(down_after=None,requests=0)
+    df = _fetch(url,tmp_path/'cache')
+    assert sorted(df['OBJECTID']) == list(range(1,len(FEATURES)+1))
+    resumed = state['requests']
+    assert resumed == len(list((tmp_path/'cache').glob('*.json'))) - 30
+
+    # Everything is cached now
+    state['requests'] = 0
+    assert len(_fetch(url,tmp_path/'cache')) == len(FEATURES)
+    assert state['requests'] == 0
+
+def test_connections_capped(server,tmp_path):
+    url,state = server
+    parcels.fetch_parcels(bounds=BOUNDS,tile_size=0.1,base_url=url,cache_dir=tmp_path/'cache',workers=2,page_size=20)
+    assert state['peak'] <= 2
+
+def test_capped_pages_raise(server,tmp_path):
+    url,state = server
+    state['max_records'] = 10
+    with pytest.raises(ValueError):
+        _fetch(url,tmp_path/'cache')
@@ -0,0 +1,99 @@
+"""
+tcad.resstock against the row by row matching of notebook 3.1, which is copied here, on seeded synthetic frames.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tcad import resstock
+
+VINTAGES = ['<1940','1940s','1950s','1960s','1970s','1980s','1990s','2000s','2010s']
+AREAS = ['0-499','500-749','750-999','1000-1499','1500-1999','2000-2499','2500-2999','3000-3999','4000+']
+ROOFS = ['Composition Shingles','Wood Shingles','Metal, Dark','Tile, Clay or Ceramic','Tile, Concrete','Slate']
+
+def _notebook_vintage(yr):
+    if yr < 1940:
+        return '<1940'
+    elif yr > 2010:
+        return '2010s'
+    else:
+        return f'{int(yr/10)}0s'
+
+def _notebook_area_bin(tcad_area):
+    if tcad_area>=6000:
+        return '4000+'
+    elif tcad_area>=3000:
+        return '3000-3999'
+    elif tcad_area >=1000:
+        n=int((tcad_area-1000)/500)*500+1000
+        return f'{n}-{n+499}'
+    elif tcad_area >=500:
+        n=int((tcad_area-500)/250)*250+500
+        return f'{n}-{n+249}'
+    else:
+        return '0-499'
+
+def _notebook_search(row,resstock_df):
+    mask1 = (resstock_df['in.vintage']==row['vintage'])
+    mask2 = (resstock_df['in.geometry_stories']==str(row['num_floors']))
+    mask3 = (resstock_df['in.geometry_floor_area']==row['geometry_floor_area'])
+    mask4 = (resstock_df['in.geometry_foundation_type']==row['geometry_foundation_type'])
+    mask5 = (resstock_df['in.roof_material']==row['roof_material'])
+    for attempt in [mask1&mask2&mask3&mask4&mask5,mask1&mask2&mask3&mask5,mask1&mask2&mask3&mask4,mask1&mask2&mask3,mask1&mask3,mask1]:
+        df = resstock_df[attempt]
+        if not df.empty:
+            return df
+    return resstock_df[mask1]
+
+@pytest.fixture
+def frames():
+    """ (tcad,resstock) with bin edges, values ResStock does not have and vintages missing from ResStock. """
+    rng = np.random.default_rng(0)
+    n = 6000
+    raw = pd.DataFrame({'in.sqft':rng.integers(300,6000,n),'in.vintage':rng.choice(VINTAGES[1:],n),
+                        'in.geometry_stories':rng.choice(['1','2','3'],n),'in.geometry_floor_area':rng.choice(AREAS,n),
+                        'in.geometry_foundation_type':rng.choice(['Slab','Ambient','Vented Crawlspace'],n),
+                        'in.geometry_building_type_height':rng.choice(['Single-Family Detached','Single-Family Attached'],n,p=[0.8,0.2]),
+                        'in.city':rng.choice(['TX, Austin','TX, Dallas'],n,p=[0.7,0.3]),'in.has_pv':rng.choice(['Yes','No'],n),
+                        'in.cooling_setpoint':rng.choice(['72F','75F'],n),'in.federal_poverty_level':rng.choice(['0-100%','400%+'],n),
+                        'in.income':rng.choice(['<10000','200000+'],n),'in.roof_material':rng.choice(ROOFS,n)},
+                       index=rng.permutation(10*n)[:n])
+    m = 500
+    tcad = pd.DataFrame({'yr_built':np.concatenate([[1939,1940,2010,2011,2023],rng.integers(1900,2024,m-5)]),
+                         'main_area':np.concatenate([[499,500,999,1000,2999,3000,5999,6000,8000],rng.uniform(100,7000,m-9)]),
+                         'num_floors':rng.choice([1,2,3,4],m),'Foundation':rng.choice(['SLAB','PIER AND B','WOOD POST','OTHER',None],m),
+                         'Roof Covering':rng.choice(['COMPOSITIO','WOOD SHING','METAL','TILE','OTHER'],m)},
+                        index=rng.permutation(10*m)[:m])
+    return tcad,resstock.select_single_family_detached(raw)
+
+def test_matches_notebook(frames):
+    tcad,resstock_df = frames
+    matched = resstock.match_resstock(tcad,resstock_df,seed=2024)
+
+    expected = tcad.copy()
+    expected['vintage'] = expected['yr_built'].apply(_notebook_vintage)
+    expected['geometry_floor_area'] = expected['main_area'].apply(_notebook_area_bin)
+    expected['geometry_foundation_type'] = expected['Foundation'].apply(lambda value:{'SLAB':'Slab','PIER AND B':'Ambient','WOOD POST':'Ambient'}.get(value,None))
+    expected['roof_material'] = expected['Roof Covering'].apply(lambda value:{'COMPOSITIO':'Composition Shingles','WOOD SHING':'Wood Shingles',
+                                                                              'METAL':'Metal, Dark','TILE':'Tile, all'}.get(value,None))
+    for col in ['vintage','geometry_floor_area','geometry_foundation_type','roof_material']:
+        pd.testing.assert_series_equal(matched[col],expected[col],check_dtype=False)
+
+    found = expected.apply(lambda row:_notebook_search(row,resstock_df),axis=1)
+    counts = found.apply(len)
+    # ResStock has no buildings before 1940 here
+    assert (counts == 0).any()
+    assert matched['resstock_level'].nunique() > 3
+    np.testing.assert_array_equal(matched['resstock_count'],counts)
+    index = resstock.ResStockIndex(resstock_df)
+    matches = index.match(resstock.add_match_keys(tcad))
+    for label in tcad.index[::7]:
+        pd.testing.assert_frame_equal(index.candidates(matches.loc[label]),found[label])
+
+    # The notebook draws for every building, buildings without candidates are left out since they raised there
+    random.seed(2024)
+    selected = [found[label].iloc[random.randint(0,counts[label]-1)].name for label in tcad.index if counts[label] > 0]
+    assert matched.loc[counts > 0,'selected_resstock_id'].tolist() == selected
+    assert matched.loc[counts == 0,'selected_resstock_id'].isna().all()
@@ -0,0 +1,95 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import set_field
+from tcad import tparser
+from tcad.lookup import LookupIndex,build_lookup_index
+from tcad.selector import SUMMARY_FILE,Selector,read_table
+
+@pytest.fixture
+def data_dir(export,layout):
+    # Buildings whose floors have no area get the highest floor column of the selection as their highest floor
+    details = tparser.parse_improvement_details(str(export/'IMP_DET.TXT'),engine='numpy')
+    floors = details['Imprv_det_type_cd'].isin(['1ST','2ND','3RD','ADDL'])
+    no_area = floors & details['imprv_id'].isin(details['imprv_id'].unique()[::20])
+    set_field(export/'IMP_DET.TXT','IMP_DET','imprv_det_area',np.flatnonzero(no_area),0)
+    tparser.ingest(export,layout/'out',workers=1,lookup=False)
+    return layout/'out'
+
+def test_stored_summary_matches_built(data_dir):
+    zip_codes = sorted(Selector(data_dir).prop_df['situs_zip'].dropna().unique())
+    county = Selector(data_dir).get_single_family_building_summary()
+    selectors = [Selector(data_dir)]
+    selectors += [Selector(data_dir,zip_codes=zip_code) for zip_code in zip_codes[:20]]
+    selectors += [Selector(data_dir).query(zip_codes[:3]),Selector(data_dir,bldg_types=['1 FAM DWELLING','MOHO SINGLE'])]
+    fewer_columns = 0
+    for selector in selectors:
+        stored = selector.get_single_family_building_summary()
+        # Categories of a built summary come from the tables it was built from
+        pd.testing.assert_frame_equal(stored,selector._build_single_family_building_summary(),check_categorical=False)
+        fewer_columns += len(stored.columns) < len(county.columns)
+    assert fewer_columns
+    assert (county['num_floors'] == 0).any()
+
+def test_summary_dtypes_match_in_memory(data_dir,export):
+    parsers = [tparser.parse_property_details,tparser.parse_improvement_info,tparser.parse_improvement_details,tparser.parse_improvement_features]
+    tables = [parse(str(export/filename),engine='numpy') for parse,filename in zip(parsers,tparser.TABLES.values())]
+    built = Selector._copy(*tables).get_single_family_building_summary()
+    stored = Selector(data_dir).get_single_family_building_summary()
+    assert stored.dtypes.astype(str).to_dict() == built.dtypes.astype(str).to_dict()
+    assert built['appraised_val'].dtype == 'Int64'
+
+def test_incremental_ingest_patches_summary_and_index(export,layout):
+    tparser.ingest(export,layout/'out',workers=1,chunksize=1000,incremental=True)
+    summary_file = (layout/'out'/SUMMARY_FILE).stat()
+    changed = shutil.copytree(export,layout/'changed')
+    set_field(changed/'PROP.TXT','PROP','situs_zip',range(0,1000,97),'78799')
+    set_field(changed/'IMP_DET.TXT','IMP_DET','imprv_det_area',range(3,5000,499),7)
+    tparser.ingest(changed,layout/'out',workers=1,chunksize=1000,incremental=True)
+    tparser.ingest(changed,layout/'full',workers=1,chunksize=1000)
+
+    # The changed rows are a delta of the stored summary
+    assert (layout/'out'/SUMMARY_FILE).stat().st_mtime_ns == summary_file.st_mtime_ns
+    assert list((layout/'out'/'SF_SUMMARY.delta').iterdir())
+    patched,built = (read_table(path/SUMMARY_FILE).sort_values('prop_id',ignore_index=True) for path in [layout/'out',layout/'full'])
+    pd.testing.assert_frame_equal(patched,built,check_categorical=False)
+    selector = Selector(layout/'out',zip_codes='78799')
+    pd.testing.assert_frame_equal(selector.get_single_family_building_summary(),selector._build_single_family_building_summary(),check_categorical=False)
+
+    patched = LookupIndex.open(layout/'out').arrays
+    shutil.copytree(layout/'out',layout/'rebuilt')
+    build_lookup_index(layout/'rebuilt')
+    rebuilt = LookupIndex.open(layout/'rebuilt',check=False).arrays
+    assert patched.keys() == rebuilt.keys()
+    for name in rebuilt:
+        np.testing.assert_array_equal(patched[name],rebuilt[name])
+
+def _assert_lookups_match(data_dir,prop_ids,address):
+    stored = Selector(data_dir)
+    loaded = Selector._copy(*(read_table(data_dir/f'{table}.parquet') for table in tparser.TABLES))
+    for looked,expected in [(stored.lookup(prop_ids),loaded.lookup(prop_ids)),(stored.lookup(**address),loaded.lookup(**address))]:
+        for name in ['prop_df','imp_info_df','imp_det_df','imp_atr_df']:
+            expected_df = getattr(expected,name).reset_index(drop=True)
+            pd.testing.assert_frame_equal(getattr(looked,name).reset_index(drop=True),expected_df.drop(columns='situs_zip',errors='ignore')
+                                          if name != 'prop_df' else expected_df,check_categorical=False)
+        assert len(looked.prop_df)
+    # Only the matching rows were read
+    assert not stored._tables and len(looked._views['IMP_ATR'][0]) < len(loaded.imp_atr_df)
+
+def test_lookup_reads_only_matching_rows(export,layout):
+    tparser.ingest(export,layout/'out',workers=1,chunksize=400,incremental=True)
+    prop_df = read_table(layout/'out'/'PROP.parquet')
+    prop_ids = prop_df['prop_id'].sample(20,random_state=0).to_numpy()
+    row = prop_df.iloc[5]
+    address = {'street':row['situs_street'],'num':row['situs_num'],'zip_code':row['situs_zip']}
+    _assert_lookups_match(layout/'out',prop_ids,address)
+
+    # With deltas the rows are found by prop_id
+    changed = shutil.copytree(export,layout/'changed')
+    set_field(changed/'IMP_DET.TXT','IMP_DET','imprv_det_area',range(3,5000,97),7)
+    tparser.ingest(changed,layout/'out',workers=1,chunksize=400,incremental=True)
+    assert list((layout/'out'/'IMP_DET.delta').iterdir())
+    _assert_lookups_match(layout/'out',prop_ids,address)
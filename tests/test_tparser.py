@@ -0,0 +1,225 @@
+import shutil
+
+import fastparquet
+import numpy as np
+import pandas as pd
+import pytest
+from fastparquet.api import filter_row_groups
+
+from conftest import set_field,write_records
+from tcad import tparser
+from tcad.selector import Selector,read_table
+
+PARSERS = {'PROP':tparser.parse_property_details,'IMP_INFO':tparser.parse_improvement_info,
+           'IMP_DET':tparser.parse_improvement_details,'IMP_ATR':tparser.parse_improvement_features}
+
+# Blank fields, '00-' hyphen values, text that is not a number, signs, decimals, padded and unsorted text
+ROWS = {
+    'PROP':[{'prop_id':'100','prop_val_yr':'2023','situs_street':'MAIN','situs_zip':'78741','appraised_val':'20123457','land_acres':'9000'},
+            {'prop_id':'101','prop_val_yr':'2023','situs_street':' OAK','situs_unit':'NA','situs_zip':'78701','appraised_val':'00-123456789'},
+            {'prop_id':'102','prop_val_yr':'','situs_street':'ELM','appraised_val':'abc','land_acres':'123456789012345'},
+            {'prop_id':'103','prop_val_yr':'2023','situs_street':'CEDAR','situs_zip':'78741','appraised_val':'','market_value':'-42'}],
+    'IMP_INFO':[{'prop_id':'100','prop_val_yr':'2023','imprv_id':'10','imprv_type_cd':'WW4','imprv_type_desc':'1 FAM DWELLING','imprv_val':'123456789'},
+                {'prop_id':'101','prop_val_yr':'2023','imprv_id':'11','imprv_type_cd':' B','imprv_type_desc':'','imprv_val':'00-12345'},
+                {'prop_id':'102','prop_val_yr':'2023','imprv_id':'12','imprv_type_cd':'A','imprv_type_desc':'MOHO','imprv_val':'1 2'}],
+    'IMP_DET':[{'prop_id':'100','prop_val_yr':'2023','imprv_id':'10','imprv_det_id':'1','Imprv_det_type_cd':'1ST','yr_built':'1990','imprv_det_area':'1500','imprv_det_val':'00-2000'},
+               {'prop_id':'100','prop_val_yr':'2023','imprv_id':'10','imprv_det_id':'2','Imprv_det_type_cd':'095','yr_built':'','imprv_det_area':'','imprv_det_val':'NA'},
+               {'prop_id':'101','prop_val_yr':'2023','imprv_id':'11','imprv_det_id':'3','Imprv_det_type_cd':' 2ND','yr_built':'1975','imprv_det_area':'1.0','imprv_det_val':'12'}],
+    'IMP_ATR':[{'prop_id':'100','prop_val_yr':'2023','imprv_id':'10','imprv_det_id':'1','imprv_attr_id':'1','imprv_attr_desc':'Floor Factor','imprv_attr_cd':'1ST','imprv_attr_val':'   .5'},
+               {'prop_id':'100','prop_val_yr':'2023','imprv_id':'10','imprv_det_id':'1','imprv_attr_id':'2','imprv_attr_desc':'Foundation','imprv_attr_cd':'SLAB','imprv_attr_val':'-42.5'},
+               {'prop_id':'101','prop_val_yr':'2023','imprv_id':'11','imprv_det_id':'3','imprv_attr_id':'3','imprv_attr_desc':'','imprv_attr_cd':'','imprv_attr_val':'00-7'}]}
+
+@pytest.mark.parametrize('table',list(PARSERS))
+@pytest.mark.parametrize('newline',['\n','\r\n'])
+@pytest.mark.parametrize('last_newline',[True,False])
+def test_engines_agree(layout,table,newline,last_newline):
+    path = write_records(layout/f'{table}.TXT',table,ROWS[table],newline=newline,last_newline=last_newline)
+    expected = PARSERS[table](str(path),engine='fwf')
+    result = PARSERS[table](str(path),engine='numpy')
+    pd.testing.assert_frame_equal(result,expected)
+    assert len(result) == len(ROWS[table])
+
+def test_engines_agree_on_non_ascii(layout):
+    rows = [{**ROWS['PROP'][0],'situs_street':'CAÑADA','situs_city':'SAN JOSÉ'},{**ROWS['PROP'][3],'situs_street':'ÅNGSTRÖM ½'}]
+    path = write_records(layout/'PROP.TXT','PROP',rows)
+    expected = tparser.parse_property_details(str(path),engine='fwf')
+    assert expected['situs_street'].tolist() == ['CAÑADA','ÅNGSTRÖM ½']
+    # Fields after the accented ones start at the same offset
+    assert expected['situs_zip'].tolist() == ['78741','78741']
+    pd.testing.assert_frame_equal(tparser.parse_property_details(str(path),engine='numpy'),expected)
+    for engine in ['fwf','numpy']:
+        tparser.parse_property_details(str(path),export_file=str(layout/f'{engine}.parquet'),chunksize=1,engine=engine)
+        streamed = pd.read_parquet(layout/f'{engine}.parquet')
+        assert streamed['situs_street'].tolist() == ['CAÑADA','ÅNGSTRÖM ½']
+        assert streamed['situs_city'].tolist() == ['SAN JOSÉ',None]
+    with pytest.raises(ValueError):
+        tparser.parse_property_details(str(path),engine='numpy',encoding='utf-8')
+
+def test_exact_large_values(layout):
+    path = write_records(layout/'PROP.TXT','PROP',ROWS['PROP'])
+    df = tparser.parse_property_details(str(path),engine='numpy')
+    assert df['appraised_val'].tolist()[:2] == [20123457,123456789]
+    assert df['land_acres'].tolist()[:3] == [9000,pd.NA,123456789012345]
+
+def test_categories_sorted(layout):
+    path = write_records(layout/'IMP_INFO.TXT','IMP_INFO',ROWS['IMP_INFO'])
+    df = tparser.parse_improvement_info(str(path),engine='numpy')
+    assert df['imprv_type_cd'].cat.categories.tolist() == ['A','B','WW4']
+
+@pytest.mark.parametrize('field,value',[('imprv_det_area','-5'),('imprv_det_area','99999999999'),('imprv_det_val','1.5'),('yr_built','-1')])
+def test_out_of_range_raises(layout,field,value):
+    rows = [dict(ROWS['IMP_DET'][0]),{**ROWS['IMP_DET'][0],field:value}]
+    path = write_records(layout/'IMP_DET.TXT','IMP_DET',rows)
+    for engine in ['fwf','numpy']:
+        with pytest.raises(TypeError):
+            tparser.parse_improvement_details(str(path),engine=engine)
+
+def test_too_many_digits_raise(layout):
+    # More digits than fit the int64 the digits are accumulated in
+    path = write_records(layout/'PROP.TXT','PROP',[*ROWS['PROP'],{'prop_id':'104','land_acres':'99999999999999999999'}])
+    for engine in ['fwf','numpy']:
+        with pytest.raises(TypeError):
+            tparser.parse_property_details(str(path),engine=engine)
+
+def test_value_columns_coerced(layout):
+    for engine in ['fwf','numpy']:
+        prop = tparser.parse_property_details(str(write_records(layout/'PROP.TXT','PROP',ROWS['PROP'])),engine=engine)
+        assert prop['appraised_val'].tolist()[1:3] == [123456789,pd.NA]
+        # IMP_DET values were never hyphen fixed
+        imp_det = tparser.parse_improvement_details(str(write_records(layout/'IMP_DET.TXT','IMP_DET',ROWS['IMP_DET'])),engine=engine)
+        assert imp_det['imprv_det_val'].tolist() == [pd.NA,pd.NA,12]
+
+@pytest.mark.parametrize('table,field,value',[('PROP','prop_id','1O1'),('IMP_INFO','imprv_id','00-11'),('IMP_DET','yr_built','19x5'),
+                                              ('IMP_ATR','prop_val_yr','NA1')])
+def test_malformed_numbers_raise(layout,table,field,value):
+    path = write_records(layout/f'{table}.TXT',table,[ROWS[table][0],{**ROWS[table][0],field:value}])
+    for engine in ['fwf','numpy']:
+        with pytest.raises(ValueError):
+            PARSERS[table](str(path),engine=engine)
+
+def test_unequal_records_raise(layout):
+    path = write_records(layout/'IMP_INFO.TXT','IMP_INFO',ROWS['IMP_INFO'])
+    data = path.read_bytes()
+    path.write_bytes(data[:20]+data[21:])
+    with pytest.raises(ValueError):
+        tparser.parse_improvement_info(str(path),engine='numpy')
+
+@pytest.mark.parametrize('last_newline',[True,False])
+def test_ingest_engines_agree(layout,last_newline):
+    export = layout/'export'
+    export.mkdir()
+    for table,filename in tparser.TABLES.items():
+        write_records(export/filename,table,ROWS[table]*50,newline='\r\n',last_newline=last_newline)
+    for engine in ['fwf','numpy']:
+        # Several blocks per file, each of them read and padded on its own
+        tparser.ingest(export,layout/engine,engine=engine,workers=1,split_size=5000,chunksize=64,summary=False,lookup=False)
+    for table in tparser.TABLES:
+        fwf,numpy = read_table(layout/'fwf'/f'{table}.parquet'),read_table(layout/'numpy'/f'{table}.parquet')
+        pd.testing.assert_frame_equal(numpy,fwf)
+        assert len(numpy) == 50*len(ROWS[table])
+
+def _dtypes(df):
+    return {col:str(dtype) for col,dtype in df.dtypes.items()}
+
+def test_paths_give_same_dtypes(layout):
+    export = layout/'export'
+    export.mkdir()
+    for table,filename in tparser.TABLES.items():
+        write_records(export/filename,table,ROWS[table])
+    tparser.ingest(export,layout/'out',workers=1,summary=False,lookup=False)
+    for table,filename in tparser.TABLES.items():
+        expected = PARSERS[table](str(export/filename),export_file=str(layout/f'{table}.parquet'))
+        assert {'Int64','UInt32'} & set(_dtypes(expected).values())
+        assert _dtypes(read_table(layout/f'{table}.parquet')) == _dtypes(expected)
+        for engine in ['fwf','numpy']:
+            PARSERS[table](str(export/filename),export_file=str(layout/f'{engine}.parquet'),chunksize=2,engine=engine)
+            assert _dtypes(read_table(layout/f'{engine}.parquet')) == _dtypes(expected)
+        assert _dtypes(read_table(layout/'out'/f'{table}.parquet',list(expected.columns))) == _dtypes(expected)
+
+@pytest.mark.parametrize('engine',['fwf','numpy'])
+def test_empty_input_writes_columns(layout,engine):
+    (layout/'PROP.TXT').write_bytes(b'')
+    tparser.parse_property_details(str(layout/'PROP.TXT'),export_file=str(layout/'PROP.parquet'),chunksize=10,engine=engine)
+    df = pd.read_parquet(layout/'PROP.parquet')
+    assert len(df) == 0
+    assert df.columns.tolist() == tparser.load_schema('PROP')['Field Name'].tolist()
+    assert df['prop_id'].dtype == 'Int64'
+
+def _sorted_table(path,table):
+    keys = [key for key in tparser.DELTA_KEYS[table] if key != 'prop_val_yr']
+    return read_table(path).sort_values(keys,ignore_index=True).astype(object)
+
+def test_ingest_clusters_by_zip(export,layout):
+    tparser.ingest(export,layout/'out',workers=1,chunksize=400,summary=False,lookup=False)
+    zip_codes = sorted(read_table(layout/'out'/'PROP.parquet',['situs_zip'])['situs_zip'].dropna().unique())[:2]
+    for table in tparser.TABLES:
+        pf = fastparquet.ParquetFile(str(layout/'out'/f'{table}.parquet'))
+        assert all(row_group.num_rows <= 400 for row_group in pf.row_groups)
+        assert len(filter_row_groups(pf,[('situs_zip','in',zip_codes)])) < len(pf.row_groups)
+    selected,queried = Selector(layout/'out',zip_codes=zip_codes),Selector(layout/'out').query(zip_codes)
+    for name in ['prop_df','imp_info_df','imp_det_df','imp_atr_df']:
+        assert 'situs_zip' not in getattr(selected,name) or name == 'prop_df'
+        # Categories come from the rows read
+        pd.testing.assert_frame_equal(getattr(selected,name).reset_index(drop=True),getattr(queried,name).reset_index(drop=True),
+                                      check_categorical=False)
+
+def test_cluster_merges_runs_in_order(export,layout,monkeypatch):
+    monkeypatch.setattr(tparser,'MERGE_ROWS',7)
+    zips = tparser.parse_property_details(str(export/'PROP.TXT'),engine='numpy')[['prop_id','situs_zip']].astype({'situs_zip':object})
+    # Unsorted rows in two parts, with missing zip codes and many rows per prop_id
+    df = tparser.parse_improvement_features(str(export/'IMP_ATR.TXT'),engine='numpy').sample(n=3000,random_state=0,ignore_index=True)
+    df = df.astype({col:object for col in df.select_dtypes(['category']).columns})
+    zips = zips[zips['prop_id'] % 10 != 0]
+    (layout/'IMP_ATR.parquet').mkdir()
+    for i,part in enumerate([df.iloc[:len(df)//3],df.iloc[len(df)//3:]]):
+        tparser.write_parquet(layout/'IMP_ATR.parquet'/f'part.{i:05d}.parquet',part,row_group_offsets=100,write_index=False,
+                              object_encoding='utf8',stats=True)
+    # 6 runs read 83 rows at a time
+    assert tparser._cluster_dataset(str(layout/'IMP_ATR.parquet'),zips,20,500)[0] == len(df)
+
+    df['situs_zip'] = df['prop_id'].map(zips.set_index('prop_id')['situs_zip']).astype(object).replace({np.nan:None})
+    codes = pd.factorize(df['situs_zip'],sort=True)[0]
+    expected = df.take(np.lexsort([df['prop_id'].to_numpy(dtype='int64'),codes])).reset_index(drop=True)
+    pf = fastparquet.ParquetFile(str(layout/'IMP_ATR.parquet'))
+    assert max(row_group.num_rows for row_group in pf.row_groups) <= 500
+    assert [path.name for path in (layout/'IMP_ATR.parquet').glob('[!_]*')] == ['part.00000.parquet']
+    pd.testing.assert_frame_equal(pd.read_parquet(layout/'IMP_ATR.parquet'),expected)
+
+def test_ingest_into_relative_dir(export,layout):
+    # Several parts per table, layout runs the test in tmp_path
+    tables = ['PROP','IMP_INFO']
+    tparser.ingest('export','relout',tables=tables,workers=1,split_size=50_000,chunksize=400,summary=False,lookup=False)
+    tparser.ingest(export,layout/'absout',tables=tables,workers=1,split_size=50_000,chunksize=400,summary=False,lookup=False)
+    for table in tables:
+        pd.testing.assert_frame_equal(read_table(f'relout/{table}.parquet'),read_table(layout/'absout'/f'{table}.parquet'))
+
+def test_incremental_ingest_moves_improvements(export,layout):
+    tparser.ingest(export,layout/'out',workers=1,chunksize=1000,summary=False,lookup=False,incremental=True)
+    moved = shutil.copytree(export,layout/'moved')
+    set_field(moved/'PROP.TXT','PROP','situs_zip',range(0,1000,7),'78799')
+    tparser.ingest(moved,layout/'out',workers=1,chunksize=1000,summary=False,lookup=False,incremental=True)
+    tparser.ingest(moved,layout/'full',workers=1,chunksize=1000,summary=False,lookup=False)
+    for table in tparser.TABLES:
+        pd.testing.assert_frame_equal(_sorted_table(layout/'out'/f'{table}.parquet',table),_sorted_table(layout/'full'/f'{table}.parquet',table))
+    assert len(Selector(layout/'out',zip_codes='78799').imp_atr_df) == len(Selector(layout/'full',zip_codes='78799').imp_atr_df) > 0
+
+def test_hashes_only_stored_for_incremental(export,layout):
+    options = dict(tables=['PROP','IMP_INFO'],workers=1,chunksize=1000,summary=False,lookup=False)
+    tparser.ingest(export,layout/'out',**options)
+    assert not list((layout/'out').glob('*.hashes.parquet'))
+
+    # Tables without hashes are ingested in full the first time
+    changed = shutil.copytree(export,layout/'changed')
+    set_field(changed/'PROP.TXT','PROP','situs_zip',range(0,1000,50),'78799')
+    stats = tparser.ingest(changed,layout/'out',incremental=True,**options)
+    assert stats.loc['PROP','rows'] == 1000 and 'changed' not in stats
+    assert sorted(path.name for path in (layout/'out').glob('*.hashes.parquet')) == ['IMP_INFO.hashes.parquet','PROP.hashes.parquet']
+    assert not list((layout/'out').glob('*.delta'))
+
+    set_field(changed/'PROP.TXT','PROP','situs_zip',range(1,1000,50),'78799')
+    stats = tparser.ingest(changed,layout/'out',incremental=True,**options)
+    assert stats.loc['PROP','changed'] == 20 and list((layout/'out').glob('PROP.delta/*'))
+
+    # A full ingest removes the hashes and deltas of the rows it replaces
+    tparser.ingest(changed,layout/'out',**options)
+    assert not list((layout/'out').glob('*.hashes.parquet')) and not list((layout/'out').glob('*.delta'))